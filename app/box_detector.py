@@ -5,9 +5,11 @@ putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
 putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
 
 import numpy as np
-import cv2
 from .models import load_models, get_emotion_model_details, get_action_model_details, get_face_embedding_model_details
-from .config import EMOTION_LABELS, ACTION_LABELS
+from .config import EMOTION_LABELS, ACTION_LABELS, DETECTION_POLICY
+from .resolution_policy import ResolutionPolicy
+from .preprocess import TensorPlan
+
 
 class Detector:
     """Xử lý nhận diện người, khuôn mặt và cảm xúc / Detection handler"""
@@ -40,16 +42,28 @@ class Detector:
         self.face_embedding_input_shape = self.face_embedding_input_details[0]['shape'] # Thêm dòng này
         self.embedding_size = self.face_embedding_input_shape[-1] # kích thước của vector embedding
 
+        # Kế hoạch tiền xử lý biên dịch 1 lần: buffer cấp phát sẵn + view tensor của interpreter
+        # Preprocessing plans compiled once: preallocated buffers + zero-copy interpreter views
+        self.emotion_plan = TensorPlan(self.emotion_interpreter, self.emotion_input_details[0], self.emotion_output_details[0])
+        self.action_plan = TensorPlan(self.action_interpreter, self.action_input_details[0], self.action_output_details[0])
+        self.face_embedding_plan = TensorPlan(self.face_embedding_interpreter, self.face_embedding_input_details[0], self.face_embedding_output_details[0])
+
         # Lưu trữ mô hình embedding khuôn mặt
         self.emb_model = self.face_embedding_interpreter
+
+        # Preset imgsz mặc định (DETECTION_POLICY); policy có trạng thái nên tạo mới cho mỗi ảnh đơn lẻ
+        # Default preset; policies are stateful, so standalone images get a fresh one per call
+        self.policy_name = DETECTION_POLICY
     
-    def process_frame(self, frame):
+    def process_frame(self, frame, policy=None):
         """
         Xử lý khung hình và trả về kết quả nhận diện.
         Processes a frame and returns the detection results.
 
         Args:
             frame (np.ndarray): Khung hình đầu vào (ảnh). Input frame (image).
+            policy (ResolutionPolicy, optional): Chính sách imgsz của luồng camera; None = ảnh đơn lẻ, quét đầy đủ.
+                                                 Per-stream resolution policy; None treats the frame as standalone.
 
         Returns:
             tuple: Một tuple chứa:
@@ -58,56 +72,151 @@ class Detector:
                    - person_boxes (list): Danh sách các khung người với thông tin hành vi. List of person bounding boxes with action info.
                    - face_boxes (list): Danh sách các khung khuôn mặt với thông tin cảm xúc. List of face bounding boxes with emotion info.
         """
-        try:
-            # Nhận diện người / Detect persons
-            person_results = self.person_model(frame, classes=[0], conf=0.3, iou=0.45, imgsz=640, half=True, verbose=False)
-            
-            person_count = 0
-            face_count = 0
-            face_boxes = []  # Danh sách khung khuôn mặt / Face boxes list
-            person_boxes = []  # Danh sách khung người có thông tin hành vi / Person boxes list with action info
-            
-            if person_results:
-                for person in person_results:
-                    # Lấy tọa độ khung người / Get person boxes
-                    boxes = person.boxes.xyxy.cpu().numpy() #boxes is a numpy array with shape (n,4)
-                    confs = person.boxes.conf.cpu().numpy() #confidence for person box
-                    person_count += len(boxes)
+        return self.process_batch([frame], [policy])[0]
 
-                    # Nhận diện hành vi và lưu thông tin / Detect actions and save info
-                    for i, (box, conf) in enumerate(zip(boxes, confs)):
-                        x1, y1, x2, y2 = map(int, box)
-                        
-                        # Cắt vùng ảnh người để nhận diện hành vi / Get person ROI for action detection
-                        if x1 < x2 and y1 < y2 and x1 >= 0 and y1 >= 0 and x2 <= frame.shape[1] and y2 <= frame.shape[0]:
-                            person_roi = frame[y1:y2, x1:x2]
-                            
-                            # Chỉ xử lý nếu vùng ảnh người hợp lệ / Only process if person ROI is valid
-                            if person_roi.size > 0 and person_roi.shape[0] > 0 and person_roi.shape[1] > 0:
-                                action = self._detect_action(person_roi)
-                            else:
-                                action = "Không xác định"  # Không thể xác định hành vi / Unknown action
-                        else:
-                            action = "Không xác định"
-                        
-                        # Lưu thông tin khung người kèm hành vi / Save person box with action info
-                        person_boxes.append(((x1, y1, x2, y2), float(conf), action))
-                    
-                    # Chuẩn bị vùng quan tâm (ROI) cho khuôn mặt / Prepare ROIs for face detection
-                    valid_rois, valid_indices = self._prepare_rois(frame, boxes)
-                    # Nhận diện khuôn mặt và cảm xúc trong ROI / Detect faces and emotions in ROIs
-                    face_data = self._detect_faces_and_emotions(frame, valid_rois, valid_indices, boxes)
-                    face_count += face_data["count"]
-                    face_boxes.extend(face_data["boxes"])
-            
-            return person_count, face_count, person_boxes, face_boxes
-            
+    def process_batch(self, frames, policies=None):
+        """
+        Xử lý nhiều khung hình (vd. từ nhiều camera) với YOLO chạy theo batch.
+        Processes several frames (e.g. from several cameras) with batched YOLO passes.
+
+        Frame cùng imgsz được gom vào 1 lần predict_batch cho YOLO người, rồi mọi ROI người của
+        mọi frame cùng imgsz được gom vào 1 lần cho YOLO khuôn mặt. Mô hình TFLite (hành vi,
+        cảm xúc, embedding) vẫn chạy từng ảnh.
+        Frames sharing an imgsz share one person predict_batch call; all person ROIs across frames
+        sharing an imgsz share one face predict_batch call. TFLite models still run per image.
+
+        Args:
+            frames (list[np.ndarray]): Các khung hình đầu vào. Input frames.
+            policies (list[ResolutionPolicy], optional): Chính sách imgsz cho từng frame (vd. theo camera);
+                                                         phần tử None = ảnh đơn lẻ. Per-frame policies, None = standalone.
+
+        Returns:
+            list[tuple]: Mỗi frame 1 tuple giống process_frame. One process_frame-style tuple per frame.
+        """
+        policies = list(policies) if policies is not None else [None] * len(frames)
+        policies = [policy or ResolutionPolicy.from_preset(self.policy_name) for policy in policies]
+        # Lỗi ở 1 frame / 1 nhóm chỉ làm hỏng frame đó, không phải cả batch
+        # A failure in one frame or group only blanks that frame, never the whole batch
+        results = [[0, 0, [], []] for _ in frames]
+        failed = set()
+
+        # Nhận diện người, gom theo imgsz / Person detection grouped by imgsz
+        detections = [None] * len(frames)
+        groups = {}
+        for i, frame in enumerate(frames):
+            try:
+                groups.setdefault(policies[i].person_imgsz(frame.shape), []).append(i)
+            except Exception as e:
+                print(f"Error in process_batch (frame {i}): {e}")
+                failed.add(i)
+        for imgsz, idxs in groups.items():
+            try:
+                outputs = self.person_model.predict_batch([frames[i] for i in idxs], conf=0.3, iou=0.45,
+                                                          imgsz=imgsz, classes=[0])
+                for i, output in zip(idxs, outputs):
+                    detections[i] = output
+            except Exception as e:
+                # Cả nhóm lỗi: chạy lại từng frame để tìm frame hỏng / Retry one by one to isolate the bad frame
+                print(f"Error in person batch (imgsz={imgsz}): {e}")
+                for i in idxs:
+                    try:
+                        detections[i] = self.person_model.predict(frames[i], conf=0.3, iou=0.45,
+                                                                   imgsz=imgsz, classes=[0])
+                    except Exception as e:
+                        print(f"Error in process_batch (frame {i}): {e}")
+                        failed.add(i)
+
+        face_groups = {}  # imgsz -> [(frame_idx, roi, person_box)]
+        for i, frame in enumerate(frames):
+            if i in failed:
+                continue
+            try:
+                boxes, confs = detections[i]
+                policies[i].observe_persons(frame.shape, boxes)
+                person_boxes = []  # Danh sách khung người có thông tin hành vi / Person boxes list with action info
+                for box, conf in zip(boxes, confs):
+                    x1, y1, x2, y2 = map(int, box)
+                    action = "Không xác định"  # Không thể xác định hành vi / Unknown action
+                    # Cắt vùng ảnh người để nhận diện hành vi / Get person ROI for action detection
+                    if x1 < x2 and y1 < y2 and x1 >= 0 and y1 >= 0 and x2 <= frame.shape[1] and y2 <= frame.shape[0]:
+                        person_roi = frame[y1:y2, x1:x2]
+                        if person_roi.size > 0:
+                            action = self._detect_action(person_roi)
+                    person_boxes.append(((x1, y1, x2, y2), float(conf), action))
+
+                # Chuẩn bị vùng quan tâm (ROI) cho khuôn mặt / Prepare ROIs for face detection
+                jobs = []
+                rois, indices = self._prepare_rois(frame, boxes)
+                for roi, idx in zip(rois, indices):
+                    if roi.size > 0:
+                        jobs.append((policies[i].face_imgsz(roi.shape), (i, roi, boxes[idx])))
+            except Exception as e:
+                print(f"Error in process_batch (frame {i}): {e}")
+                continue
+            results[i] = [len(boxes), 0, person_boxes, []]
+            for imgsz, job in jobs:
+                face_groups.setdefault(imgsz, []).append(job)
+
+        # Nhận diện khuôn mặt trên mọi ROI, gom theo imgsz / Face detection over all ROIs grouped by imgsz
+        for imgsz, jobs in face_groups.items():
+            try:
+                outputs = self.face_model.predict_batch([roi for _, roi, _ in jobs], conf=0.3, iou=0.45, imgsz=imgsz)
+            except Exception as e:
+                # Nhóm lỗi: thử từng ROI như luồng cũ / Fall back to one ROI at a time like the old path
+                print(f"Error in face batch (imgsz={imgsz}): {e}")
+                outputs = []
+                for _, roi, _ in jobs:
+                    try:
+                        outputs.append(self.face_model.predict(roi, conf=0.3, iou=0.45, imgsz=imgsz))
+                    except Exception as e:
+                        print(f"Error in face ROI: {e}")
+                        outputs.append(([], []))
+            for (i, roi, person_box), (face_xyxy, face_confs) in zip(jobs, outputs):
+                face = self._face_from_detections(roi, person_box, face_xyxy, face_confs)
+                if face is not None:
+                    results[i][1] += 1
+                    results[i][3].append(face)
+
+        return [tuple(result) for result in results]
+
+    def process_face_crop(self, face_img, verify=True, imgsz=160, min_conf=0.3):
+        """
+        Tính embedding cho ảnh khuôn mặt đã được client cắt sẵn (bỏ qua YOLO người).
+        Embeds a face crop produced client-side (skips the person YOLO pass).
+
+        Args:
+            face_img (np.ndarray): Ảnh khuôn mặt đã cắt. Client-cropped face image.
+            verify (bool): Chạy 1 lượt YOLO khuôn mặt ở imgsz nhỏ để xác nhận có mặt và cắt lại sát mặt.
+                           Run one small face-model pass to confirm a face and re-crop tightly to it.
+            imgsz (int): Kích thước ảnh cho lượt xác nhận. Input size for the verification pass.
+            min_conf (float): Confidence tối thiểu của lượt xác nhận. Minimum verification confidence.
+
+        Returns:
+            tuple: (conf, embedding)
+                   - conf (float | None): Confidence của lượt xác nhận, None nếu không xác nhận.
+                     Verification confidence, None when verification was skipped.
+                   - embedding (np.ndarray | None): None nếu không xác nhận được mặt hoặc lỗi.
+                     None when no face was confirmed or on error.
+        """
+        try:
+            conf = None
+            if verify:
+                face_xyxy, face_confs = self.face_model.predict(face_img, conf=min_conf, iou=0.45, imgsz=imgsz)
+                if len(face_confs) == 0:
+                    return None, None
+                # Giống luồng đầy đủ: cắt theo khuôn mặt tốt nhất / Same as the full path: crop to the best face
+                best = int(np.argmax(face_confs))
+                fx1, fy1, fx2, fy2 = map(int, face_xyxy[best])
+                conf = float(face_confs[best])
+                if fx2 > fx1 and fy2 > fy1:
+                    face_img = face_img[max(fy1, 0):fy2, max(fx1, 0):fx2]
+            if face_img.size == 0:
+                return conf, None
+            return conf, self._get_face_embedding(face_img)
         except Exception as e:
-            # Xử lý lỗi tại đây để tránh gây đơ ứng dụng / Handle errors to avoid freezing
-            print(f"Error in process_frame: {e}")
-            # Trả về giá trị mặc định an toàn / Return safe default values
-            return 0, 0, [], []
-    
+            print(f"Error in process_face_crop: {e}")
+            return None, None
+
     def _prepare_rois(self, frame, boxes):
         """
         Chuẩn bị các vùng ảnh hợp lệ từ khung người.
@@ -122,47 +231,40 @@ class Detector:
                 valid_indices.append(i)
         return valid_rois, valid_indices
     
-    def _detect_faces_and_emotions(self, original_frame, rois, indices, boxes):
+    def _face_from_detections(self, roi, person_box, face_xyxy, face_confs):
         """
-        Nhận diện khuôn mặt, cảm xúc và tính toán tọa độ toàn cục.
-        Detects faces and emotions and calculates global coordinates.
+        Chọn khuôn mặt tốt nhất trong 1 ROI người, tính cảm xúc, embedding và tọa độ toàn cục.
+        Picks the best face in one person ROI and computes emotion, embedding and global coordinates.
 
         Args:
-            original_frame (np.ndarray): Khung hình gốc. Original frame.
-            rois (list): Danh sách các vùng ảnh (ROI). List of image regions (ROIs).
-            indices (list): Danh sách các chỉ số tương ứng với các khung người. List of indices corresponding to person boxes.
-            boxes (np.ndarray): Mảng các khung người. Array of person bounding boxes.
+            roi (np.ndarray): Vùng ảnh người. Person image region.
+            person_box (array-like): Khung người (x1, y1, x2, y2) trong frame. Person box in the frame.
+            face_xyxy, face_confs: Kết quả YOLO khuôn mặt trên ROI. Face YOLO output for the ROI.
 
         Returns:
-            dict: Một dictionary chứa:
-                  - count (int): Số lượng khuôn mặt được nhận diện. Number of detected faces.
-                  - boxes (list): Danh sách các khung khuôn mặt với thông tin cảm xúc. List of face bounding boxes with emotion info.
+            tuple | None: (global_box, conf, emotion, embedding) hoặc None nếu không có mặt hợp lệ.
+                          The face entry, or None when no valid face was found.
         """
-        face_boxes, face_count = [], 0
-        for roi_idx, roi in enumerate(rois):
-            try:
-                result = self.face_model(roi, conf=0.3, iou=0.45, imgsz=160, half=True, verbose=False)[0]
-                if not result.boxes:
-                    continue
-                # Chỉ lấy khuôn mặt có confidence cao nhất / Select the single best face
-                best = max(result.boxes, key=lambda b: float(b.conf.cpu().numpy()))
-                fx1,fy1,fx2,fy2 = map(int, best.xyxy[0].cpu().numpy())
-                conf = float(best.conf[0].cpu().numpy())
-                px1,py1 = int(boxes[indices[roi_idx]][0]), int(boxes[indices[roi_idx]][1])
-                # Crop face region
-                face_roi = roi[fy1:fy2, fx1:fx2] if fx2>fx1 and fy2>fy1 else None
-                if face_roi is None or face_roi.size==0:
-                    continue
-                emotion = self._detect_emotion(face_roi)
-                embedding = self._get_face_embedding(face_roi)
-                global_box = (px1+fx1, py1+fy1, px1+fx2, py1+fy2)
-                face_boxes.append((global_box, conf, emotion, embedding))
-                face_count += 1
-            except Exception as e:
-                print(f"Error in face ROI {roi_idx}: {e}")
-                continue
-        return {'count': face_count, 'boxes': face_boxes}
-    
+        try:
+            if len(face_confs) == 0:
+                return None
+            # Chỉ lấy khuôn mặt có confidence cao nhất / Select the single best face
+            best = int(np.argmax(face_confs))
+            fx1, fy1, fx2, fy2 = map(int, face_xyxy[best])
+            conf = float(face_confs[best])
+            px1, py1 = int(person_box[0]), int(person_box[1])
+            # Crop face region
+            face_roi = roi[fy1:fy2, fx1:fx2] if fx2 > fx1 and fy2 > fy1 else None
+            if face_roi is None or face_roi.size == 0:
+                return None
+            emotion = self._detect_emotion(face_roi)
+            embedding = self._get_face_embedding(face_roi)
+            global_box = (px1 + fx1, py1 + fy1, px1 + fx2, py1 + fy2)
+            return (global_box, conf, emotion, embedding)
+        except Exception as e:
+            print(f"Error in face ROI: {e}")
+            return None
+
     def _detect_emotion(self, face_img):
         """
         Phát hiện cảm xúc từ ảnh khuôn mặt sử dụng mô hình TFLite
@@ -175,46 +277,12 @@ class Detector:
             str: Nhãn cảm xúc dự đoán / Predicted emotion label
         """
         try:
-            # Tiền xử lý ảnh khuôn mặt cho mô hình cảm xúc / Preprocess face image for emotion model
-            
-            # Kiểm tra xem cần chuyển sang ảnh xám không / Check if grayscale is needed
-            if self.emotion_input_shape[-1] == 1:
-                face_img = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
-            
-            # Thay đổi kích thước ảnh theo yêu cầu đầu vào / Resize to expected input dimensions
-            resized_face = cv2.resize(face_img, (self.emotion_width, self.emotion_height))
-            
-            # Kiểm tra kiểu dữ liệu đầu vào từ chi tiết / Check input type from details
-            input_dtype = self.emotion_input_details[0]['dtype']
-            
-            # Xử lý tùy thuộc vào kiểu dữ liệu đầu vào / Process based on input data type
-            if input_dtype == np.float32:
-                # Chuẩn hóa giá trị pixel cho mô hình float / Normalize pixel values for float models
-                normalized_face = resized_face.astype(np.float32) / 255.0
-            elif input_dtype == np.uint8:
-                # Đối với mô hình lượng tử hóa, giữ nguyên dạng uint8 / For quantized models, keep as uint8
-                normalized_face = resized_face.astype(np.uint8)
-            else:
-                # Mặc định chuẩn hóa kiểu float32 / Default to float32 normalization
-                normalized_face = resized_face.astype(np.float32) / 255.0
-            
-            # Thay đổi hình dạng để phù hợp với đầu vào / Reshape to match input tensor shape
-            if self.emotion_input_shape[-1] == 1:
-                input_tensor = normalized_face.reshape(1, self.emotion_height, self.emotion_width, 1)
-            else:
-                input_tensor = normalized_face.reshape(1, self.emotion_height, self.emotion_width, 3)
-            
-            # Đặt tensor đầu vào / Set input tensor
-            self.emotion_interpreter.set_tensor(self.emotion_input_details[0]['index'], input_tensor)
-            
-            # Chạy suy luận / Run inference
-            self.emotion_interpreter.invoke()
-            
-            # Lấy tensor đầu ra / Get output tensor
-            output_tensor = self.emotion_interpreter.get_tensor(self.emotion_output_details[0]['index'])
+            # Resize / grayscale / chuẩn hóa vào buffer sẵn có rồi chạy suy luận
+            # Resize, grayscale and normalize into preallocated buffers, then run inference
+            output_tensor = self.emotion_plan.run(face_img)
             
             # Lấy cảm xúc dự đoán / Get predicted emotion
-            emotion_idx = np.argmax(output_tensor)
+            emotion_idx = int(np.argmax(output_tensor))
             
             # Đảm bảo chỉ số nằm trong giới hạn của danh sách nhãn / Ensure index is within range of labels
             if 0 <= emotion_idx < len(EMOTION_LABELS):
@@ -240,49 +308,12 @@ class Detector:
             str: Nhãn hành vi dự đoán / Predicted action label
         """
         try:
-            # Thay đổi kích thước ảnh theo yêu cầu đầu vào / Resize to expected input dimensions
-            resized_person = cv2.resize(person_img, (self.action_width, self.action_height))
-            
-            # Kiểm tra số kênh màu đầu vào / Check input channels
-            expected_channels = self.action_input_shape[-1]
-            
-            # Chuyển đổi sang ảnh xám nếu cần / Convert to grayscale if needed
-            if expected_channels == 1:
-                processed_person = cv2.cvtColor(resized_person, cv2.COLOR_BGR2GRAY)
-            else:
-                processed_person = resized_person
-            
-            # Kiểm tra kiểu dữ liệu đầu vào từ chi tiết / Check input type from details
-            input_dtype = self.action_input_details[0]['dtype']
-            
-            # Xử lý tùy thuộc vào kiểu dữ liệu đầu vào / Process based on input data type
-            if input_dtype == np.float32:
-                # Chuẩn hóa giá trị pixel cho mô hình float / Normalize pixel values for float models
-                normalized_person = processed_person.astype(np.float32) / 255.0
-            elif input_dtype == np.uint8:
-                # Đối với mô hình lượng tử hóa, giữ nguyên dạng uint8 / For quantized models, keep as uint8
-                normalized_person = processed_person.astype(np.uint8)
-            else:
-                # Mặc định chuẩn hóa kiểu float32 / Default to float32 normalization
-                normalized_person = processed_person.astype(np.float32) / 255.0
-            
-            # Thay đổi hình dạng để phù hợp với đầu vào / Reshape to match input tensor shape
-            if expected_channels == 1:
-                input_tensor = normalized_person.reshape(1, self.action_height, self.action_width, 1)
-            else:
-                input_tensor = normalized_person.reshape(1, self.action_height, self.action_width, expected_channels)
-            
-            # Đặt tensor đầu vào / Set input tensor
-            self.action_interpreter.set_tensor(self.action_input_details[0]['index'], input_tensor)
-            
-            # Chạy suy luận / Run inference
-            self.action_interpreter.invoke()
-            
-            # Lấy tensor đầu ra / Get output tensor
-            output_tensor = self.action_interpreter.get_tensor(self.action_output_details[0]['index'])
+            # Resize / grayscale / chuẩn hóa vào buffer sẵn có rồi chạy suy luận
+            # Resize, grayscale and normalize into preallocated buffers, then run inference
+            output_tensor = self.action_plan.run(person_img)
             
             # Lấy hành vi dự đoán / Get predicted action
-            action_idx = np.argmax(output_tensor)
+            action_idx = int(np.argmax(output_tensor))
             
             # Đảm bảo chỉ số nằm trong giới hạn của danh sách nhãn / Ensure index is within range of labels
             if 0 <= action_idx < len(ACTION_LABELS):
@@ -297,24 +328,12 @@ class Detector:
             return "Không xác định"
 
     def _get_face_embedding(self, face_img):
+        """
+        Tính vector embedding khuôn mặt (np.ndarray float32, bản sao riêng).
+        Computes the face embedding as an owned float32 NumPy array.
+        """
         try:
-            resized_face = cv2.resize(face_img, (self.face_embedding_input_shape[1], self.face_embedding_input_shape[2])) # Sử dụng kích thước từ mô hình
-            
-            # Kiểm tra kiểu dữ liệu đầu vào của mô hình embedding
-            input_dtype = self.face_embedding_input_details[0]['dtype']
-            if input_dtype == np.float32:
-                normalized_face = resized_face.astype(np.float32) / 255.0
-            elif input_dtype == np.uint8:
-                normalized_face = resized_face.astype(np.uint8)
-            else:
-                normalized_face = resized_face.astype(np.float32) / 255.0
-                
-            input_tensor = np.expand_dims(normalized_face, axis=0)
-            
-            self.emb_model.set_tensor(self.face_embedding_input_details[0]['index'], input_tensor)
-            self.emb_model.invoke()
-            embedding = self.emb_model.get_tensor(self.face_embedding_output_details[0]['index'])[0].tolist()
-            return embedding
+            return self.face_embedding_plan.run_float(face_img)
         except Exception as e:
             print(f"Error getting face embedding: {e}")
-            return None
\ No newline at end of file
+            return None
@@ -1,3 +1,5 @@
+import os
+
 # Đường dẫn mô hình / Model paths
 PERSON_MODEL_PATH = './models/yolov8n-person-lw.pt'
 FACE_MODEL_PATH = './models/yolov8p-face-v2.pt'
@@ -6,10 +8,44 @@ ACTION_MODEL_PATH = './models/human_action_recognition_model.tflite'
 # Đường dẫn mô hình / Model paths
 PERSON_MODEL_PATH = './models/yolov8n-person-lw.pt'
 FACE_MODEL_PATH = './models/yolov8p-face-v2.pt'
-EMOTION_MODEL_PATH = './models/emotion_model_2.tflite'
-ACTION_MODEL_PATH = './models/human_action_recognition_model.tflite'
+# Có thể trỏ sang bản INT8 (scripts/quantize_int8.py) qua biến môi trường
+# Can be pointed at INT8 builds (scripts/quantize_int8.py) via environment variables
+EMOTION_MODEL_PATH = os.getenv('EMOTION_MODEL_PATH', './models/emotion_model_2.tflite')
+ACTION_MODEL_PATH = os.getenv('ACTION_MODEL_PATH', './models/human_action_recognition_model.tflite')
+EMBED_TFLITE_MODEL_PATH = os.getenv('EMBED_TFLITE_MODEL_PATH', './models/face_embedding_model_256.tflite')
 EMBED_MODEL_PATH = './models/face_embedding_model_128.h5'
 
+# Backend chạy YOLO: 'ultralytics' (torch, file .pt) hoặc 'onnxruntime' (CPU, file .onnx)
+# YOLO execution backend: 'ultralytics' (torch, .pt) or 'onnxruntime' (CPU, .onnx)
+DETECTOR_BACKEND = os.getenv('DETECTOR_BACKEND', 'ultralytics')
+PERSON_ONNX_MODEL_PATH = os.getenv('PERSON_ONNX_MODEL_PATH', './models/yolov8n-person-lw.onnx')
+FACE_ONNX_MODEL_PATH = os.getenv('FACE_ONNX_MODEL_PATH', './models/yolov8p-face-v2.onnx')
+ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))  # 0 = để ONNX Runtime tự chọn
+
+# Gói chạy TFLite: auto | tflite_runtime | ai_edge_litert | tensorflow (xem app/tflite_loader.py)
+# TFLite interpreter package used when serving
+TFLITE_PROVIDER = os.getenv('TFLITE_PROVIDER', 'auto')
+
+# Tự chọn num_threads / XNNPACK cho TFLite (xem app/tflite_autotune.py): off | cache | on | force
+# TFLite thread/XNNPACK autotuning mode and the concurrency it tunes for (defaults to the worker count)
+TFLITE_AUTOTUNE = os.getenv('TFLITE_AUTOTUNE', 'cache')
+TFLITE_AUTOTUNE_CONCURRENCY = int(os.getenv('TFLITE_AUTOTUNE_CONCURRENCY', os.getenv('WEB_CONCURRENCY', '1')))
+TFLITE_TUNING_CACHE_PATH = os.getenv('TFLITE_TUNING_CACHE_PATH', './models/.tflite_tuning.json')
+
+# Chính sách chọn imgsz cho YOLO (xem app/resolution_policy.py): fixed | recall | balanced | latency
+# Detector input-resolution policy preset
+DETECTION_POLICY = os.getenv('DETECTION_POLICY', 'balanced')
+
+# Số camera_id tối đa giữ trạng thái riêng (policy imgsz, motion gate); camera_id do client gửi lên
+# Max camera_ids with per-camera state kept in memory (least recently used are evicted)
+CAMERA_REGISTRY_MAX = int(os.getenv('CAMERA_REGISTRY_MAX', '64'))
+
+# Cổng chuyển động cho frame preview (xem app/motion_gate.py) / Motion gate for preview frames
+# MOTION_GATE_CAMERAS: JSON ghi đè theo camera, vd. {"kiosk-1": {"motion_ratio": 0.02, "idle_result": "empty"}}
+MOTION_GATE_ENABLED = os.getenv('MOTION_GATE_ENABLED', '0').lower() in ('1', 'true', 'yes')
+MOTION_GATE_IDLE_RESULT = os.getenv('MOTION_GATE_IDLE_RESULT', 'previous')  # previous | empty
+MOTION_GATE_CAMERAS = os.getenv('MOTION_GATE_CAMERAS', '')
+
 # Thiết lập hiển thị / Visualization settings
 PERSON_COLOR = (0, 0, 255)   # Màu đỏ / Red color
 FACE_COLOR = (0, 255, 0)     # Màu xanh lá / Green color
@@ -0,0 +1,197 @@
+"""
+Backend chạy mô hình YOLO (người / khuôn mặt) / YOLO detector execution backends.
+
+- UltralyticsBackend: Ultralytics trên torch (mặc định, dùng file .pt)
+- OnnxRuntimeBackend: ONNX Runtime CPU, tiền xử lý / hậu xử lý / NMS bằng NumPy,
+  không cần import torch (file .onnx xuất bởi scripts/export_yolo_onnx.py)
+
+Cả hai có cùng giao diện / Both expose the same interface:
+    predict(image, conf, iou, imgsz, classes=None) -> (boxes_xyxy, confs)
+    predict_batch(images, conf, iou, imgsz, classes=None) -> [(boxes_xyxy, confs), ...]
+với boxes_xyxy là mảng float32 (N, 4) theo tọa độ ảnh gốc, confs là float32 (N,).
+"""
+
+import numpy as np
+import cv2
+
+from .config import (
+    DETECTOR_BACKEND,
+    ONNX_INTRA_OP_THREADS,
+    PERSON_MODEL_PATH,
+    FACE_MODEL_PATH,
+    PERSON_ONNX_MODEL_PATH,
+    FACE_ONNX_MODEL_PATH,
+)
+
+_EMPTY_BOXES = np.zeros((0, 4), dtype=np.float32)
+_EMPTY_CONFS = np.zeros((0,), dtype=np.float32)
+
+
+class UltralyticsBackend:
+    """Chạy YOLO qua Ultralytics / torch."""
+
+    name = "ultralytics"
+
+    def __init__(self, weights_path):
+        import torch
+        from ultralytics import YOLO
+        self.model = YOLO(weights_path)
+        # half=True chỉ có tác dụng trên GPU / half precision only helps on CUDA
+        self.half = torch.cuda.is_available()
+
+    def _unpack(self, result):
+        if result.boxes is None or len(result.boxes) == 0:
+            return _EMPTY_BOXES, _EMPTY_CONFS
+        return (result.boxes.xyxy.cpu().numpy().astype(np.float32),
+                result.boxes.conf.cpu().numpy().astype(np.float32))
+
+    def predict(self, image, conf, iou, imgsz, classes=None):
+        return self.predict_batch([image], conf, iou, imgsz, classes)[0]
+
+    def predict_batch(self, images, conf, iou, imgsz, classes=None):
+        results = self.model(list(images), classes=classes, conf=conf, iou=iou, imgsz=imgsz,
+                             half=self.half, verbose=False)
+        return [self._unpack(r) for r in results]
+
+
+def letterbox(image, new_shape, stride=32, auto=True, color=(114, 114, 114)):
+    """
+    Resize giữ tỉ lệ + pad giống Ultralytics. Trả về (ảnh, gain, (pad_x, pad_y)).
+    Ultralytics-style letterbox; with auto=True padding is only up to a stride multiple.
+    """
+    h, w = image.shape[:2]
+    gain = min(new_shape[0] / h, new_shape[1] / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    pad_w, pad_h = new_shape[1] - new_w, new_shape[0] - new_h
+    if auto:
+        pad_w, pad_h = pad_w % stride, pad_h % stride
+    pad_x, pad_y = pad_w / 2, pad_h / 2
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return image, gain, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """NMS bằng NumPy, trả về chỉ số giữ lại theo thứ tự score giảm dần / NumPy NMS."""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1).clip(0) * (y2 - y1).clip(0)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+        h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class OnnxRuntimeBackend:
+    """
+    Chạy YOLOv8 đã export ONNX trên CPU bằng ONNX Runtime.
+    Output YOLOv8: (B, 4 + num_classes, N) với box dạng cx, cy, w, h.
+    """
+
+    name = "onnxruntime"
+    max_det = 300
+    max_wh = 7680  # offset theo lớp cho NMS đa lớp / class offset for batched NMS
+
+    def __init__(self, onnx_path, intra_op_threads=0):
+        """onnx_path: đường dẫn file .onnx hoặc bytes của mô hình / path or serialized model bytes."""
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.output_name = self.session.get_outputs()[0].name
+        # Model export với dynamic=True có H, W dạng chuỗi / dynamic axes are strings
+        height, width = model_input.shape[2], model_input.shape[3]
+        self.fixed_shape = (height, width) if isinstance(height, int) and isinstance(width, int) else None
+        batch = model_input.shape[0]
+        self.fixed_batch = batch if isinstance(batch, int) else None
+
+    def _target_shape(self, imgsz):
+        if self.fixed_shape:
+            return self.fixed_shape, False
+        return (imgsz, imgsz), True
+
+    def _preprocess(self, images, imgsz):
+        new_shape, auto = self._target_shape(imgsz)
+        padded, metas = [], []
+        for image in images:
+            img, gain, pad = letterbox(image, new_shape, auto=auto)
+            padded.append(img)
+            metas.append((gain, pad, image.shape[:2]))
+        if auto and len({p.shape for p in padded}) > 1:
+            # Batch cần cùng kích thước / a batch needs one shape
+            h = max(p.shape[0] for p in padded)
+            w = max(p.shape[1] for p in padded)
+            padded = [cv2.copyMakeBorder(p, 0, h - p.shape[0], 0, w - p.shape[1], cv2.BORDER_CONSTANT,
+                                         value=(114, 114, 114)) for p in padded]
+        blob = np.stack(padded)[..., ::-1].transpose(0, 3, 1, 2)  # BGR->RGB, NHWC->NCHW
+        blob = np.ascontiguousarray(blob, dtype=np.float32)
+        blob *= 1.0 / 255.0
+        return blob, metas
+
+    def _postprocess(self, pred, meta, conf, iou, classes):
+        pred = pred.T  # (N, 4 + nc)
+        class_scores = pred[:, 4:]
+        if classes is not None:
+            mask = np.zeros(class_scores.shape[1], dtype=bool)
+            mask[list(classes)] = True
+            class_scores = np.where(mask, class_scores, 0.0)
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        keep = scores > conf
+        if not np.any(keep):
+            return _EMPTY_BOXES, _EMPTY_CONFS
+        xywh, scores, class_ids = pred[keep, :4], scores[keep], class_ids[keep]
+        boxes = np.empty_like(xywh)
+        boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+        boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+
+        keep = nms(boxes + (class_ids * self.max_wh)[:, None], scores, iou)[: self.max_det]
+        boxes, scores = boxes[keep], scores[keep]
+
+        gain, (pad_x, pad_y), (orig_h, orig_w) = meta
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / gain).clip(0, orig_w)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / gain).clip(0, orig_h)
+        return boxes.astype(np.float32), scores.astype(np.float32)
+
+    def predict(self, image, conf, iou, imgsz, classes=None):
+        return self.predict_batch([image], conf, iou, imgsz, classes)[0]
+
+    def predict_batch(self, images, conf, iou, imgsz, classes=None):
+        if not len(images):
+            return []
+        if self.fixed_batch and self.fixed_batch != len(images):
+            # Model batch cố định: chạy từng ảnh / static batch model: run one by one
+            return [r for image in images for r in self.predict_batch([image], conf, iou, imgsz, classes)]
+        blob, metas = self._preprocess(images, imgsz)
+        preds = self.session.run([self.output_name], {self.input_name: blob})[0]
+        return [self._postprocess(pred, meta, conf, iou, classes) for pred, meta in zip(preds, metas)]
+
+
+def create_detector_backend(kind, backend=None, model_content=None):
+    """
+    Tạo backend cho mô hình 'person' hoặc 'face' theo cấu hình DETECTOR_BACKEND.
+    Creates the configured backend for the 'person' or 'face' detector.
+
+    model_content: bytes .onnx đã đọc sẵn (chỉ với onnxruntime) / preloaded ONNX bytes.
+    """
+    backend = backend or DETECTOR_BACKEND
+    if backend == "ultralytics":
+        return UltralyticsBackend(PERSON_MODEL_PATH if kind == "person" else FACE_MODEL_PATH)
+    if backend == "onnxruntime":
+        path = PERSON_ONNX_MODEL_PATH if kind == "person" else FACE_ONNX_MODEL_PATH
+        return OnnxRuntimeBackend(model_content or path, intra_op_threads=ONNX_INTRA_OP_THREADS)
+    raise ValueError(f"DETECTOR_BACKEND không hợp lệ: {backend} (ultralytics | onnxruntime)")
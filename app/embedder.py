@@ -0,0 +1,47 @@
+"""
+Trích embedding khuôn mặt theo batch cho các tác vụ offline (nạp gallery, đánh giá).
+Batched face-embedding extraction for offline jobs (gallery ingestion, evaluation).
+
+Resize tensor đầu vào của mô hình embedding TFLite về [batch_size, H, W, C] để 1 lần
+invoke xử lý nhiều crop. Mô hình convert với batch cố định không resize được thì tự
+lùi về batch 1.
+"""
+
+import numpy as np
+
+from .config import EMBED_TFLITE_MODEL_PATH
+from .tflite_loader import load_interpreter
+from .preprocess import TensorPlan
+
+
+class BatchEmbedder:
+    """Embedding cho danh sách crop khuôn mặt BGR / Embeds lists of BGR face crops."""
+
+    def __init__(self, model_path=EMBED_TFLITE_MODEL_PATH, batch_size=32, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = load_interpreter(model_path, num_threads=num_threads)
+        input_detail = self.interpreter.get_input_details()[0]
+        if batch_size != input_detail['shape'][0]:
+            try:
+                self.interpreter.resize_tensor_input(
+                    input_detail['index'], [batch_size, *input_detail['shape'][1:]], strict=True
+                )
+                self.interpreter.allocate_tensors()
+            except (RuntimeError, ValueError) as e:
+                print(f"[Embedder] Mô hình không chạy được batch {batch_size} ({e}), dùng batch 1")
+                self.interpreter = load_interpreter(model_path, num_threads=num_threads)
+        self.plan = TensorPlan(
+            self.interpreter,
+            self.interpreter.get_input_details()[0],
+            self.interpreter.get_output_details()[0],
+        )
+        self.batch_size = self.plan.batch_size
+        self.dim = int(self.interpreter.get_output_details()[0]['shape'][-1])
+
+    def embed(self, crops):
+        """Trả về ma trận float32 (len(crops), dim) / Returns a float32 (N, dim) matrix."""
+        out = np.empty((len(crops), self.dim), dtype=np.float32)
+        for start in range(0, len(crops), self.batch_size):
+            chunk = crops[start:start + self.batch_size]
+            out[start:start + len(chunk)] = self.plan.run_batch_float(chunk).reshape(len(chunk), -1)
+        return out
@@ -1,34 +1,90 @@
-from ultralytics import YOLO
-import tensorflow as tf
-from tensorflow.keras import layers, Model
-from .config import PERSON_MODEL_PATH, FACE_MODEL_PATH, EMOTION_MODEL_PATH, ACTION_MODEL_PATH, EMBED_MODEL_PATH
+import numpy as np
+from .config import (
+    EMOTION_MODEL_PATH, ACTION_MODEL_PATH, EMBED_TFLITE_MODEL_PATH,
+    DETECTOR_BACKEND, PERSON_ONNX_MODEL_PATH, FACE_ONNX_MODEL_PATH,
+)
+from .detector_backends import create_detector_backend
+from .tflite_loader import load_interpreter
+from .tflite_autotune import resolve_interpreter_settings
+
+# Mô hình đã tải sẵn ở process cha trước khi fork (xem backend/prefork.py)
+# Models preloaded by the parent before fork; workers read them copy-on-write
+_preloaded = {}
+
+
+def _tflite_paths():
+    return {
+        "emotion": EMOTION_MODEL_PATH,
+        "action": ACTION_MODEL_PATH,
+        "embedding": EMBED_TFLITE_MODEL_PATH,
+    }
+
+
+def preload_models():
+    """
+    Đọc trọng số vào bộ nhớ ở process cha, CHƯA tạo interpreter / session (không an toàn khi fork).
+    Reads model weights into memory in the parent without creating interpreters or sessions.
+
+    - TFLite: bytes của file .tflite, worker tạo interpreter từ model_content (không copy buffer)
+    - ONNX Runtime: bytes của file .onnx, worker tạo InferenceSession sau fork
+    - Ultralytics: đối tượng YOLO đã load trọng số (chưa chạy suy luận nên chưa có thread pool)
+    - Cấu hình num_threads / XNNPACK: autotune 1 lần ở cha thay vì N lần ở các worker
+    """
+    _preloaded["settings"] = resolve_interpreter_settings(_tflite_paths())
+    for path in _tflite_paths().values():
+        with open(path, "rb") as f:
+            _preloaded[path] = f.read()
+    if DETECTOR_BACKEND == "onnxruntime":
+        for kind, path in (("person", PERSON_ONNX_MODEL_PATH), ("face", FACE_ONNX_MODEL_PATH)):
+            with open(path, "rb") as f:
+                _preloaded[kind] = f.read()
+    else:
+        _preloaded["person"] = create_detector_backend("person")
+        _preloaded["face"] = create_detector_backend("face")
+    return sum(len(v) for v in _preloaded.values() if isinstance(v, bytes))
+
+
+def _detector_backend(kind):
+    model = _preloaded.get(kind)
+    if model is None:
+        return create_detector_backend(kind)
+    if isinstance(model, bytes):
+        return create_detector_backend(kind, model_content=model)
+    return model
+
 
 def load_models():
     """
     Tải mô hình YOLO cho nhận diện người và khuôn mặt, mô hình TFLite cho nhận diện cảm xúc và hành vi,
-    và mô hình TensorFlow/Keras cho trích xuất embedding khuôn mặt.
+    và mô hình TFLite cho trích xuất embedding khuôn mặt.
     / Load YOLO models for person and face detection, TFLite models for emotion and action recognition,
-    and TensorFlow/Keras model for face embedding extraction.
+    and TFLite model for face embedding extraction.
     """
-    # Tải mô hình YOLO / Load YOLO models
-    person_model = YOLO(PERSON_MODEL_PATH)   # Mô hình nhận diện người / Person model
-    face_model = YOLO(FACE_MODEL_PATH)       # Mô hình nhận diện khuôn mặt / Face model
+    # Tải mô hình YOLO theo backend cấu hình / Load YOLO models with the configured backend
+    person_model = _detector_backend("person")   # Mô hình nhận diện người / Person model
+    face_model = _detector_backend("face")       # Mô hình nhận diện khuôn mặt / Face model
     
+    # Cấu hình num_threads / XNNPACK từ cache autotune / Thread and delegate settings from the tuning cache
+    settings = _preloaded.get("settings") or resolve_interpreter_settings(_tflite_paths())
+
     # Tải mô hình nhận diện cảm xúc TensorFlow Lite / Load TFLite emotion recognition model
-    emotion_interpreter = tf.lite.Interpreter(model_path=EMOTION_MODEL_PATH)
-    emotion_interpreter.allocate_tensors()
+    emotion_interpreter = _load_tflite(EMOTION_MODEL_PATH, settings["emotion"])
     
     # Tải mô hình nhận diện hành vi TensorFlow Lite / Load TFLite action recognition model
-    action_interpreter = tf.lite.Interpreter(model_path=ACTION_MODEL_PATH)
-    action_interpreter.allocate_tensors()
+    action_interpreter = _load_tflite(ACTION_MODEL_PATH, settings["action"])
 
     # Tải mô hình TensorFlow Lite cho trích xuất embedding khuôn mặt
     # Load TensorFlow Lite model for face embedding extraction
-    face_embedding_interpreter = tf.lite.Interpreter(model_path='models/face_embedding_model_256.tflite') # Đổi đường dẫn nếu cần
-    face_embedding_interpreter.allocate_tensors()
+    face_embedding_interpreter = _load_tflite(EMBED_TFLITE_MODEL_PATH, settings["embedding"])
 
     return person_model, face_model, emotion_interpreter, action_interpreter, face_embedding_interpreter
 
+def _load_tflite(path, settings):
+    content = _preloaded.get(path)
+    if content is not None:
+        return load_interpreter(model_content=content, **settings)
+    return load_interpreter(path, **settings)
+
 def get_emotion_model_details(interpreter):
     """Lấy thông tin đầu vào và đầu ra của mô hình cảm xúc
     / Get input and output details for the emotion model"""
@@ -48,4 +104,17 @@ def get_face_embedding_model_details(interpreter):
     / Get input and output details for the face embedding model"""
     input_details = interpreter.get_input_details()
     output_details = interpreter.get_output_details()
-    return input_details, output_details
\ No newline at end of file
+    return input_details, output_details
+
+def get_quantization_params(tensor_detail):
+    """
+    Lấy (scale, zero_point) của tensor lượng tử hóa, hoặc None nếu là tensor float.
+    / Get (scale, zero_point) of a quantized tensor, or None for float tensors.
+    """
+    if tensor_detail['dtype'] not in (np.uint8, np.int8):
+        return None
+    scale, zero_point = tensor_detail['quantization']
+    if not scale:
+        # Tensor nguyên nhưng không có tham số lượng tử / Integer tensor without quantization params
+        return None
+    return float(scale), int(zero_point)
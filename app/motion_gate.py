@@ -0,0 +1,186 @@
+"""
+Cổng chuyển động đặt trước Detector.process_frame cho camera kiosk.
+Motion gate in front of Detector.process_frame for mostly-idle kiosk cameras.
+
+Mỗi frame được thu nhỏ (mặc định rộng 64 px), chuyển xám và làm mờ rồi so với frame
+tham chiếu (frame cuối cùng đã chạy nhận diện đầy đủ). Nếu tỉ lệ pixel thay đổi nhỏ hơn
+`motion_ratio` thì bỏ qua toàn bộ cascade người -> khuôn mặt -> cảm xúc / embedding và
+trả về kết quả trước đó (hoặc kết quả rỗng). Nhận diện đầy đủ chạy lại khi:
+  - có chuyển động (kể cả người mới bước vào khung hình),
+  - còn trong `hold_frames` frame sau lần chuyển động cuối (người vừa đứng yên),
+  - đến nhịp heartbeat (`heartbeat_frames` frame hoặc `heartbeat_seconds` giây).
+So với frame tham chiếu (không phải frame liền trước) nên thay đổi chậm vẫn cộng dồn
+và cuối cùng kích hoạt nhận diện.
+Dữ liệu tính thêm từ kết quả (vd. similar_faces tra trong DB) gắn vào kết quả cache bằng
+annotate() để frame bị bỏ qua không phải tra lại.
+"""
+
+import json
+import time
+import threading
+from collections import Counter, OrderedDict
+
+import cv2
+import numpy as np
+
+from .config import MOTION_GATE_ENABLED, MOTION_GATE_IDLE_RESULT, MOTION_GATE_CAMERAS, CAMERA_REGISTRY_MAX
+
+EMPTY_RESULT = (0, 0, [], [])
+
+DEFAULTS = dict(
+    enabled=MOTION_GATE_ENABLED,
+    width=64,               # chiều rộng ảnh thu nhỏ / downscaled width
+    pixel_threshold=18,     # chênh lệch xám tối thiểu để tính là thay đổi / per-pixel diff threshold
+    motion_ratio=0.01,      # tỉ lệ pixel thay đổi để coi là có chuyển động / changed-pixel fraction
+    hold_frames=5,          # số frame vẫn nhận diện sau chuyển động / frames kept hot after motion
+    heartbeat_frames=30,    # 0 = tắt / 0 disables
+    heartbeat_seconds=10.0,  # 0 = tắt / 0 disables
+    idle_result=MOTION_GATE_IDLE_RESULT,
+)
+
+
+class MotionGate:
+    """Cổng chuyển động cho 1 camera / Motion gate state for a single camera."""
+
+    def __init__(self, camera_id="default", **options):
+        unknown = set(options) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Tùy chọn motion gate không hợp lệ: {', '.join(sorted(unknown))}")
+        settings = {**DEFAULTS, **options}
+        if settings["idle_result"] not in ("previous", "empty"):
+            raise ValueError(f"idle_result không hợp lệ: {settings['idle_result']} (previous | empty)")
+        self.camera_id = camera_id
+        self.enabled = bool(settings["enabled"])
+        self.width = int(settings["width"])
+        self.pixel_threshold = int(settings["pixel_threshold"])
+        self.motion_ratio = float(settings["motion_ratio"])
+        self.hold_frames = int(settings["hold_frames"])
+        self.heartbeat_frames = int(settings["heartbeat_frames"])
+        self.heartbeat_seconds = float(settings["heartbeat_seconds"])
+        self.idle_result = settings["idle_result"]
+
+        self._lock = threading.Lock()
+        self._reference = None
+        self._last_result = EMPTY_RESULT
+        self._annotation = None
+        self._frames_since_detect = 0
+        self._last_detect_time = 0.0
+        self._hold_left = 0
+        self.frames = 0
+        self.skipped = 0
+        self.reasons = Counter()
+        self.last_motion = 0.0
+
+    def _signature(self, frame):
+        """Ảnh xám thu nhỏ + làm mờ để so sánh / Small blurred grayscale thumbnail."""
+        h, w = frame.shape[:2]
+        height = max(1, int(round(h * self.width / float(w))))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _decide(self, signature):
+        """Trả về lý do cần nhận diện đầy đủ, hoặc None nếu có thể bỏ qua."""
+        if self._reference is None or self._reference.shape != signature.shape:
+            return "first_frame"
+        diff = cv2.absdiff(signature, self._reference)
+        self.last_motion = np.count_nonzero(diff > self.pixel_threshold) / float(diff.size)
+        if self.last_motion >= self.motion_ratio:
+            self._hold_left = self.hold_frames
+            return "motion"
+        if self._hold_left > 0:
+            self._hold_left -= 1
+            return "hold"
+        if self.heartbeat_frames and self._frames_since_detect >= self.heartbeat_frames:
+            return "heartbeat"
+        if self.heartbeat_seconds and time.monotonic() - self._last_detect_time >= self.heartbeat_seconds:
+            return "heartbeat"
+        return None
+
+    def run(self, frame, detect):
+        """
+        Chạy `detect(frame)` nếu cần, ngược lại trả kết quả cache.
+        Returns (result, gated) where gated=True means detection was skipped.
+        """
+        if not self.enabled:
+            return detect(frame), False
+
+        signature = self._signature(frame)
+        with self._lock:
+            self.frames += 1
+            reason = self._decide(signature)
+            if reason is None:
+                self.skipped += 1
+                self._frames_since_detect += 1
+                self.reasons["skipped"] += 1
+                return (self._last_result if self.idle_result == "previous" else EMPTY_RESULT), True
+            self.reasons[reason] += 1
+
+        result = detect(frame)
+        with self._lock:
+            self._reference = signature
+            self._last_result = result
+            self._annotation = None
+            self._frames_since_detect = 0
+            self._last_detect_time = time.monotonic()
+        return result, False
+
+    def annotate(self, result, value):
+        """Gắn dữ liệu phụ vào kết quả cache (bỏ qua nếu đã có kết quả mới hơn) / Attach derived data."""
+        with self._lock:
+            if result is self._last_result:
+                self._annotation = value
+
+    def annotation(self, result):
+        """Dữ liệu phụ đã gắn cho `result`, hoặc None / Derived data attached to `result`, if any."""
+        with self._lock:
+            return self._annotation if result is self._last_result else None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "camera_id": self.camera_id,
+                "enabled": self.enabled,
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "hit_rate": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+                "reasons": dict(self.reasons),
+                "last_motion_ratio": round(self.last_motion, 4),
+                "idle_result": self.idle_result,
+            }
+
+
+class MotionGateRegistry:
+    """
+    Tạo / giữ MotionGate theo camera_id, áp dụng cấu hình riêng từ MOTION_GATE_CAMERAS.
+    camera_id do client gửi lên nên chỉ giữ tối đa `max_cameras` gate, bỏ gate lâu không dùng nhất.
+    Per-camera gate registry with JSON overrides, bounded LRU.
+    """
+
+    def __init__(self, overrides=MOTION_GATE_CAMERAS, max_cameras=CAMERA_REGISTRY_MAX):
+        if isinstance(overrides, str):
+            overrides = json.loads(overrides) if overrides.strip() else {}
+        self.overrides = overrides
+        for camera_id, options in overrides.items():
+            MotionGate(camera_id, **options)  # kiểm tra cấu hình sớm / validate at startup
+        self.max_cameras = max(1, max_cameras)
+        self._gates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, camera_id="default"):
+        with self._lock:
+            gate = self._gates.get(camera_id)
+            if gate is None:
+                gate = MotionGate(camera_id, **self.overrides.get(camera_id, {}))
+                self._gates[camera_id] = gate
+                if len(self._gates) > self.max_cameras:
+                    self._gates.popitem(last=False)
+            else:
+                self._gates.move_to_end(camera_id)
+            return gate
+
+    def stats(self):
+        with self._lock:
+            gates = list(self._gates.values())
+        return {gate.camera_id: gate.stats() for gate in gates}
@@ -0,0 +1,121 @@
+"""
+Kế hoạch tiền xử lý biên dịch sẵn cho từng mô hình TFLite.
+Per-model preprocessing plans compiled once at Detector start-up.
+
+Mỗi TensorPlan đọc shape / dtype / tham số lượng tử của interpreter một lần, cấp phát
+sẵn buffer resize (và grayscale nếu cần), rồi mỗi lần chạy:
+  resize vào buffer -> (grayscale) -> chuẩn hóa / lượng tử hóa ghi thẳng vào tensor
+  đầu vào của interpreter qua view `interpreter.tensor()` -> invoke -> trả view đầu ra.
+Không còn astype / reshape / expand_dims / set_tensor / get_tensor tạo mảng mới mỗi frame.
+
+Tensor đầu vào có batch > 1 (sau resize_tensor_input) thì dùng run_batch() để điền
+nhiều ảnh vào các slot của cùng 1 lần invoke (xem app/embedder.py).
+
+Lưu ý: view từ `interpreter.tensor()` không được giữ qua lần invoke() tiếp theo, nên
+plan chỉ lấy view ngay trước khi ghi / đọc và người gọi phải dùng xong (hoặc copy)
+kết quả trước khi chạy plan lần nữa.
+"""
+
+import cv2
+import numpy as np
+
+from .models import get_quantization_params
+
+
+class TensorPlan:
+    """Tiền xử lý + suy luận không cấp phát cho 1 interpreter / Allocation-free run for one interpreter."""
+
+    def __init__(self, interpreter, input_detail, output_detail):
+        self.interpreter = interpreter
+        self.batch_size, self.height, self.width, self.channels = (int(d) for d in input_detail['shape'])
+        self.dtype = input_detail['dtype']
+        self.input_quant = get_quantization_params(input_detail)
+        self.output_quant = get_quantization_params(output_detail)
+
+        # Buffer dùng lại giữa các frame / Buffers reused across frames
+        batch_shape = (self.batch_size, self.height, self.width)
+        self._resized = np.empty(batch_shape + (3,), dtype=np.uint8)
+        self._gray = np.empty(batch_shape, dtype=np.uint8) if self.channels == 1 else None
+        self._scratch = (np.empty(batch_shape + (self.channels,), dtype=np.float32)
+                         if self.input_quant is not None else None)
+
+        # Hệ số chuẩn hóa gộp: value = pixel * alpha + beta / Fused normalisation coefficients
+        if self.input_quant is not None:
+            scale, zero_point = self.input_quant
+            self._alpha = np.float32(1.0 / (255.0 * scale))
+            self._beta = np.float32(zero_point)
+            info = np.iinfo(self.dtype)
+            self._qmin, self._qmax = info.min, info.max
+        else:
+            self._alpha = np.float32(1.0 / 255.0)
+            self._beta = None
+
+        # Hàm trả về view numpy trên tensor của interpreter / Callables returning zero-copy views
+        self._input_view = interpreter.tensor(input_detail['index'])
+        self._output_view = interpreter.tensor(output_detail['index'])
+
+    def _resize_into(self, image, slot):
+        """Resize (và grayscale) ảnh vào slot của buffer sẵn có / Resize one image into a buffer slot."""
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        cv2.resize(image, (self.width, self.height), dst=self._resized[slot])
+        if self._gray is not None:
+            cv2.cvtColor(self._resized[slot], cv2.COLOR_BGR2GRAY, dst=self._gray[slot])
+
+    def _pixels(self, count):
+        """View (count, H, W, C) uint8 của các slot đã điền / Filled slots as (count, H, W, C)."""
+        if self._gray is None:
+            return self._resized[:count]
+        return self._gray[:count, ..., None]
+
+    def _write_input(self, count):
+        """Chuẩn hóa / lượng tử hóa `count` slot vào tensor đầu vào / Normalize slots into the input tensor."""
+        pixels = self._pixels(count)
+        target = self._input_view()[:count]
+        if self.input_quant is not None:
+            scratch = self._scratch[:count]
+            np.multiply(pixels, self._alpha, out=scratch)
+            scratch += self._beta
+            np.rint(scratch, out=scratch)
+            np.clip(scratch, self._qmin, self._qmax, out=scratch)
+            target[...] = scratch
+        elif self.dtype == np.uint8:
+            # Mô hình uint8 không có tham số lượng tử: pixel thô / uint8 model without params: raw pixels
+            target[...] = pixels
+        else:
+            np.multiply(pixels, self._alpha, out=target, casting='unsafe')
+        # target ra khỏi scope tại đây: không giữ view qua invoke() / view released before invoke()
+
+    def _dequantize(self, output):
+        if self.output_quant is None:
+            return np.array(output, dtype=np.float32)
+        scale, zero_point = self.output_quant
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def run(self, image):
+        """
+        Chạy mô hình trên ảnh BGR 0..255, trả về view đầu ra (batch 0).
+        Runs the model on a BGR image and returns a view of output[0]; consume it before the next run.
+        """
+        self._resize_into(image, 0)
+        self._write_input(1)
+        self.interpreter.invoke()
+        return self._output_view()[0]
+
+    def run_float(self, image):
+        """Như run() nhưng trả về mảng float32 riêng (đã giải lượng tử) / Owned, dequantized float32 copy."""
+        return self._dequantize(self.run(image))
+
+    def run_batch_float(self, images):
+        """
+        Chạy tối đa batch_size ảnh trong 1 lần invoke, trả về float32 (len(images), ...) riêng.
+        Slot thừa giữ dữ liệu cũ, đầu ra của chúng bị bỏ qua / unused slots are ignored.
+        """
+        count = len(images)
+        if count > self.batch_size:
+            raise ValueError(f"Batch {count} vượt quá kích thước tensor đầu vào {self.batch_size}")
+        for slot, image in enumerate(images):
+            self._resize_into(image, slot)
+        self._write_input(count)
+        self.interpreter.invoke()
+        return self._dequantize(self._output_view()[:count])
@@ -0,0 +1,143 @@
+"""
+Chọn kích thước đầu vào (imgsz) cho YOLO theo từng frame và từng ROI.
+Adaptive detector input resolution per frame and per ROI.
+
+- Người: ước lượng độ "lấp đầy" khung hình của người lớn nhất ở frame trước. Khi người
+  đứng gần (chiếm phần lớn ảnh) chỉ cần imgsz nhỏ để vẫn giữ đủ `min_person_pixels`
+  cạnh cho người đó; khi không thấy ai hoặc đến lượt quét đầy đủ thì dùng imgsz lớn nhất
+  để không bỏ sót người ở xa. Không bao giờ phóng to quá cạnh dài của frame.
+- Khuôn mặt: imgsz là bucket nhỏ nhất >= cạnh dài ROI * face_scale (giới hạn ở bucket
+  lớn nhất). Chỉ dùng các bucket cố định (bội số 32) để backend không phải cấp phát /
+  biên dịch lại cho mọi kích thước.
+
+Preset (DETECTION_POLICY): fixed (640 / 160 như trước), recall, balanced, latency.
+
+Trạng thái frame trước chỉ có nghĩa trong 1 luồng camera: frame preview lấy policy theo
+camera_id từ ResolutionPolicyRegistry; ảnh đơn lẻ (/store, /retrieve) dùng policy mới cho mỗi
+request (luôn quét đầy đủ). State only makes sense within one camera stream.
+"""
+
+import math
+import threading
+from collections import Counter, OrderedDict
+
+from .config import DETECTION_POLICY, CAMERA_REGISTRY_MAX
+
+PRESETS = {
+    # Giữ nguyên hành vi cũ / Previous hard-coded behaviour
+    "fixed": dict(person_sizes=(640,), face_sizes=(160,), face_scale=1.0, min_person_pixels=0, full_scan_every=1),
+    "recall": dict(person_sizes=(480, 640), face_sizes=(128, 160, 224, 320), face_scale=1.25,
+                   min_person_pixels=320, full_scan_every=5),
+    "balanced": dict(person_sizes=(320, 416, 512, 640), face_sizes=(96, 128, 160), face_scale=1.0,
+                     min_person_pixels=224, full_scan_every=15),
+    "latency": dict(person_sizes=(256, 320, 416, 640), face_sizes=(64, 96, 128, 160), face_scale=0.75,
+                    min_person_pixels=160, full_scan_every=30),
+}
+
+
+def _bucket(sizes, target):
+    """Bucket nhỏ nhất >= target, hoặc bucket lớn nhất / Smallest bucket >= target, else the largest."""
+    for size in sizes:
+        if size >= target:
+            return size
+    return sizes[-1]
+
+
+class ResolutionPolicy:
+    """
+    Chính sách chọn imgsz, giữ trạng thái frame trước (dùng 1 instance cho 1 camera).
+    Resolution policy with per-stream state (use one instance per camera).
+    """
+
+    def __init__(self, person_sizes, face_sizes, face_scale=1.0, min_person_pixels=224, full_scan_every=15,
+                 name="custom"):
+        self.name = name
+        self.person_sizes = tuple(sorted(person_sizes))
+        self.face_sizes = tuple(sorted(face_sizes))
+        self.face_scale = face_scale
+        self.min_person_pixels = min_person_pixels
+        self.full_scan_every = max(1, full_scan_every)
+        self._lock = threading.Lock()
+        self._largest_fill = None  # tỉ lệ diện tích người lớn nhất / largest person area ratio
+        self._frames_since_full = 0
+        self.person_size_counts = Counter()
+        self.face_size_counts = Counter()
+
+    @classmethod
+    def from_preset(cls, name=DETECTION_POLICY):
+        if name not in PRESETS:
+            raise ValueError(f"DETECTION_POLICY không hợp lệ: {name} ({', '.join(PRESETS)})")
+        return cls(name=name, **PRESETS[name])
+
+    def person_imgsz(self, frame_shape):
+        """imgsz cho mô hình người của frame này / Person detector imgsz for this frame."""
+        h, w = frame_shape[:2]
+        # Không phóng to quá kích thước frame / never upscale past the frame itself
+        full = _bucket(self.person_sizes, max(h, w))
+        with self._lock:
+            self._frames_since_full += 1
+            if self._largest_fill is None or self._frames_since_full >= self.full_scan_every:
+                size = full
+            else:
+                # Người chiếm tỉ lệ cạnh sqrt(fill): cần imgsz đủ để cạnh người >= min_person_pixels
+                needed = self.min_person_pixels / math.sqrt(self._largest_fill)
+                size = min(_bucket(self.person_sizes, needed), full)
+            if size == full:
+                self._frames_since_full = 0
+            self.person_size_counts[size] += 1
+        return size
+
+    def observe_persons(self, frame_shape, boxes):
+        """Cập nhật trạng thái từ kết quả nhận diện người / Update state from the person boxes found."""
+        h, w = frame_shape[:2]
+        fill = None
+        if len(boxes):
+            areas = [max(0.0, (x2 - x1) * (y2 - y1)) for x1, y1, x2, y2 in boxes]
+            fill = min(1.0, max(areas) / float(h * w)) or None
+        with self._lock:
+            self._largest_fill = fill
+
+    def face_imgsz(self, roi_shape):
+        """imgsz cho mô hình khuôn mặt trên 1 ROI người / Face detector imgsz for one person ROI."""
+        size = _bucket(self.face_sizes, max(roi_shape[:2]) * self.face_scale)
+        with self._lock:
+            self.face_size_counts[size] += 1
+        return size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "policy": self.name,
+                "person_imgsz": dict(self.person_size_counts),
+                "face_imgsz": dict(self.face_size_counts),
+            }
+
+
+class ResolutionPolicyRegistry:
+    """
+    Giữ 1 ResolutionPolicy cho mỗi camera_id, tối đa `max_cameras` camera (bỏ camera lâu không dùng nhất).
+    Per-camera policy registry, bounded LRU since camera_id comes from the client.
+    """
+
+    def __init__(self, name=DETECTION_POLICY, max_cameras=CAMERA_REGISTRY_MAX):
+        ResolutionPolicy.from_preset(name)  # kiểm tra preset sớm / validate at startup
+        self.name = name
+        self.max_cameras = max(1, max_cameras)
+        self._policies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, camera_id="default"):
+        with self._lock:
+            policy = self._policies.get(camera_id)
+            if policy is None:
+                policy = self._policies[camera_id] = ResolutionPolicy.from_preset(self.name)
+                if len(self._policies) > self.max_cameras:
+                    self._policies.popitem(last=False)
+            else:
+                self._policies.move_to_end(camera_id)
+            return policy
+
+    def stats(self):
+        with self._lock:
+            policies = list(self._policies.items())
+        return {camera_id: policy.stats() for camera_id, policy in policies}
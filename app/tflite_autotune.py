@@ -0,0 +1,172 @@
+"""
+Tự chọn num_threads / XNNPACK cho từng mô hình TFLite khi khởi động.
+Startup autotuner for per-model TFLite thread count and XNNPACK delegate.
+
+Với mỗi mô hình, đo các cấu hình ứng viên (num_threads x XNNPACK bật/tắt) trong khi
+`concurrency` interpreter chạy song song (mô phỏng số worker server dùng thật), chọn
+cấu hình có p50 thấp nhất và lưu vào cache JSON theo khóa
+    <sha256 mô hình>:<chữ ký CPU>:c<concurrency>
+để các lần khởi động sau dùng lại mà không phải đo.
+
+TFLITE_AUTOTUNE:
+    off   - luôn dùng mặc định của TFLite
+    cache - dùng kết quả trong cache nếu có, không tự đo (mặc định)
+    on    - dùng cache, mô hình nào chưa có thì đo rồi lưu
+    force - đo lại toàn bộ và ghi đè cache
+"""
+
+import os
+import json
+import time
+import hashlib
+import platform
+import threading
+
+import numpy as np
+
+from .config import TFLITE_AUTOTUNE, TFLITE_AUTOTUNE_CONCURRENCY, TFLITE_TUNING_CACHE_PATH
+from .tflite_loader import load_interpreter, OpResolverType
+
+_cache_lock = threading.Lock()
+
+
+def cpu_signature():
+    """Chữ ký CPU: kiến trúc + tên CPU + số core / CPU identity used in the cache key."""
+    model_name = platform.processor() or ""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    model_name = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    return f"{platform.machine()}|{model_name}|{os.cpu_count()}"
+
+
+def model_hash(model_path):
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def cache_key(model_path, concurrency):
+    return f"{model_hash(model_path)}:{cpu_signature()}:c{concurrency}"
+
+
+def load_cache(path=TFLITE_TUNING_CACHE_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, path=TFLITE_TUNING_CACHE_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def candidate_settings(max_threads=None):
+    """Các cấu hình ứng viên / Candidate (num_threads, xnnpack) settings."""
+    max_threads = max_threads or os.cpu_count() or 1
+    threads = sorted({1, 2, 4, max_threads} & set(range(1, max_threads + 1)))
+    xnnpack_options = [True, False] if OpResolverType is not None else [True]
+    return [{"num_threads": t, "xnnpack": x} for t in threads for x in xnnpack_options]
+
+
+def _random_input(detail):
+    shape = detail["shape"]
+    if detail["dtype"] in (np.uint8, np.int8):
+        info = np.iinfo(detail["dtype"])
+        return np.random.randint(info.min, info.max + 1, size=shape).astype(detail["dtype"])
+    return np.random.random_sample(shape).astype(detail["dtype"])
+
+
+def measure_setting(model_path, setting, concurrency, warmup=3, iterations=30):
+    """
+    Đo p50 (ms) của 1 cấu hình khi `concurrency` interpreter chạy cùng lúc.
+    Measures median invoke latency while `concurrency` interpreters run in parallel.
+    """
+    interpreters = [load_interpreter(model_path, **setting) for _ in range(concurrency)]
+    samples = [[] for _ in interpreters]
+    barrier = threading.Barrier(concurrency)
+
+    def run(idx, interpreter):
+        detail = interpreter.get_input_details()[0]
+        data = _random_input(detail)
+        interpreter.set_tensor(detail["index"], data)
+        for _ in range(warmup):
+            interpreter.invoke()
+        barrier.wait()
+        for _ in range(iterations):
+            start = time.perf_counter()
+            interpreter.invoke()
+            samples[idx].append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=run, args=(i, interp)) for i, interp in enumerate(interpreters)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return float(np.median(np.concatenate([np.asarray(s) for s in samples])))
+
+
+def tune_model(model_path, concurrency, candidates=None):
+    """Đo toàn bộ ứng viên, trả về cấu hình nhanh nhất kèm kết quả đo."""
+    results = []
+    for setting in candidates or candidate_settings():
+        try:
+            p50 = measure_setting(model_path, setting, concurrency)
+        except Exception as e:
+            print(f"[Autotune] {os.path.basename(model_path)} {setting} lỗi: {e}")
+            continue
+        results.append({**setting, "p50_ms": p50})
+        print(f"[Autotune] {os.path.basename(model_path)} threads={setting['num_threads']} "
+              f"xnnpack={setting['xnnpack']} -> p50={p50:.2f} ms")
+    if not results:
+        return None
+    best = min(results, key=lambda r: r["p50_ms"])
+    return {
+        "num_threads": best["num_threads"],
+        "xnnpack": best["xnnpack"],
+        "p50_ms": best["p50_ms"],
+        "candidates": results,
+        "model": os.path.basename(model_path),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def resolve_interpreter_settings(model_paths, mode=TFLITE_AUTOTUNE, concurrency=TFLITE_AUTOTUNE_CONCURRENCY,
+                                 cache_path=TFLITE_TUNING_CACHE_PATH):
+    """
+    Trả về {tên: {"num_threads", "xnnpack"}} cho các mô hình, dùng cache / autotune theo mode.
+    Returns per-model load_interpreter() kwargs; an empty dict means TFLite defaults.
+    """
+    if mode == "off":
+        return {name: {} for name in model_paths}
+
+    with _cache_lock:
+        cache = load_cache(cache_path)
+        settings, changed = {}, False
+        for name, path in model_paths.items():
+            key = cache_key(path, concurrency)
+            entry = None if mode == "force" else cache.get(key)
+            if entry is None and mode in ("on", "force"):
+                print(f"[Autotune] Đang đo {name} (concurrency={concurrency})...")
+                entry = tune_model(path, concurrency)
+                if entry:
+                    cache[key] = entry
+                    changed = True
+            if entry:
+                settings[name] = {"num_threads": entry["num_threads"], "xnnpack": entry["xnnpack"]}
+                print(f"[Autotune] {name}: threads={entry['num_threads']} xnnpack={entry['xnnpack']}")
+            else:
+                settings[name] = {}
+        if changed:
+            save_cache(cache, cache_path)
+    return settings
@@ -0,0 +1,80 @@
+"""
+Chọn trình thông dịch TFLite cho đường phục vụ / TFLite interpreter selection for the serving path.
+
+Ưu tiên gói độc lập `tflite_runtime` (hoặc `ai_edge_litert`) để server không phải
+import toàn bộ TensorFlow; chỉ dùng `tensorflow.lite` khi không có gói nào khác.
+Prefers the standalone interpreter packages so serving does not pay TensorFlow's
+import time and memory; falls back to `tensorflow.lite` when neither is installed.
+
+Mô hình chứa Select TF ops (Flex) không chạy được trên gói độc lập: ở chế độ auto,
+riêng mô hình đó được tải bằng tensorflow (kèm cảnh báo). Convert lại chỉ với
+TFLITE_BUILTINS (vd. scripts/quantize_int8.py) để bỏ hẳn TensorFlow khỏi server.
+
+TFLITE_PROVIDER = auto | tflite_runtime | ai_edge_litert | tensorflow
+"""
+
+import importlib
+
+from .config import TFLITE_PROVIDER
+
+_PROVIDER_MODULES = {
+    "tflite_runtime": "tflite_runtime.interpreter",
+    "ai_edge_litert": "ai_edge_litert.interpreter",
+    "tensorflow": "tensorflow",
+}
+
+
+def _import_provider(name):
+    """Trả về (Interpreter, OpResolverType) của provider / Interpreter class and resolver enum."""
+    if name not in _PROVIDER_MODULES:
+        raise ValueError(f"TFLITE_PROVIDER không hợp lệ: {name}")
+    module = importlib.import_module(_PROVIDER_MODULES[name])
+    if name == "tensorflow":
+        return module.lite.Interpreter, getattr(module.lite.experimental, "OpResolverType", None)
+    return module.Interpreter, getattr(module, "OpResolverType", None)
+
+
+def _resolve(provider):
+    candidates = list(_PROVIDER_MODULES) if provider == "auto" else [provider]
+    errors = []
+    for name in candidates:
+        try:
+            return (name,) + _import_provider(name)
+        except ImportError as e:
+            errors.append(f"{name}: {e}")
+    raise ImportError("Không tìm thấy TFLite interpreter nào: " + "; ".join(errors))
+
+
+PROVIDER, Interpreter, OpResolverType = _resolve(TFLITE_PROVIDER)
+
+
+def _create(interpreter_cls, model_path, model_content, kwargs):
+    interpreter = interpreter_cls(model_path=model_path, model_content=model_content, **kwargs)
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+def load_interpreter(model_path=None, model_content=None, num_threads=None, xnnpack=None):
+    """
+    Tạo và allocate 1 interpreter TFLite từ đường dẫn hoặc bytes trong bộ nhớ.
+    Creates and allocates a TFLite interpreter from a path or in-memory model bytes.
+
+    xnnpack=False tắt delegate XNNPACK mặc định / disables the default XNNPACK delegate.
+    """
+    kwargs = {}
+    if num_threads:
+        kwargs["num_threads"] = num_threads
+    if xnnpack is False and OpResolverType is not None:
+        kwargs["experimental_op_resolver_type"] = OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    try:
+        return _create(Interpreter, model_path, model_content, kwargs)
+    except (RuntimeError, ValueError) as e:
+        if TFLITE_PROVIDER != "auto" or PROVIDER == "tensorflow" or "Select TensorFlow op" not in str(e):
+            raise
+    # Mô hình cần Flex delegate: chỉ tensorflow chạy được / Flex ops need full TensorFlow
+    print(f"[TFLite] {model_path or 'model'} dùng Select TF ops, tải bằng tensorflow "
+          f"(convert lại với TFLITE_BUILTINS để bỏ TensorFlow khỏi server)")
+    tf_interpreter, tf_resolver = _import_provider("tensorflow")
+    if "experimental_op_resolver_type" in kwargs and tf_resolver is not None:
+        kwargs["experimental_op_resolver_type"] = tf_resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    return _create(tf_interpreter, model_path, model_content, kwargs)
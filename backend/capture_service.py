@@ -0,0 +1,254 @@
+"""
+Thu hình trực tiếp từ camera sảnh (RTSP / webcam / file video) thay vì chờ trình duyệt upload.
+
+- Mỗi nguồn 1 thread giải mã (CameraSource). Thread đọc liên tục bằng grab() để không bị trễ buffer,
+  chỉ retrieve() (chuyển màu, copy) frame được lấy mẫu theo `fps` của nguồn. Mất kết nối thì mở lại
+  với backoff. File video được đọc theo FPS gốc (giống camera thật) và lặp lại khi hết.
+- Mỗi camera chỉ giữ frame mới nhất chưa xử lý (frame cũ bị thay thì tính là dropped): camera chậm
+  không kéo trễ cả hệ thống.
+- Thread gom batch: lấy frame đang chờ của mọi camera khi đủ CAPTURE_MAX_BATCH frame hoặc frame cũ nhất
+  đã chờ CAPTURE_MAX_WAIT_MS, rồi chạy 1 lần Detector.process_batch qua hàng đợi suy luận chung
+  (lớp PREVIEW), nên 1 bộ mô hình phục vụ mọi camera và /store, /retrieve vẫn được ưu tiên.
+- Kết quả đăng theo camera: latest(camera_id) và callback subscribe(fn(camera_id, entry)). Kết quả chỉ nằm
+  trong bộ nhớ process này, nên CAPTURE_SOURCES chỉ chạy với 1 worker (backend/prefork.py từ chối nhiều worker).
+
+Cấu hình CAPTURE_SOURCES (JSON), vd.:
+    {"lobby-1": "rtsp://10.0.0.21/stream1", "lobby-2": {"url": "rtsp://10.0.0.22/stream1", "fps": 4},
+     "demo": {"url": "./videos/lobby.mp4", "fps": 1}, "usb": {"url": "0"}}
+Mặc định mỗi nguồn lấy CAPTURE_SAMPLE_FPS frame/giây.
+"""
+
+import os
+import json
+import time
+import threading
+
+import cv2
+
+from app.resolution_policy import ResolutionPolicy
+from backend.scheduler import Overloaded
+
+CAPTURE_SOURCES = json.loads(os.getenv("CAPTURE_SOURCES") or "{}")
+CAPTURE_SAMPLE_FPS = float(os.getenv("CAPTURE_SAMPLE_FPS", "2"))
+CAPTURE_MAX_BATCH = int(os.getenv("CAPTURE_MAX_BATCH", "8"))
+CAPTURE_MAX_WAIT_MS = float(os.getenv("CAPTURE_MAX_WAIT_MS", "50"))
+CAPTURE_RECONNECT_MAX_S = float(os.getenv("CAPTURE_RECONNECT_MAX_S", "30"))
+
+
+def summarize(result):
+    """Tuple kết quả Detector -> dict JSON được (bỏ embedding)."""
+    person_count, face_count, person_boxes, face_boxes = result
+    return {
+        "person_count": person_count,
+        "face_count": face_count,
+        "person_boxes": [{"coords": coords, "confidence": conf, "action": action}
+                         for (coords, conf, action) in person_boxes],
+        "face_boxes": [{"coords": coords, "confidence": conf, "emotion": emotion}
+                       for (coords, conf, emotion, _) in face_boxes],
+    }
+
+
+class CameraSource:
+    """1 thread giải mã cho 1 camera / video; frame lấy mẫu được đẩy vào on_frame(camera_id, frame, ts)."""
+
+    def __init__(self, camera_id, url, on_frame, fps=CAPTURE_SAMPLE_FPS):
+        self.camera_id = camera_id
+        self.url = url
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.on_frame = on_frame
+        self.is_file = os.path.isfile(url)
+        self.stats = {"decoded": 0, "sampled": 0, "reconnects": 0, "connected": False, "last_error": None}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"capture-{camera_id}", daemon=True)
+
+    def _open(self):
+        # "0", "1"... là webcam cục bộ / digits mean a local device index
+        cap = cv2.VideoCapture(int(self.url) if self.url.isdigit() else self.url)
+        if not cap.isOpened():
+            cap.release()
+            raise IOError(f"Không mở được nguồn {self.url}")
+        return cap
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                cap = self._open()
+            except IOError as e:
+                self.stats["last_error"] = str(e)
+                print(f"[Capture] {self.camera_id}: {e}, thử lại sau {backoff:.0f} s")
+                self._stop.wait(backoff)
+                backoff = min(CAPTURE_RECONNECT_MAX_S, backoff * 2)
+                self.stats["reconnects"] += 1
+                continue
+
+            backoff = 1.0
+            self.stats["connected"] = True
+            file_period = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 25.0) if self.is_file else 0.0
+            next_sample = next_frame = time.monotonic()
+            rewound = False
+            try:
+                while not self._stop.is_set():
+                    if not cap.grab():
+                        if self.is_file and not rewound:
+                            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # hết file: phát lại / loop the file
+                            rewound = True
+                            continue
+                        raise IOError("Mất tín hiệu")
+                    rewound = False
+                    self.stats["decoded"] += 1
+                    now = time.monotonic()
+                    if now >= next_sample:
+                        ok, frame = cap.retrieve()
+                        if ok:
+                            next_sample = max(next_sample + self.interval, now)
+                            self.stats["sampled"] += 1
+                            self.on_frame(self.camera_id, frame, time.perf_counter())
+                    if file_period:
+                        next_frame += file_period
+                        self._stop.wait(max(0.0, next_frame - time.monotonic()))
+            except IOError as e:
+                self.stats["last_error"] = str(e)
+                print(f"[Capture] {self.camera_id}: {e}, kết nối lại")
+            finally:
+                self.stats["connected"] = False
+                cap.release()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class CaptureService:
+    """
+    Gom frame của nhiều camera thành batch động cho 1 Detector dùng chung.
+    run_batch(frames, policies) -> list kết quả, vd. chạy qua InferenceScheduler.submit.
+    """
+
+    def __init__(self, sources, run_batch, max_batch=CAPTURE_MAX_BATCH, max_wait_ms=CAPTURE_MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._cond = threading.Condition()
+        self._pending = {}   # camera_id -> (frame, captured_at), chỉ giữ frame mới nhất
+        self._latest = {}
+        self._subscribers = []
+        self._stopped = False
+        self._thread = None
+        self.stats = {"batches": 0, "frames": 0, "batch_sizes": {}, "shed": 0, "errors": 0,
+                      "last_batch_ms": None, "last_error": None}
+        self.cameras = {}
+        self.policies = {}
+        self.dropped = {}
+        for camera_id, spec in sources.items():
+            spec = {"url": spec} if isinstance(spec, str) else dict(spec)
+            self.cameras[camera_id] = CameraSource(camera_id, str(spec["url"]), self._on_frame,
+                                                   fps=float(spec.get("fps", CAPTURE_SAMPLE_FPS)))
+            # Mỗi camera 1 ResolutionPolicy riêng: imgsz theo người trong khung hình của camera đó
+            self.policies[camera_id] = (ResolutionPolicy.from_preset(spec["policy"]) if "policy" in spec
+                                        else ResolutionPolicy.from_preset())
+            self.dropped[camera_id] = 0
+
+    # ----- nhận frame -----
+    def _on_frame(self, camera_id, frame, captured_at):
+        with self._cond:
+            if camera_id in self._pending:
+                self.dropped[camera_id] += 1
+            self._pending[camera_id] = (frame, captured_at)
+            self._cond.notify()
+
+    def _take_batch(self):
+        """Chờ tới khi đủ batch hoặc frame cũ nhất hết hạn chờ; trả về [(camera_id, frame, captured_at)]."""
+        with self._cond:
+            while not self._stopped:
+                if self._pending:
+                    oldest = min(ts for _, ts in self._pending.values())
+                    remaining = oldest + self.max_wait - time.perf_counter()
+                    if len(self._pending) >= self.max_batch or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait()
+            if self._stopped:
+                return []
+            ordered = sorted(self._pending.items(), key=lambda item: item[1][1])[:self.max_batch]
+            for camera_id, _ in ordered:
+                del self._pending[camera_id]
+            return [(camera_id, frame, ts) for camera_id, (frame, ts) in ordered]
+
+    # ----- chạy batch + đăng kết quả -----
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+            start = time.perf_counter()
+            try:
+                results = self.run_batch([frame for _, frame, _ in batch],
+                                         [self.policies[camera_id] for camera_id, _, _ in batch])
+            except Overloaded as e:
+                # Hàng đợi preview đầy / quá hạn: bỏ batch này, camera đã có frame mới hơn
+                self.stats["shed"] += 1
+                self.stats["last_error"] = f"Overloaded: {e}"
+                continue
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = f"{type(e).__name__}: {e}"
+                print(f"[Capture] Lỗi chạy batch {len(batch)} frame: {e}")
+                continue
+            done = time.perf_counter()
+            self.stats["batches"] += 1
+            self.stats["frames"] += len(batch)
+            size = str(len(batch))
+            self.stats["batch_sizes"][size] = self.stats["batch_sizes"].get(size, 0) + 1
+            self.stats["last_batch_ms"] = round((done - start) * 1000, 2)
+            for (camera_id, _, captured_at), result in zip(batch, results):
+                entry = {
+                    "camera_id": camera_id,
+                    "result": result,
+                    "at": time.time(),
+                    "latency_ms": round((done - captured_at) * 1000, 2),
+                    "batch_size": len(batch),
+                }
+                self._latest[camera_id] = entry
+                for callback in list(self._subscribers):
+                    try:
+                        callback(camera_id, entry)
+                    except Exception as e:
+                        print(f"[Capture] Lỗi subscriber cho {camera_id}: {e}")
+
+    def subscribe(self, callback):
+        """callback(camera_id, entry) được gọi trên thread gom batch sau mỗi kết quả."""
+        self._subscribers.append(callback)
+
+    def latest(self, camera_id):
+        return self._latest.get(camera_id)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="capture-batcher", daemon=True)
+        self._thread.start()
+        for camera in self.cameras.values():
+            camera.start()
+        print(f"[Capture] {len(self.cameras)} camera, batch tối đa {self.max_batch}, "
+              f"chờ tối đa {self.max_wait * 1000:.0f} ms")
+
+    def stop(self):
+        for camera in self.cameras.values():
+            camera.stop()
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            pending = len(self._pending)
+        return dict(
+            self.stats,
+            batch_sizes=dict(self.stats["batch_sizes"]),
+            pending=pending,
+            cameras={camera_id: dict(camera.stats, dropped=self.dropped[camera_id],
+                                     last_latency_ms=(self._latest.get(camera_id) or {}).get("latency_ms"))
+                     for camera_id, camera in self.cameras.items()},
+        )
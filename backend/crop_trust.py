@@ -0,0 +1,143 @@
+"""
+Chính sách tin ảnh khuôn mặt do kiosk tự cắt (/store_crop, /retrieve_crop).
+
+Kiosk có phần cứng tự phát hiện mặt gửi ảnh đã cắt + box + confidence của detector phía client;
+server bỏ YOLO người, chỉ chạy (tuỳ chính sách) 1 lượt YOLO khuôn mặt ở imgsz nhỏ rồi mô hình embedding.
+
+CROP_TRUST_MODE:
+    off     : tắt 2 endpoint crop (403)
+    verify  : mọi ảnh crop đều qua lượt xác nhận khuôn mặt (mặc định)
+    trusted : kiosk trong CROP_KIOSK_TOKENS (JSON kiosk_id -> token) gửi đúng cặp header
+              X-Kiosk-Id / X-Kiosk-Token bỏ lượt xác nhận, trừ một tỉ lệ CROP_AUDIT_RATE được kiểm tra
+              ngẫu nhiên; kiosk trượt quá CROP_MAX_AUDIT_FAILURES lần kiểm tra bị hạ về verify cho tới
+              khi restart. Thiếu / sai token thì coi như kiosk lạ, luôn xác nhận.
+Mọi chế độ đều từ chối trước khi suy luận: confidence client < CROP_MIN_CLIENT_CONF, ảnh nhỏ hơn
+CROP_MIN_SIZE px, tỉ lệ cạnh > CROP_MAX_ASPECT, hoặc kích thước ảnh lệch box khai báo quá CROP_BOX_TOLERANCE.
+
+Thống kê theo kiosk: GET /crop_trust/stats (mọi request không xác thực được gộp vào "unknown").
+"""
+
+import os
+import hmac
+import json
+import random
+import threading
+from collections import defaultdict
+
+UNKNOWN_KIOSK = "unknown"
+
+CROP_TRUST_MODE = os.getenv("CROP_TRUST_MODE", "verify")  # off | verify | trusted
+CROP_KIOSK_TOKENS = json.loads(os.getenv("CROP_KIOSK_TOKENS", "{}"))
+CROP_AUDIT_RATE = float(os.getenv("CROP_AUDIT_RATE", "0.05"))
+CROP_MAX_AUDIT_FAILURES = int(os.getenv("CROP_MAX_AUDIT_FAILURES", "3"))
+CROP_MIN_CLIENT_CONF = float(os.getenv("CROP_MIN_CLIENT_CONF", "0.5"))
+CROP_MIN_SIZE = int(os.getenv("CROP_MIN_SIZE", "48"))
+CROP_MAX_ASPECT = float(os.getenv("CROP_MAX_ASPECT", "2.0"))
+CROP_BOX_TOLERANCE = float(os.getenv("CROP_BOX_TOLERANCE", "0.5"))
+# Lượt xác nhận phía server: imgsz nhỏ vì ảnh chỉ còn mỗi khuôn mặt
+CROP_VERIFY_IMGSZ = int(os.getenv("CROP_VERIFY_IMGSZ", "160"))
+CROP_VERIFY_CONF = float(os.getenv("CROP_VERIFY_CONF", "0.3"))
+
+MODES = ("off", "verify", "trusted")
+
+
+class CropRejected(Exception):
+    def __init__(self, reason, status_code=400):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+def parse_box(text):
+    """"x1,y1,x2,y2" -> tuple int; sai định dạng thì CropRejected."""
+    try:
+        x1, y1, x2, y2 = (int(float(v)) for v in text.split(","))
+    except (AttributeError, ValueError):
+        raise CropRejected(f"box không hợp lệ: {text!r} (cần x1,y1,x2,y2)")
+    if x2 <= x1 or y2 <= y1:
+        raise CropRejected(f"box rỗng: {text!r}")
+    return x1, y1, x2, y2
+
+
+class CropTrustPolicy:
+    def __init__(self, mode=CROP_TRUST_MODE, kiosk_tokens=CROP_KIOSK_TOKENS, audit_rate=CROP_AUDIT_RATE):
+        if mode not in MODES:
+            raise ValueError(f"CROP_TRUST_MODE không hợp lệ: {mode} ({' | '.join(MODES)})")
+        self.mode = mode
+        self.kiosk_tokens = {kiosk: token for kiosk, token in kiosk_tokens.items() if token}
+        self.audit_rate = audit_rate
+        self.verify_imgsz = CROP_VERIFY_IMGSZ
+        self.verify_conf = CROP_VERIFY_CONF
+        self._lock = threading.Lock()
+        self._demoted = set()
+        self._stats = defaultdict(lambda: {"accepted": 0, "rejected": 0, "verified": 0, "trusted": 0,
+                                           "verify_failed": 0, "audits": 0, "audit_failed": 0})
+
+    def authenticate(self, kiosk_id, token):
+        """kiosk_id nếu token khớp CROP_KIOSK_TOKENS, ngược lại "unknown" (X-Kiosk-Id tự khai không đủ)."""
+        expected = self.kiosk_tokens.get(kiosk_id) if kiosk_id else None
+        if expected and token and hmac.compare_digest(token, expected):
+            return kiosk_id
+        return UNKNOWN_KIOSK
+
+    def _trusted(self, kiosk_id):
+        return self.mode == "trusted" and kiosk_id in self.kiosk_tokens and kiosk_id not in self._demoted
+
+    def check(self, kiosk_id, box, client_conf, crop_shape):
+        """
+        Kiểm tra 1 ảnh crop trước khi suy luận; kiosk_id là kết quả của authenticate().
+        Trả về (verify, audit): verify=True nếu phải chạy lượt xác nhận khuôn mặt, audit=True nếu
+        đó là lượt kiểm tra ngẫu nhiên của kiosk tin cậy. Không đạt thì ném CropRejected.
+        """
+        try:
+            if self.mode == "off":
+                raise CropRejected("Upload ảnh crop đang tắt (CROP_TRUST_MODE=off)", status_code=403)
+            x1, y1, x2, y2 = parse_box(box) if isinstance(box, str) else box
+            height, width = crop_shape[:2]
+            if client_conf < CROP_MIN_CLIENT_CONF:
+                raise CropRejected(f"confidence client {client_conf:.2f} < {CROP_MIN_CLIENT_CONF}")
+            if min(width, height) < CROP_MIN_SIZE:
+                raise CropRejected(f"ảnh crop {width}x{height} nhỏ hơn {CROP_MIN_SIZE} px")
+            if max(width, height) / min(width, height) > CROP_MAX_ASPECT:
+                raise CropRejected(f"tỉ lệ cạnh ảnh crop {width}x{height} bất thường")
+            # Client có thể nới box hoặc resize ảnh, nhưng không lệch quá CROP_BOX_TOLERANCE
+            box_w, box_h = x2 - x1, y2 - y1
+            if abs(width / box_w - 1) > CROP_BOX_TOLERANCE or abs(height / box_h - 1) > CROP_BOX_TOLERANCE:
+                raise CropRejected(f"ảnh crop {width}x{height} không khớp box {box_w}x{box_h}")
+        except CropRejected:
+            with self._lock:
+                self._stats[kiosk_id]["rejected"] += 1
+            raise
+
+        with self._lock:
+            if not self._trusted(kiosk_id):
+                return True, False
+            audit = random.random() < self.audit_rate
+            return audit, audit
+
+    def record(self, kiosk_id, verified, audit, ok):
+        """Ghi kết quả suy luận của 1 ảnh crop (ok=False: lượt xác nhận không thấy khuôn mặt)."""
+        with self._lock:
+            stats = self._stats[kiosk_id]
+            stats["accepted" if ok else "rejected"] += 1
+            stats["verified" if verified else "trusted"] += 1
+            if verified and not ok:
+                stats["verify_failed"] += 1
+            if audit:
+                stats["audits"] += 1
+                if not ok:
+                    stats["audit_failed"] += 1
+                    if stats["audit_failed"] > CROP_MAX_AUDIT_FAILURES and kiosk_id not in self._demoted:
+                        self._demoted.add(kiosk_id)
+                        print(f"[CropTrust] Kiosk {kiosk_id} trượt {stats['audit_failed']} lần kiểm tra, "
+                              f"hạ về chế độ verify")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "trusted_kiosks": sorted(set(self.kiosk_tokens) - self._demoted),
+                "demoted_kiosks": sorted(self._demoted),
+                "audit_rate": self.audit_rate,
+                "kiosks": {kiosk: dict(stats) for kiosk, stats in self._stats.items()},
+            }
@@ -0,0 +1,257 @@
+"""
+Đo độ trễ lệnh MongoDB và thời gian chờ connection pool cho db_utils.
+
+- CommandMetrics (pymongo CommandListener): độ trễ mỗi lệnh theo (lệnh, collection),
+  gồm cả mạng (duration_micros là round-trip phía driver).
+- PoolMetrics (pymongo ConnectionPoolListener): thời gian chờ lấy connection từ pool,
+  số connection đang bị giữ, số lần lấy connection thất bại.
+- Lệnh chậm hơn MONGODB_SLOW_MS được in ra dạng `[MongoDB][SLOW]` kèm hình dạng lệnh
+  (giá trị đã lược bỏ, vector embedding rút gọn) và hàm db_utils đã gọi lệnh đó.
+
+Xem số liệu: GET /metrics/mongo (JSON) hoặc /metrics/mongo?format=prometheus.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import defaultdict, deque
+
+from pymongo import monitoring
+
+SLOW_MS = float(os.getenv("MONGODB_SLOW_MS", "100"))
+# Số mẫu gần nhất giữ lại để tính percentile cho mỗi key
+RESERVOIR_SIZE = 1024
+_DB_UTILS_MODULE = "backend.db_utils"
+
+
+def _percentiles(samples):
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50_ms": round(pick(0.50), 3), "p95_ms": round(pick(0.95), 3), "p99_ms": round(pick(0.99), 3)}
+
+
+class _Series:
+    """Bộ đếm + mẫu gần nhất cho 1 key."""
+
+    __slots__ = ("count", "errors", "total_ms", "max_ms", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+    def add(self, ms, failed=False):
+        self.count += 1
+        self.errors += int(failed)
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.samples.append(ms)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else None,
+            "max_ms": round(self.max_ms, 3),
+            **_percentiles(list(self.samples)),
+        }
+
+
+def command_shape(value, depth=0):
+    """Hình dạng lệnh: giữ key và toán tử, thay giá trị bằng kiểu, rút gọn mảng số dài."""
+    if depth > 8:
+        return "..."
+    if isinstance(value, dict):
+        return {k: command_shape(v, depth + 1) for k, v in value.items() if k not in ("lsid", "$clusterTime", "$db")}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 4 and all(isinstance(v, (int, float)) for v in value[:4]):
+            return f"[{len(value)} x number]"
+        return [command_shape(v, depth + 1) for v in value[:4]] + (["..."] if len(value) > 4 else [])
+    if isinstance(value, str) and value.startswith("$"):
+        return value  # tham chiếu field / biến ($face_embedding, $$i)
+    return type(value).__name__
+
+
+def _calling_function():
+    """Tên hàm trong backend.db_utils gần nhất trên stack (listener chạy trên thread gọi lệnh)."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == _DB_UTILS_MODULE:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "?"
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._series = defaultdict(_Series)
+        self._callers = defaultdict(_Series)
+        self._pending = {}
+        self.slow_count = 0
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        self._pending[(event.request_id, event.connection_id)] = (
+            collection, _calling_function(), command_shape(event.command))
+
+    def _finish(self, event, failed):
+        collection, caller, shape = self._pending.pop((event.request_id, event.connection_id), ("-", "?", None))
+        ms = event.duration_micros / 1000.0
+        with self._lock:
+            self._series[(event.command_name, collection)].add(ms, failed)
+            self._callers[caller].add(ms, failed)
+            slow = ms >= self.slow_ms
+            if slow:
+                self.slow_count += 1
+        if slow:
+            print(
+                f"[MongoDB][SLOW] {event.command_name} {collection} {ms:.1f} ms "
+                f"caller={caller}{' FAILED' if failed else ''} "
+                f"shape={json.dumps(shape, ensure_ascii=False, default=str)}"
+            )
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "slow_ms": self.slow_ms,
+                "slow_count": self.slow_count,
+                "commands": [
+                    {"command": cmd, "collection": coll, **series.snapshot()}
+                    for (cmd, coll), series in sorted(self._series.items())
+                ],
+                "callers": {name: series.snapshot() for name, series in sorted(self._callers.items())},
+            }
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Thời gian chờ checkout; sự kiện checkout chạy trên thread gọi lệnh nên dùng thread-local."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.wait = _Series()
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.failed_checkouts = 0
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.perf_counter()
+
+    def _wait_ms(self):
+        start = getattr(self._local, "start", None)
+        self._local.start = None
+        return (time.perf_counter() - start) * 1000 if start is not None else 0.0
+
+    def connection_checked_out(self, event):
+        ms = self._wait_ms()
+        with self._lock:
+            self.wait.add(ms)
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_check_out_failed(self, event):
+        ms = self._wait_ms()
+        with self._lock:
+            self.wait.add(ms, failed=True)
+            self.failed_checkouts += 1
+        print(f"[MongoDB][POOL] checkout thất bại sau {ms:.1f} ms: {event.reason}")
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    # Các sự kiện còn lại không cần đo
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkout_wait": self.wait.snapshot(),
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "failed_checkouts": self.failed_checkouts,
+            }
+
+
+command_metrics = CommandMetrics()
+pool_metrics = PoolMetrics()
+
+
+def listeners():
+    """Truyền vào MongoClient(event_listeners=...)."""
+    return [command_metrics, pool_metrics]
+
+
+def snapshot():
+    return {"commands": command_metrics.snapshot(), "pool": pool_metrics.snapshot()}
+
+
+def prometheus_text():
+    """Xuất số liệu dạng Prometheus text exposition."""
+    data = snapshot()
+    lines = [
+        "# TYPE mongo_command_duration_ms summary",
+    ]
+    for row in data["commands"]["commands"]:
+        labels = f'command="{row["command"]}",collection="{row["collection"]}"'
+        for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+            if row[key] is not None:
+                lines.append(f'mongo_command_duration_ms{{{labels},quantile="{q}"}} {row[key]}')
+        lines.append(f"mongo_command_duration_ms_count{{{labels}}} {row['count']}")
+        lines.append(f"mongo_command_duration_ms_sum{{{labels}}} {round(row['mean_ms'] * row['count'], 3)}")
+        lines.append(f"mongo_command_errors_total{{{labels}}} {row['errors']}")
+    lines.append("# TYPE mongo_caller_duration_ms summary")
+    for caller, row in data["commands"]["callers"].items():
+        lines.append(f'mongo_caller_duration_ms_count{{caller="{caller}"}} {row["count"]}')
+        lines.append(f'mongo_caller_duration_ms_sum{{caller="{caller}"}} {round(row["mean_ms"] * row["count"], 3)}')
+    lines.append(f"mongo_slow_commands_total {data['commands']['slow_count']}")
+    pool = data["pool"]
+    wait = pool["checkout_wait"]
+    lines.append("# TYPE mongo_pool_checkout_wait_ms summary")
+    for q, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+        if wait[key] is not None:
+            lines.append(f'mongo_pool_checkout_wait_ms{{quantile="{q}"}} {wait[key]}')
+    lines.append(f"mongo_pool_checkout_wait_ms_count {wait['count']}")
+    lines.append(f"mongo_pool_checked_out {pool['checked_out']}")
+    lines.append(f"mongo_pool_failed_checkouts_total {pool['failed_checkouts']}")
+    return "\n".join(lines) + "\n"
@@ -3,9 +3,12 @@ from datetime import datetime, timezone
 
 import numpy as np
 from fastapi import HTTPException
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from dotenv import load_dotenv
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from backend import db_metrics
 
 load_dotenv()
 
@@ -14,20 +17,33 @@ DB_NAME = os.getenv("MONGODB_DB_NAME", "face_recognition_db")
 
 LOCKER_COLLECTION_NAME = os.getenv("MONGODB_LOCKER_COLLECTION", "lockers")
 SESSION_COLLECTION_NAME = os.getenv("MONGODB_SESSION_COLLECTION", "locker_sessions")
+FACE_COLLECTION_NAME = os.getenv("MONGODB_FACE_COLLECTION", "faces")
 
 if not MONGODB_URI:
     raise RuntimeError("MONGODB_URI is not set. Please configure it in .env or Render env vars")
 
-client = MongoClient(MONGODB_URI)
+# Listener đo độ trễ lệnh + chờ pool, xem backend/db_metrics.py và GET /metrics/mongo
+client = MongoClient(MONGODB_URI, event_listeners=db_metrics.listeners())
 db = client[DB_NAME]
 
 lockers_collection = db[LOCKER_COLLECTION_NAME]
 locker_sessions_collection = db[SESSION_COLLECTION_NAME]
+faces_collection = db[FACE_COLLECTION_NAME]
 
 # ✅ Indexes
 lockers_collection.create_index("locker_id", unique=True)
 locker_sessions_collection.create_index("status")
 locker_sessions_collection.create_index("locker_id")
+# Bắt kịp thay đổi sau snapshot embedding (backend/embedding_snapshot.py)
+locker_sessions_collection.create_index("created_at")
+locker_sessions_collection.create_index("closed_at")
+faces_collection.create_index("user_id")
+# Mỗi ảnh nguồn chỉ được nạp 1 lần (scripts/ingest_gallery.py chạy lại / resume an toàn)
+faces_collection.create_index(
+    [("user_id", 1), ("source", 1)],
+    unique=True,
+    partialFilterExpression={"source": {"$exists": True}},
+)
 
 
 # ========== COMMON ==========
@@ -41,6 +57,32 @@ def _to_unit_vector(vec) -> list[float]:
     return arr.astype(float).tolist()
 
 
+def _cosine_sim_stage(query_vec: list[float]) -> dict:
+    """Stage $addFields tính cosineSim = dot(face_embedding, query_vec) (cả 2 đã chuẩn hóa)."""
+    return {
+        "$addFields": {
+            "cosineSim": {
+                "$reduce": {
+                    "input": {
+                        "$map": {
+                            "input": {"$range": [0, len(query_vec)]},
+                            "as": "i",
+                            "in": {
+                                "$multiply": [
+                                    {"$arrayElemAt": ["$face_embedding", "$$i"]},
+                                    {"$arrayElemAt": [query_vec, "$$i"]},
+                                ]
+                            },
+                        }
+                    },
+                    "initialValue": 0,
+                    "in": {"$add": ["$$value", "$$this"]},
+                }
+            }
+        }
+    }
+
+
 # ========== LOCKERS + SESSIONS (FLOW LƯU / LẤY ĐỒ) ==========
 
 def init_lockers_if_empty(num_lockers: int = 10):
@@ -113,7 +155,12 @@ def mark_locker_free(locker_id: str):
     )
 
 
-def create_locker_session(locker_id: str, face_embedding):
+def new_session_id() -> str:
+    """Sinh trước _id cho session để giữ tủ (claim_locker) trước khi insert session."""
+    return str(ObjectId())
+
+
+def create_locker_session(locker_id: str, face_embedding, session_id: str | None = None):
     """Tạo 1 phiên gửi đồ (session) gắn với locker_id, lưu face_embedding đã chuẩn hóa."""
     try:
         unit_vec = _to_unit_vector(face_embedding)
@@ -126,6 +173,8 @@ def create_locker_session(locker_id: str, face_embedding):
             "created_at": now,
             "closed_at": None,
         }
+        if session_id is not None:
+            doc["_id"] = ObjectId(session_id)
 
         result = locker_sessions_collection.insert_one(doc)
         session_id = str(result.inserted_id)
@@ -137,11 +186,12 @@ def create_locker_session(locker_id: str, face_embedding):
         raise HTTPException(status_code=500, detail="Failed to create locker session")
 
 
-def close_locker_session(session_id: str):
+def close_locker_session(session_id: str) -> bool:
+    """active -> closed; trả về False nếu session đã đóng trước đó (kết quả tra cứu cũ / request trùng)."""
     now = datetime.now(timezone.utc)
     try:
         result = locker_sessions_collection.update_one(
-            {"_id": ObjectId(session_id)},
+            {"_id": ObjectId(session_id), "status": "active"},
             {
                 "$set": {
                     "status": "closed",
@@ -156,6 +206,43 @@ def close_locker_session(session_id: str):
     except Exception as e:
         print(f"[MongoDB] Error closing locker session: {e}")
         raise HTTPException(status_code=500, detail="Failed to close locker session")
+    return result.matched_count == 1
+
+
+# ----- LOCKERS: ghi xuyên có điều kiện cho bảng trạng thái tủ (backend/locker_state.py) -----
+_LOCKER_STATE_FIELDS = {"_id": 0, "locker_id": 1, "status": 1, "current_session_id": 1,
+                        "bank": 1, "distance": 1, "updated_at": 1}
+
+
+def load_locker_states() -> list[dict]:
+    """Đọc trạng thái mọi tủ (không kèm dữ liệu khác) để dựng bảng trong bộ nhớ."""
+    return list(lockers_collection.find({}, _LOCKER_STATE_FIELDS))
+
+
+def get_locker_state(locker_id: str) -> dict | None:
+    return lockers_collection.find_one({"locker_id": locker_id}, _LOCKER_STATE_FIELDS)
+
+
+def claim_locker(locker_id: str, session_id: str) -> bool:
+    """free -> occupied chỉ khi tủ vẫn đang free trong DB (1 lệnh ghi, không đọc trước)."""
+    now = datetime.now(timezone.utc)
+    result = lockers_collection.update_one(
+        {"locker_id": locker_id, "status": "free"},
+        {"$set": {"status": "occupied", "current_session_id": session_id, "updated_at": now}},
+    )
+    print(f"[MongoDB] claim_locker({locker_id}) -> matched={result.matched_count}")
+    return result.matched_count == 1
+
+
+def release_held_locker(locker_id: str, session_id: str) -> bool:
+    """occupied -> free chỉ khi tủ vẫn do đúng session_id giữ."""
+    now = datetime.now(timezone.utc)
+    result = lockers_collection.update_one(
+        {"locker_id": locker_id, "status": "occupied", "current_session_id": session_id},
+        {"$set": {"status": "free", "current_session_id": None, "updated_at": now}},
+    )
+    print(f"[MongoDB] release_held_locker({locker_id}) -> matched={result.matched_count}")
+    return result.matched_count == 1
 
 
 # ----- LOCKERS helper (dùng cho /init_lockers) -----
@@ -201,9 +288,10 @@ def release_locker(locker_id):
     mark_locker_free(locker_id)
 
 
-def find_active_session_by_face(query_embedding):
+def find_active_session_by_face(query_embedding, exclude_ids=None):
     """
     Tìm session đang active có khuôn mặt giống nhất với query_embedding.
+    exclude_ids: session đã đóng nhưng chưa ghi xuống DB (chế độ write-behind).
 
     Trả về dict:
     {
@@ -215,32 +303,13 @@ def find_active_session_by_face(query_embedding):
     """
     try:
         query_vec = _to_unit_vector(query_embedding)
-        dim = len(query_vec)
 
+        match = {"status": "active"}
+        if exclude_ids:
+            match["_id"] = {"$nin": [ObjectId(sid) for sid in exclude_ids]}
         pipeline = [
-            {"$match": {"status": "active"}},
-            {
-                "$addFields": {
-                    "cosineSim": {
-                        "$reduce": {
-                            "input": {
-                                "$map": {
-                                    "input": {"$range": [0, dim]},
-                                    "as": "i",
-                                    "in": {
-                                        "$multiply": [
-                                            {"$arrayElemAt": ["$face_embedding", "$$i"]},
-                                            {"$arrayElemAt": [query_vec, "$$i"]},
-                                        ]
-                                    },
-                                }
-                            },
-                            "initialValue": 0,
-                            "in": {"$add": ["$$value", "$$this"]},
-                        }
-                    }
-                }
-            },
+            {"$match": match},
+            _cosine_sim_stage(query_vec),
             {"$sort": {"cosineSim": -1}},
             {"$limit": 1},
         ]
@@ -268,3 +337,127 @@ def find_active_session_by_face(query_embedding):
     except Exception as e:
         print(f"[MongoDB] Error finding active session by face: {e}")
         raise HTTPException(status_code=500, detail="Failed to find active session by face")
+
+
+def apply_session_records(records: list[dict]) -> dict:
+    """
+    Ghi 1 lô quyết định gửi / lấy đồ từ journal write-behind (backend/write_behind.py).
+
+    Mỗi lệnh lọc theo session_id (khoá idempotent) nên ghi lại cả lô sau khi crash không đổi kết quả:
+    - store   : upsert session với _id định trước ($setOnInsert), tủ free -> occupied bởi session này
+    - retrieve: session active -> closed, tủ do session này giữ -> free
+    Thứ tự trong lô được giữ (ordered=True) để store rồi retrieve cùng tủ áp dụng đúng trình tự.
+    """
+    session_ops, locker_ops = [], []
+    for rec in records:
+        oid = ObjectId(rec["session_id"])
+        at = datetime.fromisoformat(rec["at"])
+        if rec["op"] == "store":
+            session_ops.append(UpdateOne(
+                {"_id": oid},
+                {"$setOnInsert": {
+                    "locker_id": rec["locker_id"],
+                    "face_embedding": _to_unit_vector(rec["embedding"]),
+                    "status": "active",
+                    "created_at": at,
+                    "closed_at": None,
+                }},
+                upsert=True,
+            ))
+            locker_ops.append(UpdateOne(
+                {"locker_id": rec["locker_id"],
+                 "$or": [{"status": "free"}, {"current_session_id": rec["session_id"]}]},
+                {"$set": {"status": "occupied", "current_session_id": rec["session_id"], "updated_at": at}},
+            ))
+        elif rec["op"] == "retrieve":
+            session_ops.append(UpdateOne(
+                {"_id": oid, "status": "active"},
+                {"$set": {"status": "closed", "closed_at": at}},
+            ))
+            locker_ops.append(UpdateOne(
+                {"locker_id": rec["locker_id"], "current_session_id": rec["session_id"]},
+                {"$set": {"status": "free", "current_session_id": None, "updated_at": at}},
+            ))
+    sessions = locker_sessions_collection.bulk_write(session_ops, ordered=True) if session_ops else None
+    lockers = lockers_collection.bulk_write(locker_ops, ordered=True) if locker_ops else None
+    result = {
+        "sessions_upserted": sessions.upserted_count if sessions else 0,
+        "sessions_modified": sessions.modified_count if sessions else 0,
+        "lockers_matched": lockers.matched_count if lockers else 0,
+        "locker_ops": len(locker_ops),
+    }
+    print(f"[MongoDB] apply_session_records({len(records)}) -> {result}")
+    return result
+
+
+def load_active_sessions() -> list[dict]:
+    """Toàn bộ session active (_id, locker_id, face_embedding) để nạp chỉ mục shard."""
+    return list(
+        locker_sessions_collection.find(
+            {"status": "active"}, {"_id": 1, "locker_id": 1, "face_embedding": 1}
+        )
+    )
+
+
+def load_session_changes(since: datetime) -> tuple[list[dict], list[str]]:
+    """
+    Thay đổi session từ mốc `since` (bắt kịp sau khi nạp snapshot):
+    - opened: session còn active tạo từ `since` (_id, locker_id, face_embedding)
+    - closed: _id (str) các session đóng từ `since`
+    """
+    opened = list(
+        locker_sessions_collection.find(
+            {"status": "active", "created_at": {"$gte": since}},
+            {"_id": 1, "locker_id": 1, "face_embedding": 1},
+        )
+    )
+    closed = [str(doc["_id"]) for doc in locker_sessions_collection.find({"closed_at": {"$gte": since}}, {"_id": 1})]
+    print(f"[MongoDB] load_session_changes(since={since.isoformat()}) -> opened={len(opened)}, closed={len(closed)}")
+    return opened, closed
+
+
+# ========== FACES (GALLERY NHÂN VIÊN / ENROLLED USERS) ==========
+
+def insert_face_documents(docs: list[dict]) -> int:
+    """
+    Ghi 1 lô document khuôn mặt bằng insert_many (không theo thứ tự).
+    Bỏ qua document trùng (user_id, source) đã có sẵn -> chạy lại an toàn.
+    Trả về số document đã ghi mới.
+    """
+    if not docs:
+        return 0
+    try:
+        result = faces_collection.insert_many(docs, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        fatal = [err for err in errors if err.get("code") != 11000]
+        if fatal:
+            raise
+        inserted = e.details.get("nInserted", len(docs) - len(errors))
+        print(f"[MongoDB] insert_face_documents -> {inserted} mới, {len(errors)} đã tồn tại")
+        return inserted
+
+
+def find_similar_faces(query_embedding, top_k: int = 3):
+    """
+    Tìm top_k khuôn mặt trong gallery giống query_embedding nhất.
+
+    Trả về list dict: [{"user_id": "1", "name": "...", "cosineSim": 0.97}, ...]
+    """
+    try:
+        query_vec = _to_unit_vector(query_embedding)
+        pipeline = [
+            # Gallery có thể lẫn embedding của mô hình cũ khác số chiều
+            {"$match": {"face_embedding": {"$size": len(query_vec)}}},
+            _cosine_sim_stage(query_vec),
+            {"$sort": {"cosineSim": -1}},
+            {"$limit": top_k},
+            {"$project": {"_id": 0, "user_id": 1, "name": 1, "cosineSim": 1}},
+        ]
+        results = list(faces_collection.aggregate(pipeline))
+        print(f"[MongoDB] find_similar_faces -> {len(results)} kết quả")
+        return results
+    except Exception as e:
+        print(f"[MongoDB] Error finding similar faces: {e}")
+        raise HTTPException(status_code=500, detail="Failed to find similar faces")
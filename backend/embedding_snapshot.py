@@ -0,0 +1,144 @@
+"""
+Snapshot embedding ra file để khởi động lại nhanh (memory-map thay vì nạp lại toàn bộ từ Mongo).
+
+Định dạng file (1 file, ghi nguyên tử bằng file tạm + fsync + os.replace):
+    [0, 4096)        : MAGIC + header JSON (đệm bằng khoảng trắng)
+    [4096, ...)      : ma trận float32 (capacity, dim), C-order; chỉ `count` hàng đầu có dữ liệu,
+                       phần còn lại là chỗ trống để thêm session mà không phải cấp phát lại
+    sau ma trận      : JSON [[session_id, ...], [locker_id, ...]]
+
+Header: format, generation (tăng mỗi lần ghi), as_of (mốc thời gian dữ liệu), dim, count, capacity,
+crc32 của ids và của `count` hàng ma trận, meta (vd. shard_index / shard_count).
+
+load(): kiểm tra magic / format / crc32 của ids (nhỏ), map ma trận bằng np.memmap mode "c"
+(copy-on-write: trang chưa sửa dùng chung page cache, không đọc hết file). crc32 của ma trận
+kiểm tra sau bằng verify() (thread nền) để thời gian sẵn sàng không tăng theo số embedding.
+Người gọi bắt kịp phần thay đổi sau as_of - SNAPSHOT_CATCHUP_MARGIN_S (bù session ghi trễ
+bởi write-behind / đồng bộ outbox mang created_at cũ).
+"""
+
+import os
+import json
+import zlib
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+
+MAGIC = b"LKEMBSNP"
+FORMAT_VERSION = 1
+HEADER_SIZE = 4096
+SNAPSHOT_CATCHUP_MARGIN_S = float(os.getenv("SNAPSHOT_CATCHUP_MARGIN_S", "300"))
+
+
+class SnapshotError(Exception):
+    """File snapshot thiếu, sai định dạng hoặc sai checksum."""
+
+
+class Snapshot:
+    def __init__(self, path, header, session_ids, locker_ids, matrix, pristine):
+        self.path = path
+        self.header = header
+        self.session_ids = session_ids
+        self.locker_ids = locker_ids
+        self.matrix = matrix  # memmap (capacity, dim), mode "c": chỉ mục sửa trên bản này
+        self._pristine = pristine  # memmap mode "r" cùng inode, để verify() đọc đúng nội dung file
+
+    @property
+    def as_of(self):
+        return datetime.fromisoformat(self.header["as_of"])
+
+    @property
+    def catch_up_since(self):
+        return self.as_of - timedelta(seconds=SNAPSHOT_CATCHUP_MARGIN_S)
+
+    @property
+    def count(self):
+        return self.header["count"]
+
+    def verify(self):
+        """Tính crc32 của phần ma trận có dữ liệu (đọc cả file); sai thì ném SnapshotError."""
+        if self._pristine is None:
+            return
+        crc = zlib.crc32(np.ascontiguousarray(self._pristine[:self.count]).data)
+        if crc != self.header["crc32"]["matrix"]:
+            raise SnapshotError(f"{self.path}: checksum ma trận không khớp")
+
+
+def write(path, session_ids, locker_ids, matrix, as_of=None, meta=None, spare=0.25):
+    """
+    Ghi snapshot cho `len(session_ids)` hàng đầu của matrix. Trả về header đã ghi.
+    spare: tỉ lệ hàng trống để chỉ mục nạp từ snapshot thêm session không phải cấp phát lại ngay.
+    """
+    count = len(session_ids)
+    matrix = np.asarray(matrix[:count], dtype=np.float32)
+    dim = matrix.shape[1] if count else 0
+    capacity = count + max(256, int(count * spare))
+    ids = json.dumps([list(session_ids), list(locker_ids)], separators=(",", ":")).encode("utf-8")
+
+    # File cũ hỏng / khác format: bắt đầu lại từ thế hệ 0, vẫn ghi đè được
+    try:
+        previous = read_header(path) if os.path.exists(path) else {}
+    except (SnapshotError, OSError):
+        previous = {}
+    header = {
+        "format": FORMAT_VERSION,
+        "generation": previous.get("generation", 0) + 1,
+        "as_of": (as_of or datetime.now(timezone.utc)).isoformat(),
+        "dim": dim,
+        "count": count,
+        "capacity": capacity,
+        "ids_offset": HEADER_SIZE + capacity * dim * 4,
+        "ids_length": len(ids),
+        "crc32": {"matrix": zlib.crc32(np.ascontiguousarray(matrix).data), "ids": zlib.crc32(ids)},
+        "meta": meta or {},
+    }
+    raw = MAGIC + json.dumps(header).encode("utf-8")
+    if len(raw) > HEADER_SIZE:
+        raise SnapshotError("Header snapshot quá lớn")
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw.ljust(HEADER_SIZE, b" "))
+        f.write(matrix.tobytes())
+        f.write(b"\0" * ((capacity - count) * dim * 4))
+        f.write(ids)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return header
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    if not raw.startswith(MAGIC):
+        raise SnapshotError(f"{path}: không phải file snapshot")
+    try:
+        header = json.loads(raw[len(MAGIC):].rstrip(b" "))
+    except ValueError as e:
+        raise SnapshotError(f"{path}: header hỏng ({e})")
+    if header.get("format") != FORMAT_VERSION:
+        raise SnapshotError(f"{path}: format {header.get('format')} không hỗ trợ (cần {FORMAT_VERSION})")
+    return header
+
+
+def load(path):
+    """Map snapshot; ném SnapshotError nếu file không dùng được (người gọi nạp lại toàn bộ)."""
+    if not os.path.exists(path):
+        raise SnapshotError(f"{path}: chưa có snapshot")
+    header = read_header(path)
+    with open(path, "rb") as f:
+        f.seek(header["ids_offset"])
+        ids = f.read(header["ids_length"])
+    if len(ids) != header["ids_length"] or zlib.crc32(ids) != header["crc32"]["ids"]:
+        raise SnapshotError(f"{path}: danh sách id bị cắt cụt hoặc sai checksum")
+    session_ids, locker_ids = json.loads(ids)
+
+    matrix = pristine = None
+    if header["dim"]:
+        shape = (header["capacity"], header["dim"])
+        # Map ngay cả 2 bản: file có bị snapshot mới thay thế sau đó thì vẫn trỏ đúng inode này
+        matrix = np.memmap(path, dtype=np.float32, mode="c", offset=HEADER_SIZE, shape=shape)
+        pristine = np.memmap(path, dtype=np.float32, mode="r", offset=HEADER_SIZE, shape=shape)
+    return Snapshot(path, header, session_ids, locker_ids, matrix, pristine)
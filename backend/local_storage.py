@@ -0,0 +1,346 @@
+"""
+Backend lưu trữ nhúng cho kiosk offline / edge (STORAGE_BACKEND=local).
+
+- Trạng thái tủ + session: SQLite (WAL, synchronous=NORMAL) trong LOCAL_STORAGE_DIR/locker.db.
+  Mỗi lệnh cấp / trả tủ là 1 UPDATE có điều kiện trên file cục bộ, không qua mạng.
+- Embedding của session: ma trận float32 (capacity, D) trong LOCAL_STORAGE_DIR/embeddings.npy
+  (memmap). sessions.row trỏ vào hàng của ma trận; hàng của session đã đóng được dùng lại.
+  Session active được giữ thêm trong SessionIndex nên tra cứu khuôn mặt là 1 phép nhân ma trận.
+- Đồng bộ lên Mongo: mỗi lần gửi / lấy đồ ghi thêm 1 bản ghi vào bảng outbox (cùng transaction),
+  cùng định dạng với journal write-behind. Khi có MONGODB_URI, thread nền đẩy outbox bằng
+  db_utils.apply_session_records (idempotent theo session_id) mỗi LOCAL_SYNC_SECONDS, mất mạng
+  thì giữ lại và thử lại với backoff tới LOCAL_SYNC_MAX_BACKOFF_S. Không đồng bộ (thiếu MONGODB_URI
+  hoặc LOCAL_SYNC_ENABLED=0) thì không ghi outbox, để kiosk offline hẳn không phình file.
+- Chỉ mục, bộ cấp hàng embedding và memmap nằm trong 1 process: chỉ chạy với 1 worker
+  (backend/prefork.py từ chối WEB_CONCURRENCY > 1).
+
+Độ bền: WAL + synchronous=NORMAL không fsync mỗi commit (crash process không mất dữ liệu,
+mất điện có thể mất vài giao dịch cuối). Hàng embedding được flush xuống file trước khi COMMIT
+session trỏ tới nó (kể cả khi không đồng bộ Mongo), nên session đã commit luôn có embedding.
+Session có embedding hỏng (toàn 0) lúc khởi động bị bỏ qua khỏi chỉ mục và được log.
+Gallery khuôn mặt (find_similar_faces) chỉ có trên Mongo: chế độ local trả về danh sách rỗng.
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+from bson import ObjectId
+from fastapi import HTTPException
+
+from backend.session_index import SessionIndex
+from backend.storage import StorageBackend
+
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "./data/local_store")
+LOCAL_SYNC_ENABLED = os.getenv("LOCAL_SYNC_ENABLED", "1").lower() in ("1", "true", "yes")
+LOCAL_SYNC_SECONDS = float(os.getenv("LOCAL_SYNC_SECONDS", "5"))
+LOCAL_SYNC_BATCH = int(os.getenv("LOCAL_SYNC_BATCH", "200"))
+LOCAL_SYNC_MAX_BACKOFF_S = float(os.getenv("LOCAL_SYNC_MAX_BACKOFF_S", "300"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lockers (
+    locker_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'free',
+    current_session_id TEXT,
+    bank TEXT,
+    distance REAL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    locker_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    row INTEGER,
+    created_at TEXT NOT NULL,
+    closed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_status ON sessions(status);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    record TEXT NOT NULL
+);
+"""
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class EmbeddingFile:
+    """Ma trận embedding (capacity, D) float32 trong 1 file .npy, mở bằng memmap; tăng gấp đôi khi đầy."""
+
+    def __init__(self, path, capacity=1024):
+        self.path = path
+        self.initial_capacity = capacity
+        self.matrix = np.load(path, mmap_mode="r+") if os.path.exists(path) else None
+
+    @property
+    def dim(self):
+        return None if self.matrix is None else self.matrix.shape[1]
+
+    def _open(self, capacity, dim, copy_rows=0):
+        tmp = self.path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if copy_rows:
+            grown[:copy_rows] = self.matrix[:copy_rows]
+        grown.flush()
+        del grown
+        os.replace(tmp, self.path)
+        self.matrix = np.load(self.path, mmap_mode="r+")
+
+    def write(self, row, vec):
+        if self.matrix is None:
+            self._open(max(self.initial_capacity, row + 1), vec.shape[0])
+        elif vec.shape[0] != self.dim:
+            raise ValueError(f"Embedding {vec.shape[0]} chiều, file {self.dim} chiều")
+        elif row >= len(self.matrix):
+            self._open(max(2 * len(self.matrix), row + 1), self.dim, copy_rows=len(self.matrix))
+        self.matrix[row] = vec
+
+    def read(self, row):
+        return np.array(self.matrix[row])
+
+    def flush(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+
+
+class LocalStorage(StorageBackend):
+    name = "local"
+
+    def __init__(self, directory=LOCAL_STORAGE_DIR, sync=LOCAL_SYNC_ENABLED):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(directory, "locker.db"),
+                                     check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._embeddings = EmbeddingFile(os.path.join(directory, "embeddings.npy"))
+        self._index = SessionIndex()
+        self._free_rows = []
+        self._next_row = 0
+        self._load_index()
+
+        self.sync_stats = {"synced": 0, "batches": 0, "retries": 0, "last_error": None, "last_sync_at": None}
+        self._wake = threading.Event()
+        self._thread = None
+        self._outbox = bool(sync and os.getenv("MONGODB_URI"))
+        if self._outbox:
+            self._thread = threading.Thread(target=self._sync_loop, name="local-sync", daemon=True)
+            self._thread.start()
+        print(f"[LocalStore] {directory}: {len(self._index)} session active, "
+              f"đồng bộ Mongo {'bật' if self._thread else 'tắt'}")
+
+    def _load_index(self):
+        rows = self._conn.execute("SELECT session_id, locker_id, row FROM sessions WHERE status = 'active'").fetchall()
+        used = set()
+        for rec in rows:
+            if rec["row"] is None or self._embeddings.matrix is None or rec["row"] >= len(self._embeddings.matrix):
+                print(f"[LocalStore] Session {rec['session_id']} không có embedding, bỏ khỏi chỉ mục")
+                continue
+            used.add(rec["row"])
+            try:
+                self._index.add(rec["session_id"], rec["locker_id"], self._embeddings.read(rec["row"]))
+            except ValueError:
+                print(f"[LocalStore] Embedding của session {rec['session_id']} hỏng, bỏ khỏi chỉ mục")
+        self._next_row = max(used) + 1 if used else 0
+        self._free_rows = [row for row in range(self._next_row) if row not in used]
+
+    def _append_outbox(self, record):
+        """Ghi 1 bản ghi chờ đồng bộ (trong transaction của người gọi); bỏ qua khi không đồng bộ Mongo."""
+        if self._outbox:
+            self._conn.execute("INSERT INTO outbox (record) VALUES (?)", (json.dumps(record, separators=(",", ":")),))
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    # ----- tủ -----
+    def init_lockers_if_empty(self, num_lockers=10):
+        count = self._execute("SELECT COUNT(*) FROM lockers").fetchone()[0]
+        if count > 0:
+            print(f"[LocalStore] Lockers already initialized ({count} lockers).")
+            return
+        self.create_lockers(num_lockers)
+        print(f"[LocalStore] Initialized {num_lockers} lockers.")
+
+    def create_lockers(self, count):
+        now = _now()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            created = 0
+            for i in range(1, count + 1):
+                cur = self._conn.execute(
+                    "INSERT OR IGNORE INTO lockers (locker_id, status, created_at, updated_at) VALUES (?, 'free', ?, ?)",
+                    (f"L{i:02d}", now, now),
+                )
+                created += cur.rowcount
+            self._conn.execute("COMMIT")
+        return created
+
+    @staticmethod
+    def _locker_doc(rec):
+        # Bỏ field NULL để giống document Mongo (locker_state dùng doc.get(..., mặc định))
+        doc = {key: rec[key] for key in ("locker_id", "status", "current_session_id", "bank", "distance")
+               if rec[key] is not None or key == "current_session_id"}
+        doc["updated_at"] = datetime.fromisoformat(rec["updated_at"])
+        return doc
+
+    def load_locker_states(self):
+        return [self._locker_doc(rec) for rec in self._execute("SELECT * FROM lockers").fetchall()]
+
+    def get_locker_state(self, locker_id):
+        rec = self._execute("SELECT * FROM lockers WHERE locker_id = ?", (locker_id,)).fetchone()
+        return self._locker_doc(rec) if rec else None
+
+    def claim_locker(self, locker_id, session_id):
+        cur = self._execute(
+            "UPDATE lockers SET status = 'occupied', current_session_id = ?, updated_at = ? "
+            "WHERE locker_id = ? AND status = 'free'",
+            (session_id, _now(), locker_id),
+        )
+        return cur.rowcount == 1
+
+    def release_held_locker(self, locker_id, session_id):
+        cur = self._execute(
+            "UPDATE lockers SET status = 'free', current_session_id = NULL, updated_at = ? "
+            "WHERE locker_id = ? AND status = 'occupied' AND current_session_id = ?",
+            (_now(), locker_id, session_id),
+        )
+        return cur.rowcount == 1
+
+    # ----- session -----
+    def new_session_id(self):
+        # ObjectId để bản ghi outbox ghi thẳng được làm _id bên Mongo
+        return str(ObjectId())
+
+    def create_locker_session(self, locker_id, face_embedding, session_id=None):
+        vec = SessionIndex._unit(face_embedding)
+        session_id = session_id or self.new_session_id()
+        now = _now()
+        record = {"op": "store", "session_id": session_id, "locker_id": locker_id, "at": now,
+                  "embedding": vec.astype(float).tolist()}
+        with self._lock:
+            row = self._free_rows.pop() if self._free_rows else self._next_row
+            try:
+                self._embeddings.write(row, vec)
+                # Embedding xuống đĩa trước, session trỏ tới nó commit sau / row before the row pointer
+                self._embeddings.flush()
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, locker_id, status, row, created_at) VALUES (?, ?, 'active', ?, ?)",
+                    (session_id, locker_id, row, now),
+                )
+                self._append_outbox(record)
+                self._conn.execute("COMMIT")
+            except (sqlite3.Error, OSError, ValueError) as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                if row < self._next_row:
+                    self._free_rows.append(row)
+                print(f"[LocalStore] Error creating locker session: {e}")
+                raise HTTPException(status_code=500, detail="Failed to create locker session")
+            self._next_row = max(self._next_row, row + 1)
+            self._index.add(session_id, locker_id, vec)
+        print(f"[LocalStore] create_locker_session -> locker_id={locker_id}, session_id={session_id}")
+        return session_id
+
+    def close_locker_session(self, session_id):
+        now = _now()
+        with self._lock:
+            rec = self._conn.execute(
+                "SELECT locker_id, row FROM sessions WHERE session_id = ? AND status = 'active'", (session_id,)
+            ).fetchone()
+            if rec is None:
+                print(f"[LocalStore] close_locker_session({session_id}) -> không có session active")
+                return False
+            record = {"op": "retrieve", "session_id": session_id, "locker_id": rec["locker_id"], "at": now}
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.execute(
+                    "UPDATE sessions SET status = 'closed', closed_at = ?, row = NULL WHERE session_id = ?",
+                    (now, session_id),
+                )
+                self._append_outbox(record)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                print(f"[LocalStore] Error closing locker session: {e}")
+                raise HTTPException(status_code=500, detail="Failed to close locker session")
+            self._index.remove(session_id)
+            if rec["row"] is not None:
+                self._free_rows.append(rec["row"])
+        return True
+
+    def find_active_session_by_face(self, query_embedding, exclude_ids=None):
+        # Không có write-behind ở chế độ local nên exclude_ids luôn rỗng
+        return self._index.best(query_embedding)
+
+    def load_active_sessions(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, locker_id, row FROM sessions WHERE status = 'active' AND row IS NOT NULL"
+            ).fetchall()
+            return [{"_id": rec["session_id"], "locker_id": rec["locker_id"],
+                     "face_embedding": self._embeddings.read(rec["row"]).astype(float).tolist()} for rec in rows]
+
+    def find_similar_faces(self, query_embedding, top_k=3):
+        return []
+
+    # ----- đồng bộ lên Mongo -----
+    def sync_once(self):
+        """Đẩy 1 lô outbox lên Mongo; trả về số bản ghi đã đẩy. Lỗi mạng / Mongo được ném ra."""
+        rows = self._execute("SELECT seq, record FROM outbox ORDER BY seq LIMIT ?", (LOCAL_SYNC_BATCH,)).fetchall()
+        if not rows:
+            return 0
+        # Import lúc cần: db_utils kết nối Mongo ngay khi import; import lỗi (mất mạng) sẽ được thử lại
+        from backend import db_utils
+
+        db_utils.apply_session_records([json.loads(rec["record"]) for rec in rows])
+        self._execute("DELETE FROM outbox WHERE seq <= ?", (rows[-1]["seq"],))
+        self.sync_stats["synced"] += len(rows)
+        self.sync_stats["batches"] += 1
+        self.sync_stats["last_sync_at"] = _now()
+        return len(rows)
+
+    def _sync_loop(self):
+        backoff = LOCAL_SYNC_SECONDS
+        offline = False
+        while True:
+            self._wake.wait(backoff)
+            self._wake.clear()
+            try:
+                while self.sync_once() == LOCAL_SYNC_BATCH:
+                    pass
+                if offline:
+                    print("[LocalStore] Kết nối Mongo đã trở lại, outbox đã đồng bộ")
+                offline = False
+                backoff = LOCAL_SYNC_SECONDS
+            except Exception as e:
+                self.sync_stats["retries"] += 1
+                self.sync_stats["last_error"] = f"{type(e).__name__}: {e}"
+                if not offline:
+                    print(f"[LocalStore] Không đồng bộ được lên Mongo ({e}), giữ outbox và thử lại")
+                offline = True
+                backoff = min(LOCAL_SYNC_MAX_BACKOFF_S, max(backoff * 2, 1.0))
+
+    def sync_now(self):
+        self._wake.set()
+
+    def close(self):
+        with self._lock:
+            self._embeddings.flush()
+            self._conn.close()
+
+    def stats(self):
+        pending = self._execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        return {"backend": self.name, "directory": self.directory, "active_sessions": len(self._index),
+                "sync_enabled": self._thread is not None, "outbox_pending": pending, **self.sync_stats}
@@ -0,0 +1,276 @@
+"""
+Bảng trạng thái tủ trong bộ nhớ, ghi xuyên (write-through) xuống backend lưu trữ (backend/storage.py).
+
+- Nạp toàn bộ collection lockers lúc khởi động; cấp tủ / đếm tủ không cần đọc DB.
+- Mỗi bank (field `bank` của locker, mặc định "default") giữ 1 free-list theo chính sách cấp tủ:
+    lowest_id : bitset theo thứ tự locker_id, lấy bit thấp nhất
+    nearest   : bitset theo field `distance` (khoảng cách tới kiosk), gần nhất trước
+    lru       : tủ được trả lâu nhất được cấp trước (dàn đều độ mòn)
+  Thêm chính sách mới bằng register_policy(name, factory).
+- Mỗi lần cấp / trả tủ là 1 lệnh update_one có điều kiện (status free / đúng session giữ tủ).
+  Điều kiện không khớp nghĩa là DB đã đổi ở nơi khác (worker khác khi WEB_CONCURRENCY > 1,
+  sửa tay): tủ đó được nạp lại từ DB và thử tủ kế tiếp.
+- Thread nền nạp lại cả bảng mỗi LOCKER_STATE_RESYNC_SECONDS (các worker khác có thể đã trả tủ);
+  đọc DB nằm ngoài lock, thay đổi cấp / trả tủ xảy ra trong lúc đọc được áp lại lên bảng mới.
+  Trên đường request chỉ còn lệnh claim_locker có điều kiện; riêng khi hết tủ trống mới nạp lại ngay.
+
+Cấu hình: LOCKER_ALLOCATION_POLICY (lowest_id | nearest | lru), LOCKER_STATE_RESYNC_SECONDS.
+
+write_through=False (chế độ write-behind, backend/write_behind.py): bảng là nguồn sự thật duy nhất,
+cấp / trả tủ chỉ đổi bộ nhớ, không nạp lại định kỳ; load() gọi lại (vd. /init_lockers) chỉ thêm tủ mới
+từ DB, tủ đã có giữ nguyên trạng thái trong bộ nhớ.
+"""
+
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from backend.storage import get_storage
+
+LOCKER_ALLOCATION_POLICY = os.getenv("LOCKER_ALLOCATION_POLICY", "lowest_id")
+LOCKER_STATE_RESYNC_SECONDS = float(os.getenv("LOCKER_STATE_RESYNC_SECONDS", "30"))
+DEFAULT_BANK = "default"
+_EPOCH = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def _natural_key(locker_id):
+    """L2 < L10: so sánh phần số theo giá trị."""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", locker_id)]
+
+
+class RankedBitsetPolicy:
+    """Free-list dạng bitset trên danh sách tủ đã xếp hạng; cấp tủ = bit thấp nhất."""
+
+    def __init__(self, lockers, key):
+        self.order = sorted(lockers, key=lambda locker_id: key(lockers[locker_id]))
+        self.index = {locker_id: i for i, locker_id in enumerate(self.order)}
+        self.mask = 0
+
+    def add(self, locker_id):
+        self.mask |= 1 << self.index[locker_id]
+
+    def discard(self, locker_id):
+        self.mask &= ~(1 << self.index[locker_id])
+
+    def pop(self):
+        if not self.mask:
+            return None
+        lowest = self.mask & -self.mask
+        self.mask ^= lowest
+        return self.order[lowest.bit_length() - 1]
+
+    def __len__(self):
+        return bin(self.mask).count("1")
+
+
+class LeastRecentlyUsedPolicy:
+    """Free-list FIFO: tủ được trả sớm nhất (nghỉ lâu nhất) được cấp trước."""
+
+    def __init__(self, lockers):
+        self.free = OrderedDict()
+
+    def add(self, locker_id):
+        self.free[locker_id] = None
+        self.free.move_to_end(locker_id)
+
+    def discard(self, locker_id):
+        self.free.pop(locker_id, None)
+
+    def pop(self):
+        return self.free.popitem(last=False)[0] if self.free else None
+
+    def __len__(self):
+        return len(self.free)
+
+
+ALLOCATION_POLICIES = {
+    "lowest_id": lambda lockers: RankedBitsetPolicy(lockers, key=lambda doc: _natural_key(doc["locker_id"])),
+    "nearest": lambda lockers: RankedBitsetPolicy(
+        lockers, key=lambda doc: (doc.get("distance", float("inf")), _natural_key(doc["locker_id"]))
+    ),
+    "lru": LeastRecentlyUsedPolicy,
+}
+
+
+def register_policy(name, factory):
+    """factory(lockers: {locker_id: doc}) -> đối tượng có add / discard / pop / __len__."""
+    ALLOCATION_POLICIES[name] = factory
+
+
+class LockerTable:
+    def __init__(self, policy=LOCKER_ALLOCATION_POLICY, resync_seconds=LOCKER_STATE_RESYNC_SECONDS,
+                 write_through=True, storage=None):
+        if policy not in ALLOCATION_POLICIES:
+            raise ValueError(f"LOCKER_ALLOCATION_POLICY không hợp lệ: {policy} ({' | '.join(ALLOCATION_POLICIES)})")
+        self.policy = policy
+        self.storage = storage or get_storage()
+        self.write_through = write_through
+        self.resync_seconds = resync_seconds if write_through else 0
+        self._lock = threading.RLock()
+        self._lockers = {}
+        self._banks = {}
+        self._bank_sizes = {}
+        self._loaded_at = 0.0
+        self._recorders = []  # mỗi lần load đang đọc DB: {locker_id: (status, session_id)} đổi trong lúc đó
+        self._stop = threading.Event()
+        self._thread = None
+        self.conflicts = 0
+
+    # ----- nạp từ DB -----
+    def load(self):
+        changes = {}
+        with self._lock:
+            self._recorders.append(changes)
+        try:
+            docs = self.storage.load_locker_states()
+        finally:
+            with self._lock:
+                self._recorders.remove(changes)
+        with self._lock:
+            # Cấp / trả tủ trong lúc đọc DB mới hơn bản vừa đọc: áp lại / replay changes made meanwhile
+            for doc in docs:
+                if doc["locker_id"] in changes:
+                    status, session_id = changes[doc["locker_id"]]
+                    doc.update(status=status, current_session_id=session_id)
+            if not self.write_through:
+                # Write-behind: DB chưa có các lần cấp / trả đang nằm trong journal, nên tủ đã biết giữ
+                # trạng thái trong bộ nhớ; lần nạp lại (vd. /init_lockers) chỉ thêm tủ mới
+                for doc in docs:
+                    known = self._lockers.get(doc["locker_id"])
+                    if known is not None:
+                        doc.update(status=known.get("status"), current_session_id=known.get("current_session_id"),
+                                   updated_at=known.get("updated_at"))
+            self._lockers = {doc["locker_id"]: doc for doc in docs}
+            by_bank = {}
+            for doc in docs:
+                by_bank.setdefault(doc.get("bank") or DEFAULT_BANK, {})[doc["locker_id"]] = doc
+            self._banks = {bank: ALLOCATION_POLICIES[self.policy](lockers) for bank, lockers in by_bank.items()}
+            self._bank_sizes = {bank: len(lockers) for bank, lockers in by_bank.items()}
+            # Thêm theo thứ tự updated_at để LRU bắt đầu từ tủ nghỉ lâu nhất
+            for doc in sorted(docs, key=lambda d: d.get("updated_at") or _EPOCH):
+                if doc.get("status") == "free":
+                    self._banks[doc.get("bank") or DEFAULT_BANK].add(doc["locker_id"])
+            self._loaded_at = time.monotonic()
+        print(f"[Lockers] Nạp {len(docs)} tủ, {len(self._banks)} bank, policy={self.policy}")
+
+    def _record(self, locker_id, status, session_id):
+        for changes in self._recorders:
+            changes[locker_id] = (status, session_id)
+
+    def _resync_loop(self):
+        while not self._stop.wait(self.resync_seconds):
+            try:
+                self.load()
+            except Exception as e:
+                print(f"[Lockers] Nạp lại bảng tủ lỗi: {e}")
+
+    def start(self):
+        """Bật thread nạp lại định kỳ (chỉ chế độ ghi xuyên)."""
+        if self.resync_seconds and self._thread is None:
+            self._thread = threading.Thread(target=self._resync_loop, name="locker-resync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh(self, locker_id):
+        """Nạp lại 1 tủ sau khi lệnh ghi có điều kiện không khớp."""
+        doc = self.storage.get_locker_state(locker_id)
+        old = self._lockers.get(locker_id)
+        if doc is None or old is None or (doc.get("bank") or DEFAULT_BANK) != (old.get("bank") or DEFAULT_BANK):
+            self.load()  # tủ mới / bị xoá / đổi bank: dựng lại cả bảng
+            return
+        self._lockers[locker_id] = doc
+        self._record(locker_id, doc.get("status"), doc.get("current_session_id"))
+        bank = self._banks[doc.get("bank") or DEFAULT_BANK]
+        if doc.get("status") == "free":
+            bank.add(locker_id)
+        else:
+            bank.discard(locker_id)
+
+    # ----- cấp / trả tủ -----
+    def _pop(self, bank):
+        banks = [bank] if bank in self._banks else []
+        banks += [name for name in self._banks if name != bank]
+        for name in banks:
+            locker_id = self._banks[name].pop()
+            if locker_id is not None:
+                return locker_id
+        return None
+
+    def allocate(self, session_id, bank=None):
+        """Cấp 1 tủ trống cho session_id (ưu tiên `bank`); trả về locker_id hoặc None nếu hết tủ."""
+        with self._lock:
+            resynced = False
+            while True:
+                locker_id = self._pop(bank)
+                if locker_id is None:
+                    if resynced or not self.write_through:
+                        return None
+                    self.load()
+                    resynced = True
+                    continue
+                if not self.write_through or self.storage.claim_locker(locker_id, session_id):
+                    doc = self._lockers[locker_id]
+                    doc.update(status="occupied", current_session_id=session_id, updated_at=datetime.now(timezone.utc))
+                    self._record(locker_id, "occupied", session_id)
+                    return locker_id
+                self.conflicts += 1
+                self._refresh(locker_id)
+
+    def release(self, locker_id, session_id):
+        """Trả tủ do session_id giữ; trả về False nếu DB cho thấy tủ không còn do session này giữ."""
+        with self._lock:
+            if not self.write_through:
+                doc = self._lockers.get(locker_id)
+                if doc is None or doc.get("current_session_id") != session_id:
+                    return False
+            elif not self.storage.release_held_locker(locker_id, session_id):
+                self.conflicts += 1
+                self._refresh(locker_id)
+                return False
+            doc = self._lockers.get(locker_id)
+            if doc is None:
+                self.load()
+                return True
+            doc.update(status="free", current_session_id=None, updated_at=datetime.now(timezone.utc))
+            self._record(locker_id, "free", None)
+            self._banks[doc.get("bank") or DEFAULT_BANK].add(locker_id)
+            return True
+
+    def apply(self, locker_id, session_id):
+        """Đặt trạng thái 1 tủ trong bộ nhớ (session_id=None: free), dùng khi replay journal."""
+        with self._lock:
+            doc = self._lockers.get(locker_id)
+            if doc is None:
+                return
+            bank = self._banks[doc.get("bank") or DEFAULT_BANK]
+            if session_id is None:
+                doc.update(status="free", current_session_id=None)
+                bank.add(locker_id)
+            else:
+                doc.update(status="occupied", current_session_id=session_id)
+                bank.discard(locker_id)
+            self._record(locker_id, doc["status"], session_id)
+
+    def bank_of(self, locker_id):
+        doc = self._lockers.get(locker_id)
+        return (doc.get("bank") if doc else None) or DEFAULT_BANK
+
+    # ----- thống kê -----
+    def summary(self):
+        with self._lock:
+            total = len(self._lockers)
+            free = sum(len(bank) for bank in self._banks.values())
+            banks = {name: {"total": self._bank_sizes[name], "free": len(bank)} for name, bank in self._banks.items()}
+            return {
+                "total_lockers": total,
+                "free_lockers": free,
+                "occupied_lockers": total - free,
+                "banks": banks,
+                "policy": self.policy,
+                "conflicts": self.conflicts,
+            }
@@ -1,17 +1,29 @@
 # backend/main.py
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from pydantic import BaseModel
 import os
+import hmac
+import time
+import asyncio
 import numpy as np
 import cv2
 from typing import List
 
-from backend.db_utils import lockers_collection
 from app.box_detector import Detector
-from backend import db_utils
+from app.motion_gate import MotionGateRegistry
+from app.resolution_policy import ResolutionPolicyRegistry
+from backend import db_metrics, profiling
+from backend.prefork import require_single_process
+from backend.storage import get_storage
+from backend.locker_state import LockerTable
+from backend.scatter_gather import ShardCoordinator, SHARD_NODES
+from backend.write_behind import WriteBehindQueue, WRITE_BEHIND_ENABLED
+from backend.scheduler import InferenceScheduler, Overloaded, INTERACTIVE, PREVIEW
+from backend.crop_trust import CropTrustPolicy, CropRejected
+from backend.capture_service import CaptureService, CAPTURE_SOURCES, summarize
 
 app = FastAPI(
     title="Smart Locker System using Facial Recognition",
@@ -21,8 +33,50 @@ app = FastAPI(
 
 detector = Detector()
 
+# Cổng chuyển động theo camera cho frame preview (MOTION_GATE_ENABLED / MOTION_GATE_CAMERAS)
+motion_gates = MotionGateRegistry()
+
+# imgsz theo camera cho frame preview; /store, /retrieve mỗi request 1 policy mới (không dùng chung trạng thái)
+resolution_policies = ResolutionPolicyRegistry()
+
+# Hàng đợi suy luận: /store, /retrieve chạy trước frame preview; preview quá tải bị trả 503
+scheduler = InferenceScheduler()
+
+# Khi nào tin ảnh khuôn mặt kiosk tự cắt (/store_crop, /retrieve_crop), xem backend/crop_trust.py
+crop_policy = CropTrustPolicy()
+
+# Backend lưu trữ (STORAGE_BACKEND): mongo hoặc local (SQLite + file embedding, đồng bộ Mongo khi có mạng)
+storage = get_storage()
+
 # Khởi tạo danh sách tủ nếu cần
-db_utils.init_lockers_if_empty(num_lockers=12)
+storage.init_lockers_if_empty(num_lockers=12)
+
+# Trạng thái tủ trong bộ nhớ: cấp tủ / đếm tủ không đọc DB, ghi xuyên có điều kiện
+# WRITE_BEHIND_ENABLED: quyết định ghi journal cục bộ rồi trả lời ngay, thread nền ghi xuống Mongo.
+# Journal + bảng tủ là của 1 process nên không cho chạy nhiều worker (tương tự STORAGE_BACKEND=local, CAPTURE_SOURCES).
+require_single_process()
+if WRITE_BEHIND_ENABLED and storage.name != "mongo":
+    print(f"[WriteBehind] Bỏ qua WRITE_BEHIND_ENABLED: backend {storage.name} đã ghi cục bộ")
+write_behind = WriteBehindQueue(storage=storage) if WRITE_BEHIND_ENABLED and storage.name == "mongo" else None
+locker_table = LockerTable(write_through=write_behind is None, storage=storage)
+locker_table.load()
+locker_table.start()
+if write_behind is not None:
+    write_behind.replay(locker_table)
+    write_behind.start()
+
+# Tra cứu session theo khuôn mặt trên nhiều node shard (SHARD_NODES); rỗng = hỏi thẳng backend lưu trữ
+shards = ShardCoordinator(SHARD_NODES) if SHARD_NODES else None
+
+# Camera sảnh kéo trực tiếp (CAPTURE_SOURCES): frame mọi camera gom batch qua hàng đợi suy luận chung.
+# Kết quả chỉ nằm trong process này nên require_single_process() ở trên đã từ chối nhiều worker.
+capture = None
+if CAPTURE_SOURCES:
+    capture = CaptureService(
+        CAPTURE_SOURCES,
+        lambda frames, policies: scheduler.submit(PREVIEW, detector.process_batch, frames, policies).result(),
+    )
+    capture.start()
 
 # ----------------- CORS -----------------
 app.add_middleware(
@@ -49,14 +103,33 @@ class RetrieveResponse(BaseModel):
 
 
 # Ngưỡng để quyết định cho mở tủ khi LẤY ĐỒ
-UNLOCK_THRESHOLD = 0.93
+# (hiệu chỉnh bằng scripts/calibrate_thresholds.py, ghi đè qua biến môi trường)
+UNLOCK_THRESHOLD = float(os.getenv("UNLOCK_THRESHOLD", "0.93"))
 # Ngưỡng để coi là "mặt đã có tủ đang gửi đồ"
-EXISTING_FACE_THRESHOLD = 0.95
+EXISTING_FACE_THRESHOLD = float(os.getenv("EXISTING_FACE_THRESHOLD", "0.95"))
+
+
+async def _infer(priority, fn, *args):
+    """Chạy fn trên thread suy luận theo độ ưu tiên; quá tải -> 503 + Retry-After."""
+    try:
+        return await scheduler.run(priority, fn, *args)
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+
+async def _find_active_session(embedding):
+    """Session active giống nhất + cờ `complete` (False khi có shard không trả lời)."""
+    if shards is None:
+        if write_behind is not None:
+            return write_behind.find_active_session(embedding), True
+        return storage.find_active_session_by_face(embedding), True
+    result = await shards.match(embedding)
+    return result["match"], result["complete"]
 
 
 # ----------------- API: process_frame (debug) -----------------
 @app.post("/process_frame")
-async def process_frame(file: UploadFile = File(...)):
+async def process_frame(file: UploadFile = File(...), camera_id: str = Form("default")):
     contents = await file.read()
     nparr = np.frombuffer(contents, np.uint8)
     frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
@@ -64,30 +137,38 @@ async def process_frame(file: UploadFile = File(...)):
     if frame is None:
         raise HTTPException(status_code=400, detail="Không đọc được ảnh từ file upload")
 
-    person_count, face_count, person_boxes, face_boxes = detector.process_frame(frame)
-
-    face_boxes_for_response = []
-    for (coords, conf, emotion, embedding) in face_boxes:
-        if embedding is not None:
-            similar_faces = db_utils.find_similar_faces(embedding, top_k=3)
-            face_names = [face.get("name") for face in similar_faces]
-            face_boxes_for_response.append(
-                {
-                    "coords": coords,
-                    "confidence": conf,
-                    "emotion": emotion,
-                    "similar_faces": face_names,
-                }
-            )
-        else:
-            face_boxes_for_response.append(
-                {
-                    "coords": coords,
-                    "confidence": conf,
-                    "emotion": emotion,
-                    "similar_faces": [],
-                }
-            )
+    # Frame preview đi qua cổng chuyển động: không có gì thay đổi thì dùng lại kết quả trước
+    gate = motion_gates.get(camera_id)
+    policy = resolution_policies.get(camera_id)
+    result, gated = await _infer(PREVIEW, gate.run, frame, lambda f: detector.process_frame(f, policy))
+    person_count, face_count, person_boxes, face_boxes = result
+
+    # Frame bị bỏ qua dùng lại cả similar_faces đã tra cho kết quả đó, không gọi lại DB
+    face_boxes_for_response = gate.annotation(result) if gated else None
+    if face_boxes_for_response is None:
+        face_boxes_for_response = []
+        for (coords, conf, emotion, embedding) in face_boxes:
+            if embedding is not None:
+                similar_faces = storage.find_similar_faces(embedding, top_k=3)
+                face_names = [face.get("name") for face in similar_faces]
+                face_boxes_for_response.append(
+                    {
+                        "coords": coords,
+                        "confidence": conf,
+                        "emotion": emotion,
+                        "similar_faces": face_names,
+                    }
+                )
+            else:
+                face_boxes_for_response.append(
+                    {
+                        "coords": coords,
+                        "confidence": conf,
+                        "emotion": emotion,
+                        "similar_faces": [],
+                    }
+                )
+        gate.annotate(result, face_boxes_for_response)
 
     return {
         "persons": person_count,
@@ -97,9 +178,139 @@ async def process_frame(file: UploadFile = File(...)):
             for (coords, conf, action) in person_boxes
         ],
         "face_boxes": face_boxes_for_response,
+        "motion_gated": gated,
     }
 
 
+async def _store_embeddings(embeddings: list[np.ndarray]) -> StoreResponse:
+    """Phần chung của /store và /store_crop: gộp embedding, chặn mặt đã gửi đồ, cấp tủ, tạo session."""
+    embed_stack = np.stack(embeddings, axis=0)
+    avg_embedding = np.mean(embed_stack, axis=0)
+    print(f"[STORE] Collected {len(embeddings)} embeddings, using averaged template.")
+
+    # 🔴 CHECK: mặt này đã có session active chưa?
+    existing_session, complete = await _find_active_session(avg_embedding)
+    if not complete:
+        print("[STORE] Tra cứu shard thiếu node, bỏ qua kiểm tra trùng trên node đó")
+    if existing_session and float(existing_session["cosineSim"]) >= EXISTING_FACE_THRESHOLD:
+        locker_id = existing_session["locker_id"]
+        # Trả về 400 để FE show lỗi
+        raise HTTPException(
+            status_code=400,
+            detail=f"Khuôn mặt này đang có đồ tại tủ {locker_id}. "
+                   f"Vui lòng lấy đồ hoặc đóng phiên hiện tại trước khi gửi thêm.",
+        )
+
+    # Giữ 1 tủ free cho session mới (id sinh trước, 1 lệnh ghi có điều kiện, không đọc DB)
+    session_id = storage.new_session_id()
+    locker_id = locker_table.allocate(session_id)
+    if not locker_id:
+        return StoreResponse(
+            status="denied",
+            locker_id=None,
+            confidence=None,
+            message="Hiện không còn tủ trống, vui lòng thử lại sau.",
+        )
+
+    # Tạo session mới (ghi journal nếu write-behind); lỗi thì trả lại tủ vừa giữ
+    try:
+        if write_behind is not None:
+            write_behind.record_store(session_id, locker_id, avg_embedding)
+        else:
+            storage.create_locker_session(locker_id=locker_id, face_embedding=avg_embedding, session_id=session_id)
+    except OSError as e:
+        locker_table.release(locker_id, session_id)
+        print(f"[STORE] Không ghi được journal: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create locker session")
+    except HTTPException:
+        locker_table.release(locker_id, session_id)
+        raise
+    if shards is not None:
+        await shards.add_session(session_id, locker_id, avg_embedding, locker_table.bank_of(locker_id))
+
+    return StoreResponse(
+        status="granted",
+        locker_id=locker_id,
+        confidence=None,
+        message=f"Tủ {locker_id} đã được cấp. Vui lòng gửi đồ vào tủ.",
+    )
+
+
+def _close_session(session_id, locker_id):
+    """
+    Đóng session + trả tủ; True chỉ khi session còn active và tủ vẫn do session đó giữ.
+    Kết quả tra cứu có thể cũ (shard chưa nhận lệnh xoá, 2 request lấy đồ cùng lúc): tủ có thể đã
+    được cấp cho người khác nên không được mở.
+    """
+    if write_behind is not None:
+        # Bảng tủ trong bộ nhớ là nguồn sự thật ở chế độ write-behind
+        if not locker_table.release(locker_id, session_id):
+            print(f"[RETRIEVE] Tủ {locker_id} không còn do session {session_id} giữ, từ chối")
+            return False
+        write_behind.record_retrieve(session_id, locker_id)
+        return True
+    if not storage.close_locker_session(session_id):
+        print(f"[RETRIEVE] Session {session_id} đã đóng trước đó, từ chối")
+        return False
+    if not locker_table.release(locker_id, session_id):
+        print(f"[RETRIEVE] Session {session_id} đã đóng nhưng tủ {locker_id} không còn do session này giữ, từ chối")
+        return False
+    return True
+
+
+async def _retrieve_embedding(embedding) -> RetrieveResponse:
+    """Phần chung của /retrieve và /retrieve_crop: tìm session theo khuôn mặt, đủ ngưỡng thì mở tủ."""
+    best_session, complete = await _find_active_session(embedding)
+
+    # Thiếu shard mà chưa có kết quả vượt ngưỡng: session đúng có thể nằm ở shard lỗi
+    if not complete and (not best_session or float(best_session["cosineSim"]) < UNLOCK_THRESHOLD):
+        raise HTTPException(
+            status_code=503,
+            detail="Hệ thống tra cứu tạm thời chưa đầy đủ, vui lòng thử lại.",
+            headers={"Retry-After": "1"},
+        )
+
+    if not best_session:
+        return RetrieveResponse(
+            status="denied",
+            locker_id=None,
+            confidence=None,
+            message="Không tìm thấy tủ tương ứng với khuôn mặt này.",
+        )
+
+    locker_id = best_session["locker_id"]
+    cosineSim = float(best_session["cosineSim"])
+
+    if cosineSim < UNLOCK_THRESHOLD:
+        return RetrieveResponse(
+            status="denied",
+            locker_id=locker_id,
+            confidence=cosineSim,
+            message="Độ tương đồng khuôn mặt chưa đủ để mở tủ.",
+        )
+
+    # Đủ ngưỡng -> chỉ mở tủ khi chính request này đóng được session & trả tủ
+    session_id = best_session["session_id"]
+    closed = _close_session(session_id, locker_id)
+    if shards is not None:
+        # Kể cả khi không đóng được: bỏ mục cũ khỏi shard để lần sau không khớp lại
+        await shards.remove_session(session_id, locker_id, locker_table.bank_of(locker_id))
+    if not closed:
+        return RetrieveResponse(
+            status="denied",
+            locker_id=None,
+            confidence=cosineSim,
+            message="Phiên gửi đồ này đã kết thúc, vui lòng thử lại.",
+        )
+
+    return RetrieveResponse(
+        status="granted",
+        locker_id=locker_id,
+        confidence=cosineSim,
+        message=f"Đã mở tủ {locker_id}. Vui lòng lấy đồ.",
+    )
+
+
 # ----------------- API: LƯU ĐỒ (STORE) -----------------
 @app.post("/store", response_model=StoreResponse)
 async def store_item(
@@ -139,7 +350,7 @@ async def store_item(
             print("[STORE] Bỏ qua frame: không đọc được ảnh")
             continue
 
-        person_count, face_count, person_boxes, face_boxes = detector.process_frame(frame)
+        person_count, face_count, person_boxes, face_boxes = await _infer(INTERACTIVE, detector.process_frame, frame)
 
         if face_count == 0:
             print("[STORE] Frame không có khuôn mặt, bỏ qua")
@@ -151,7 +362,7 @@ async def store_item(
             print("[STORE] Không trích xuất được embedding, bỏ qua frame này")
             continue
 
-        embeddings.append(np.array(embedding, dtype=np.float32))
+        embeddings.append(np.asarray(embedding, dtype=np.float32))
 
     if len(embeddings) == 0:
         raise HTTPException(
@@ -159,45 +370,7 @@ async def store_item(
             detail="Không thu được khuôn mặt hợp lệ nào. Hãy thử lại và đảm bảo mặt rõ, đủ sáng.",
         )
 
-    embed_stack = np.stack(embeddings, axis=0)
-    avg_embedding = np.mean(embed_stack, axis=0)
-    print(f"[STORE] Collected {len(embeddings)} embeddings, using averaged template.")
-
-    # 🔴 CHECK: mặt này đã có session active chưa?
-    existing_session = db_utils.find_active_session_by_face(avg_embedding)
-    if existing_session and float(existing_session["cosineSim"]) >= EXISTING_FACE_THRESHOLD:
-        locker_id = existing_session["locker_id"]
-        # Trả về 400 để FE show lỗi
-        raise HTTPException(
-            status_code=400,
-            detail=f"Khuôn mặt này đang có đồ tại tủ {locker_id}. "
-                   f"Vui lòng lấy đồ hoặc đóng phiên hiện tại trước khi gửi thêm.",
-        )
-
-    # Tìm 1 tủ đang free
-    locker = db_utils.find_free_locker()
-    if not locker:
-        return StoreResponse(
-            status="denied",
-            locker_id=None,
-            confidence=None,
-            message="Hiện không còn tủ trống, vui lòng thử lại sau.",
-        )
-
-    locker_id = locker["locker_id"]
-
-    # Tạo session mới
-    session_id = db_utils.create_locker_session(locker_id=locker_id, face_embedding=avg_embedding)
-
-    # Đánh dấu tủ đang bị chiếm
-    db_utils.mark_locker_occupied(locker_id=locker_id, session_id=session_id)
-
-    return StoreResponse(
-        status="granted",
-        locker_id=locker_id,
-        confidence=None,
-        message=f"Tủ {locker_id} đã được cấp. Vui lòng gửi đồ vào tủ.",
-    )
+    return await _store_embeddings(embeddings)
 
 
 # ----------------- API: LẤY ĐỒ (RETRIEVE) -----------------
@@ -218,7 +391,7 @@ async def retrieve_item(file: UploadFile = File(...)):
     if frame is None:
         raise HTTPException(status_code=400, detail="Không đọc được ảnh từ file upload")
 
-    person_count, face_count, person_boxes, face_boxes = detector.process_frame(frame)
+    person_count, face_count, person_boxes, face_boxes = await _infer(INTERACTIVE, detector.process_frame, frame)
 
     if face_count == 0:
         raise HTTPException(status_code=400, detail="Không phát hiện khuôn mặt nào trong ảnh")
@@ -230,55 +403,112 @@ async def retrieve_item(file: UploadFile = File(...)):
             status_code=400, detail="Không trích xuất được embedding khuôn mặt"
         )
 
-    best_session = db_utils.find_active_session_by_face(embedding)
+    return await _retrieve_embedding(embedding)
 
-    if not best_session:
-        return RetrieveResponse(
-            status="denied",
-            locker_id=None,
-            confidence=None,
-            message="Không tìm thấy tủ tương ứng với khuôn mặt này.",
-        )
 
-    locker_id = best_session["locker_id"]
-    cosineSim = float(best_session["cosineSim"])
+# ----------------- API: GỬI / LẤY ĐỒ BẰNG ẢNH KHUÔN MẶT ĐÃ CẮT -----------------
+async def _embed_crop(upload: UploadFile, box: str, confidence: float, kiosk_id: str):
+    """Áp chính sách crop rồi chạy lượt xác nhận (nếu cần) + embedding; bị từ chối thì CropRejected."""
+    contents = await upload.read()
+    crop = cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    if crop is None:
+        raise CropRejected("Không đọc được ảnh crop")
+    verify, audit = crop_policy.check(kiosk_id, box, confidence, crop.shape)
+    conf, embedding = await _infer(
+        INTERACTIVE, detector.process_face_crop, crop, verify, crop_policy.verify_imgsz, crop_policy.verify_conf
+    )
+    crop_policy.record(kiosk_id, verify, audit, embedding is not None)
+    return embedding
 
-    if cosineSim < UNLOCK_THRESHOLD:
-        return RetrieveResponse(
-            status="denied",
-            locker_id=locker_id,
-            confidence=cosineSim,
-            message="Độ tương đồng khuôn mặt chưa đủ để mở tủ.",
+
+@app.post("/store_crop", response_model=StoreResponse)
+async def store_item_crop(
+    files: List[UploadFile] = File(..., description="Ảnh khuôn mặt đã cắt ở kiosk (1 hoặc nhiều)"),
+    boxes: List[str] = Form(..., description="Box của từng ảnh trong frame gốc: x1,y1,x2,y2"),
+    confidences: List[float] = Form(..., description="Confidence detector phía kiosk của từng ảnh"),
+    x_kiosk_id: str | None = Header(None),
+    x_kiosk_token: str | None = Header(None),
+):
+    """Như /store nhưng kiosk gửi ảnh khuôn mặt đã cắt: server không chạy YOLO người."""
+    if not (len(files) == len(boxes) == len(confidences)):
+        raise HTTPException(status_code=400, detail="files, boxes, confidences phải cùng số phần tử")
+    kiosk_id = crop_policy.authenticate(x_kiosk_id, x_kiosk_token)
+
+    embeddings: list[np.ndarray] = []
+    for upload, box, confidence in zip(files, boxes, confidences):
+        try:
+            embedding = await _embed_crop(upload, box, confidence, kiosk_id)
+        except CropRejected as e:
+            if e.status_code != 400:
+                raise HTTPException(status_code=e.status_code, detail=e.reason)
+            print(f"[STORE_CROP] Bỏ qua ảnh crop: {e.reason}")
+            continue
+        if embedding is None:
+            print("[STORE_CROP] Không xác nhận được khuôn mặt trong ảnh crop, bỏ qua")
+            continue
+        embeddings.append(np.asarray(embedding, dtype=np.float32))
+
+    if len(embeddings) == 0:
+        raise HTTPException(
+            status_code=400,
+            detail="Không thu được khuôn mặt hợp lệ nào. Hãy thử lại và đảm bảo mặt rõ, đủ sáng.",
         )
+    return await _store_embeddings(embeddings)
 
-    # Đủ ngưỡng -> cho mở tủ, đóng session & free locker
-    session_id = best_session["session_id"]
-    db_utils.close_locker_session(session_id=session_id)
-    db_utils.mark_locker_free(locker_id=locker_id)
 
-    return RetrieveResponse(
-        status="granted",
-        locker_id=locker_id,
-        confidence=cosineSim,
-        message=f"Đã mở tủ {locker_id}. Vui lòng lấy đồ.",
-    )
+@app.post("/retrieve_crop", response_model=RetrieveResponse)
+async def retrieve_item_crop(
+    file: UploadFile = File(..., description="Ảnh khuôn mặt đã cắt ở kiosk"),
+    box: str = Form(..., description="Box trong frame gốc: x1,y1,x2,y2"),
+    confidence: float = Form(..., description="Confidence detector phía kiosk"),
+    x_kiosk_id: str | None = Header(None),
+    x_kiosk_token: str | None = Header(None),
+):
+    """Như /retrieve nhưng kiosk gửi ảnh khuôn mặt đã cắt: server không chạy YOLO người."""
+    try:
+        embedding = await _embed_crop(file, box, confidence, crop_policy.authenticate(x_kiosk_id, x_kiosk_token))
+    except CropRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.reason)
+    if embedding is None:
+        raise HTTPException(status_code=400, detail="Không xác nhận được khuôn mặt trong ảnh crop")
+    return await _retrieve_embedding(embedding)
+
+
+@app.get("/crop_trust/stats")
+async def crop_trust_stats():
+    """Số ảnh crop được nhận / từ chối / kiểm tra ngẫu nhiên theo kiosk."""
+    return crop_policy.stats()
+
+
+@app.get("/cameras")
+async def cameras_stats():
+    """Trạng thái từng camera kéo trực tiếp, kích thước batch, số frame bị bỏ."""
+    if capture is None:
+        return {"enabled": False}
+    return {"enabled": True, **capture.snapshot()}
+
+
+@app.get("/cameras/{camera_id}/latest")
+async def camera_latest(camera_id: str):
+    """Kết quả nhận diện mới nhất của 1 camera kéo trực tiếp."""
+    if capture is None or camera_id not in capture.cameras:
+        raise HTTPException(status_code=404, detail=f"Không có camera {camera_id}")
+    entry = capture.latest(camera_id)
+    if entry is None:
+        return {"camera_id": camera_id, "result": None}
+    return dict(entry, result=summarize(entry["result"]))
 
 
 @app.get("/lockers/summary")
 async def lockers_summary():
-    total = lockers_collection.count_documents({})
-    free = lockers_collection.count_documents({"status": "free"})
-    occupied = lockers_collection.count_documents({"status": "occupied"})
-    return {
-        "total_lockers": total,
-        "free_lockers": free,
-        "occupied_lockers": occupied,
-    }
+    return locker_table.summary()
 
 
 @app.post("/init_lockers")
 async def init_lockers(count: int = 12):
-    created = db_utils.create_lockers(count)
+    created = storage.create_lockers(count)
+    if created:
+        locker_table.load()
     return {
         "requested": count,
         "created": created,
@@ -286,6 +516,102 @@ async def init_lockers(count: int = 12):
     }
 
 
+@app.get("/motion_gate/stats")
+async def motion_gate_stats():
+    """Tỉ lệ frame preview được bỏ qua nhận diện theo từng camera."""
+    return motion_gates.stats()
+
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    """Độ sâu hàng đợi, thời gian chờ và số việc bị từ chối theo từng lớp ưu tiên."""
+    return scheduler.stats()
+
+
+@app.get("/write_behind/stats")
+async def write_behind_stats():
+    """Số bản ghi journal đang chờ ghi xuống Mongo, lỗi / lần thử lại gần nhất."""
+    if write_behind is None:
+        return {"enabled": False}
+    return {"enabled": True, **write_behind.snapshot()}
+
+
+@app.get("/storage/stats")
+async def storage_stats():
+    """Backend lưu trữ đang dùng; chế độ local kèm số bản ghi chờ đồng bộ lên Mongo."""
+    return await asyncio.to_thread(storage.stats)
+
+
+@app.on_event("shutdown")
+async def flush_write_behind():
+    if write_behind is not None:
+        left = await asyncio.to_thread(write_behind.drain)
+        if left:
+            print(f"[WriteBehind] Tắt server còn {left} bản ghi, sẽ replay lần khởi động sau")
+    if capture is not None:
+        capture.stop()
+    locker_table.stop()
+    storage.close()
+
+
+@app.get("/metrics/mongo")
+async def mongo_metrics(format: str = "json"):
+    """Độ trễ lệnh Mongo theo lệnh / collection / hàm db_utils và thời gian chờ pool."""
+    if format == "prometheus":
+        return PlainTextResponse(db_metrics.prometheus_text())
+    return db_metrics.snapshot()
+
+
+# ----------------- DEBUG: profiling (chỉ admin) -----------------
+def _require_admin(token: str | None):
+    """Endpoint debug chỉ bật khi có ADMIN_TOKEN; sai / thiếu token coi như không tồn tại."""
+    if not profiling.ADMIN_TOKEN or not token or not hmac.compare_digest(token, profiling.ADMIN_TOKEN):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.get("/debug/profile")
+async def debug_profile(
+    seconds: float = 10.0,
+    interval_ms: float = 5.0,
+    format: str = "collapsed",
+    include_idle: bool = False,
+    x_admin_token: str | None = Header(None),
+):
+    """
+    Lấy mẫu CPU mọi thread trong `seconds` giây (tối đa PROFILE_MAX_SECONDS).
+    format=collapsed: file .folded cho flamegraph.pl / speedscope; format=json: bảng hàm tốn nhất.
+    """
+    _require_admin(x_admin_token)
+    try:
+        # Chạy trong thread riêng để event loop vẫn phục vụ request trong lúc đo
+        stacks, ticks = await asyncio.to_thread(
+            profiling.sample_stacks, seconds, interval_ms, include_idle=include_idle
+        )
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if format == "json":
+        return profiling.top_functions(stacks, ticks)
+    return PlainTextResponse(
+        profiling.collapsed_text(stacks),
+        headers={"Content-Disposition": f'attachment; filename="profile-{int(time.time())}.folded"'},
+    )
+
+
+@app.get("/debug/allocations")
+async def debug_allocations(
+    seconds: float = 10.0,
+    limit: int = 30,
+    x_admin_token: str | None = Header(None),
+):
+    """Cấp phát bộ nhớ (tracemalloc) trong `seconds` giây: dòng code tăng nhiều nhất."""
+    _require_admin(x_admin_token)
+    try:
+        return await asyncio.to_thread(profiling.allocation_snapshot, seconds, limit)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
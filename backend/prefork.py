@@ -0,0 +1,200 @@
+"""
+Chạy nhiều worker uvicorn bằng fork, mô hình tải 1 lần ở process cha.
+
+uvicorn --workers dùng spawn: mỗi worker import lại backend.main nên mỗi worker tự đọc
+toàn bộ trọng số. Ở đây process cha:
+  1. đọc trọng số (app.models.preload_models) + autotune TFLite 1 lần,
+  2. gc.freeze() để GC của worker không ghi vào các trang nhớ chung,
+  3. mở socket lắng nghe rồi fork N worker.
+Mỗi worker sau fork mới import backend.main: tạo interpreter / session từ trọng số dùng
+chung (copy-on-write) và MongoClient riêng (MongoClient không an toàn khi fork).
+
+Phần không chia sẻ được: buffer tensor của interpreter, trọng số XNNPACK đã pack lại,
+arena của ONNX Runtime / torch. Xem PSS từng worker trong log [Prefork].
+
+Cấu hình: WEB_CONCURRENCY (số worker), PREFORK_MEMORY_REPORT_SECONDS (0 = chỉ báo lúc khởi động).
+
+Tính năng giữ trạng thái trong 1 process (xem single_process_conflicts) bị từ chối khi chạy nhiều
+worker: serve() dừng trước khi fork, backend.main dừng lúc import (vd. uvicorn --workers).
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+
+MEMORY_REPORT_SECONDS = float(os.getenv("PREFORK_MEMORY_REPORT_SECONDS", "300"))
+
+
+def multi_process():
+    """True khi server chạy nhiều worker (WEB_CONCURRENCY > 1 hoặc đang là worker prefork)."""
+    return int(os.getenv("WEB_CONCURRENCY", "1")) > 1 or "PREFORK_WORKER_ID" in os.environ
+
+
+def single_process_conflicts():
+    """Các cấu hình đang bật chỉ đúng khi cả server là 1 process."""
+    from backend.write_behind import WRITE_BEHIND_ENABLED
+    from backend.storage import STORAGE_BACKEND
+    from backend.capture_service import CAPTURE_SOURCES
+    conflicts = []
+    if WRITE_BEHIND_ENABLED:
+        # Mỗi worker replay / cắt cùng 1 journal và cấp tủ từ bảng trong bộ nhớ riêng
+        conflicts.append("WRITE_BEHIND_ENABLED=1")
+    if STORAGE_BACKEND == "local":
+        # Chỉ mục session + bộ cấp hàng embeddings.npy nằm trong bộ nhớ của từng worker
+        conflicts.append("STORAGE_BACKEND=local")
+    if CAPTURE_SOURCES:
+        # Kết quả camera (latest / thống kê) nằm trong bộ nhớ của worker kéo camera; worker khác không thấy
+        conflicts.append("CAPTURE_SOURCES")
+    return conflicts
+
+
+def require_single_process():
+    """Ném RuntimeError nếu chạy nhiều worker mà bật tính năng trong single_process_conflicts()."""
+    conflicts = single_process_conflicts()
+    if conflicts and multi_process():
+        raise RuntimeError(f"{', '.join(conflicts)} chỉ chạy được với 1 worker; đặt WEB_CONCURRENCY=1 "
+                           f"hoặc tắt các tùy chọn này")
+
+
+def process_memory(pid):
+    """RSS / PSS / shared / private (MB) của 1 process từ /proc/<pid>/smaps_rollup (Linux)."""
+    fields = {"Rss": 0, "Pss": 0, "Shared_Clean": 0, "Shared_Dirty": 0, "Private_Clean": 0, "Private_Dirty": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    fields[key] = int(rest.split()[0])
+    except (OSError, ValueError):
+        return None
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        "rss_mb": mb(fields["Rss"]),
+        "pss_mb": mb(fields["Pss"]),
+        "shared_mb": mb(fields["Shared_Clean"] + fields["Shared_Dirty"]),
+        "private_mb": mb(fields["Private_Clean"] + fields["Private_Dirty"]),
+    }
+
+
+def report_memory(workers):
+    """In bộ nhớ cha + từng worker; tổng PSS là dung lượng thật cả nhóm chiếm."""
+    rows = [("parent", os.getpid())] + [(f"worker {idx}", pid) for pid, idx in sorted(workers.items(), key=lambda x: x[1])]
+    total_pss = 0.0
+    for name, pid in rows:
+        mem = process_memory(pid)
+        if mem is None:
+            continue
+        total_pss += mem["pss_mb"]
+        print(f"[Prefork] {name:<9} pid={pid:<7} rss={mem['rss_mb']:>7.1f} MB  pss={mem['pss_mb']:>7.1f} MB  "
+              f"shared={mem['shared_mb']:>7.1f} MB  private={mem['private_mb']:>7.1f} MB")
+    print(f"[Prefork] Tổng PSS: {total_pss:.1f} MB ({len(workers)} worker)")
+
+
+def _preload_models():
+    from app.models import preload_models
+    start = time.perf_counter()
+    size = preload_models()
+    print(f"[Prefork] Đã tải sẵn mô hình ({size / 2**20:.1f} MB file) trong {time.perf_counter() - start:.1f} s")
+
+
+def _limit_worker_threads(workers):
+    """Chia CPU cho các worker để torch không tạo N x số core thread."""
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+
+
+def _run_worker(index, sock, app, workers, uvicorn_kwargs):
+    # uvicorn tự cài handler SIGINT / SIGTERM cho worker
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.environ["PREFORK_WORKER_ID"] = str(index)
+    gc.enable()
+    _limit_worker_threads(workers)
+
+    import uvicorn
+    config = uvicorn.Config(app, **uvicorn_kwargs)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _bind(host, port):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(app, host, port, workers, preload=_preload_models, memory_report_seconds=MEMORY_REPORT_SECONDS,
+          **uvicorn_kwargs):
+    """
+    Tải mô hình rồi fork `workers` worker uvicorn cùng lắng nghe 1 socket.
+    Worker chết bất thường được fork lại; SIGINT / SIGTERM dừng toàn bộ.
+    """
+    # Dừng trước khi fork: worker lỗi lúc import sẽ bị fork lại liên tục
+    conflicts = single_process_conflicts()
+    if conflicts and workers > 1:
+        raise SystemExit(f"[Prefork] {', '.join(conflicts)} chỉ chạy được với 1 worker (WEB_CONCURRENCY={workers})")
+    # Tắt GC trong lúc preload để đối tượng không bị dời / đánh dấu trước khi freeze
+    gc.disable()
+    if preload is not None:
+        preload()
+    sock = _bind(host, port)
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(index, sock, app, workers, uvicorn_kwargs)
+            except BaseException as e:
+                print(f"[Prefork] worker {index} lỗi: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for index in range(workers):
+        spawn(index)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"[Prefork] {workers} worker trên {host}:{port} (parent pid={os.getpid()})")
+
+    # Đợi worker import xong backend.main trước khi báo bộ nhớ lần đầu
+    next_report = time.monotonic() + 30
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            index = children.pop(pid)
+            if not stopping:
+                print(f"[Prefork] worker {index} (pid={pid}) thoát với mã {os.waitstatus_to_exitcode(status)}, fork lại")
+                time.sleep(1)  # tránh fork liên tục khi worker lỗi ngay lúc khởi động
+                spawn(index)
+            continue
+        if not stopping and next_report and time.monotonic() >= next_report:
+            report_memory(children)
+            next_report = time.monotonic() + memory_report_seconds if memory_report_seconds > 0 else None
+        time.sleep(0.5)
+    sock.close()
+    print("[Prefork] Đã dừng")
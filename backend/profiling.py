@@ -0,0 +1,153 @@
+"""
+Profiling tại chỗ cho server đang chạy (endpoint /debug/*, chỉ admin).
+
+- sample_stacks: lấy mẫu stack của MỌI thread qua sys._current_frames() trong N giây
+  (event loop, threadpool của FastAPI, thread nền...). Không cần cài gì, overhead
+  chỉ nằm ở thread lấy mẫu, không chèn hook vào code đang chạy.
+  Kết quả dạng collapsed stacks ("thread;file:func;file:func count") cho flamegraph.pl /
+  speedscope, hoặc bảng hàm tốn thời gian nhất (self / total).
+- allocation_snapshot: bật tracemalloc trong N giây rồi so sánh snapshot đầu / cuối,
+  trả về các dòng code cấp phát nhiều nhất trong khoảng đó. Tắt lại ngay sau khi đo.
+
+Chỉ 1 phiên profiling chạy tại 1 thời điểm (_busy).
+"""
+
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+_busy = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+def _collapse(frame, thread_name, max_depth):
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+def sample_stacks(seconds, interval_ms=5.0, max_depth=64, include_idle=False):
+    """
+    Lấy mẫu stack mọi thread. Trả về (Counter collapsed_stack -> số mẫu, số lần lấy mẫu).
+    Thread đang chờ (select / Condition.wait...) bị bỏ qua trừ khi include_idle.
+    """
+    seconds = min(float(seconds), PROFILE_MAX_SECONDS)
+    interval = max(0.001, interval_ms / 1000.0)
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("Đang có phiên profiling khác")
+    try:
+        me = threading.get_ident()
+        stacks = Counter()
+        ticks = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if not include_idle and _is_idle(frame):
+                    continue
+                stacks[_collapse(frame, names.get(ident, f"thread-{ident}"), max_depth)] += 1
+            ticks += 1
+            time.sleep(interval)
+        return stacks, ticks
+    finally:
+        _busy.release()
+
+
+_IDLE_FUNCS = {"wait", "select", "poll", "epoll", "_worker", "accept", "sleep", "get", "_wait_for_tstate_lock"}
+_IDLE_FILES = {"threading.py", "selectors.py", "queue.py", "thread.py", "base_events.py"}
+
+
+def _is_idle(frame):
+    """Thread đang block trong hàm chờ của stdlib (frame trên cùng)."""
+    code = frame.f_code
+    return code.co_name in _IDLE_FUNCS and os.path.basename(code.co_filename) in _IDLE_FILES
+
+
+def collapsed_text(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_functions(stacks, ticks, limit=30):
+    """Bảng hàm: self = mẫu hàm nằm trên cùng stack, total = mẫu hàm có mặt trong stack."""
+    self_counts, total_counts = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = [label.rsplit(":", 1)[0] for label in stack.split(";")[1:]]
+        if not frames:
+            continue
+        self_counts[frames[-1]] += count
+        for func in set(frames):
+            total_counts[func] += count
+    samples = sum(stacks.values()) or 1
+    return {
+        "ticks": ticks,
+        "samples": sum(stacks.values()),
+        "top_self": [
+            {"function": func, "samples": n, "percent": round(100.0 * n / samples, 2)}
+            for func, n in self_counts.most_common(limit)
+        ],
+        "top_total": [
+            {"function": func, "samples": n, "percent": round(100.0 * n / samples, 2)}
+            for func, n in total_counts.most_common(limit)
+        ],
+    }
+
+
+def allocation_snapshot(seconds, limit=30, frames=10, key_type="lineno"):
+    """
+    Đo cấp phát bộ nhớ trong `seconds` giây bằng tracemalloc (diff snapshot đầu / cuối).
+    Nếu tracemalloc đã được bật từ trước (PYTHONTRACEMALLOC) thì giữ nguyên, không tắt.
+    """
+    seconds = min(float(seconds), PROFILE_MAX_SECONDS)
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy("Đang có phiên profiling khác")
+    already_tracing = tracemalloc.is_tracing()
+    try:
+        if not already_tracing:
+            tracemalloc.start(frames)
+        before = tracemalloc.take_snapshot()
+        time.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+        _busy.release()
+
+    def _rows(stats):
+        return [
+            {
+                "where": str(stat.traceback[0]) if stat.traceback else "?",
+                "size_kb": round(stat.size / 1024, 1),
+                "size_diff_kb": round(getattr(stat, "size_diff", 0) / 1024, 1),
+                "count": stat.count,
+                "count_diff": getattr(stat, "count_diff", 0),
+            }
+            for stat in stats[:limit]
+        ]
+
+    return {
+        "seconds": seconds,
+        "traced_current_mb": round(current / 2**20, 2),
+        "traced_peak_mb": round(peak / 2**20, 2),
+        "top_growth": _rows(after.compare_to(before, key_type)),
+        "top_current": _rows(after.statistics(key_type)),
+    }
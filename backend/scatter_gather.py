@@ -0,0 +1,111 @@
+"""
+Coordinator tra cứu session theo khuôn mặt trên nhiều node shard (backend/shard_node.py).
+
+- match: gửi song song tới mọi shard, mỗi shard có SHARD_TIMEOUT_MS; gộp top-1 theo cosineSim.
+  Kết quả kèm `complete` = mọi shard đều trả lời. Khi thiếu shard, người gọi chỉ nên tin
+  kết quả nếu điểm đã vượt ngưỡng (shard thiếu có thể chứa đúng session cần tìm).
+- add_session / remove_session: gửi tới shard sở hữu tủ (shard_for); lỗi chỉ log,
+  shard tự bù khi resync từ Mongo. Trong lúc đó shard có thể trả session đã đóng, nên người gọi
+  chỉ mở tủ khi đóng được session có điều kiện (status active) trong DB.
+
+Cấu hình: SHARD_NODES=http://10.0.0.5:9100,http://10.0.0.6:9100 (thứ tự = SHARD_INDEX).
+"""
+
+import os
+import time
+import asyncio
+
+import httpx
+import numpy as np
+
+from backend.session_index import shard_for
+
+SHARD_NODES = [url.strip().rstrip("/") for url in os.getenv("SHARD_NODES", "").split(",") if url.strip()]
+SHARD_TIMEOUT_MS = float(os.getenv("SHARD_TIMEOUT_MS", "300"))
+
+
+class ShardCoordinator:
+    def __init__(self, nodes=None, timeout_ms=SHARD_TIMEOUT_MS):
+        self.nodes = list(nodes if nodes is not None else SHARD_NODES)
+        if not self.nodes:
+            raise ValueError("SHARD_NODES rỗng")
+        self.timeout = timeout_ms / 1000.0
+        self._client = None
+        self.stats = {"queries": 0, "partial": 0, "failures": {url: 0 for url in self.nodes}}
+
+    @property
+    def client(self):
+        # Tạo lazily trong event loop đang chạy; giữ kết nối keep-alive tới các shard
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    def owner(self, locker_id, bank=None):
+        return self.nodes[shard_for(locker_id, len(self.nodes), bank)]
+
+    async def _ask(self, url, payload):
+        try:
+            resp = await asyncio.wait_for(self.client.post(f"{url}/match", json=payload), self.timeout)
+            resp.raise_for_status()
+            return url, resp.json(), None
+        except Exception as e:
+            self.stats["failures"][url] += 1
+            return url, None, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+    async def match(self, query_embedding):
+        """
+        Trả về {"match": {"session_id", "locker_id", "cosineSim", "shard"} | None,
+                "complete": bool, "failed": {url: lỗi}, "elapsed_ms": float}.
+        """
+        start = time.perf_counter()
+        payload = {"embedding": np.asarray(query_embedding, dtype=np.float32).astype(float).tolist()}
+        replies = await asyncio.gather(*(self._ask(url, payload) for url in self.nodes))
+
+        best, failed = None, {}
+        for url, body, error in replies:
+            if error is not None:
+                failed[url] = error
+                continue
+            found = body.get("match")
+            if found and (best is None or found["cosineSim"] > best["cosineSim"]):
+                best = dict(found, shard=body.get("shard"))
+        self.stats["queries"] += 1
+        if failed:
+            self.stats["partial"] += 1
+            print(f"[Shards] match thiếu {len(failed)}/{len(self.nodes)} shard: {failed}")
+        return {
+            "match": best,
+            "complete": not failed,
+            "failed": failed,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    async def add_session(self, session_id, locker_id, embedding, bank=None):
+        url = self.owner(locker_id, bank)
+        payload = {
+            "session_id": session_id,
+            "locker_id": locker_id,
+            "embedding": np.asarray(embedding, dtype=np.float32).astype(float).tolist(),
+        }
+        try:
+            resp = await self.client.post(f"{url}/sessions", json=payload)
+            resp.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"[Shards] add_session({session_id}) -> {url} lỗi: {e}")
+            return False
+
+    async def remove_session(self, session_id, locker_id, bank=None):
+        url = self.owner(locker_id, bank)
+        try:
+            resp = await self.client.delete(f"{url}/sessions/{session_id}")
+            resp.raise_for_status()
+            return True
+        except Exception as e:
+            print(f"[Shards] remove_session({session_id}) -> {url} lỗi: {e}")
+            return False
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
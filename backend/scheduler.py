@@ -0,0 +1,187 @@
+"""
+Hàng đợi suy luận có ưu tiên cho Detector dùng chung.
+
+- INTERACTIVE (/store, /retrieve: người đang đứng chờ ở tủ) luôn được lấy ra trước.
+- PREVIEW (/process_frame) bị từ chối sớm bằng 503 + Retry-After khi hàng đợi preview
+  vượt SCHEDULER_PREVIEW_MAX_DEPTH, hoặc khi frame đã chờ quá SCHEDULER_PREVIEW_MAX_AGE_MS
+  lúc tới lượt (frame preview cũ không còn giá trị với FE).
+- Một thread suy luận duy nhất chạy Detector (interpreter TFLite không an toàn đa luồng),
+  event loop chỉ await kết quả nên vẫn nhận request trong lúc suy luận.
+
+Thống kê: GET /scheduler/stats.
+"""
+
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+INTERACTIVE = 0
+PREVIEW = 1
+CLASS_NAMES = {INTERACTIVE: "interactive", PREVIEW: "preview"}
+
+DEFAULT_LIMITS = {
+    # max_depth: số việc đang chờ tối đa; max_age_ms: bỏ việc đã chờ quá lâu (0 = không giới hạn)
+    INTERACTIVE: {
+        "max_depth": int(os.getenv("SCHEDULER_INTERACTIVE_MAX_DEPTH", "32")),
+        "max_age_ms": float(os.getenv("SCHEDULER_INTERACTIVE_MAX_AGE_MS", "0")),
+    },
+    PREVIEW: {
+        "max_depth": int(os.getenv("SCHEDULER_PREVIEW_MAX_DEPTH", "4")),
+        "max_age_ms": float(os.getenv("SCHEDULER_PREVIEW_MAX_AGE_MS", "1000")),
+    },
+}
+
+
+class Overloaded(Exception):
+    """Việc bị từ chối; retry_after (giây) dùng cho header Retry-After."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _resolve(future, result=None, error=None):
+    # Client ngắt kết nối thì future đã bị huỷ / the awaiting request may be gone
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _deliver(loop, future, result=None, error=None):
+    # Future asyncio phải được resolve trên loop của nó; Future của submit() thì resolve trực tiếp
+    if loop is None:
+        _resolve(future, result, error)
+    else:
+        loop.call_soon_threadsafe(_resolve, future, result, error)
+
+
+class _ClassStats:
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.shed_depth = 0
+        self.shed_age = 0
+        self.waits_ms = deque(maxlen=1024)
+
+    def snapshot(self, depth):
+        waits = sorted(self.waits_ms)
+        pick = lambda q: round(waits[min(len(waits) - 1, int(q * len(waits)))], 2) if waits else None
+        return {
+            "queued": depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "shed_depth": self.shed_depth,
+            "shed_age": self.shed_age,
+            "wait_p50_ms": pick(0.50),
+            "wait_p95_ms": pick(0.95),
+            "wait_max_ms": round(waits[-1], 2) if waits else None,
+        }
+
+
+class InferenceScheduler:
+    def __init__(self, limits=None):
+        self.limits = {cls: dict(DEFAULT_LIMITS[cls], **(limits or {}).get(cls, {})) for cls in DEFAULT_LIMITS}
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._depth = {cls: 0 for cls in self.limits}
+        self._stats = {cls: _ClassStats() for cls in self.limits}
+        self._service_s = 0.05  # EWMA thời gian chạy 1 việc, để ước lượng Retry-After
+        self._busy = False
+        self._thread = None
+
+    def _retry_after(self, depth):
+        return max(1, math.ceil(self._service_s * (depth + 1)))
+
+    async def run(self, priority, fn, *args):
+        """Xếp fn(*args) vào hàng đợi theo priority và chờ kết quả; raise Overloaded khi bị từ chối."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._enqueue(priority, fn, args, future, loop)
+        return await future
+
+    def submit(self, priority, fn, *args):
+        """
+        Như run() nhưng cho thread ngoài event loop (vd. backend/capture_service.py):
+        trả về concurrent.futures.Future; Overloaded được ném ngay hoặc qua future.
+        """
+        future = Future()
+        self._enqueue(priority, fn, args, future, None)
+        return future
+
+    def _enqueue(self, priority, fn, args, future, loop):
+        with self._cond:
+            stats = self._stats[priority]
+            stats.submitted += 1
+            depth = self._depth[priority]
+            if depth >= self.limits[priority]["max_depth"]:
+                stats.shed_depth += 1
+                raise Overloaded(f"Hàng đợi {CLASS_NAMES[priority]} đầy ({depth})", self._retry_after(depth))
+            heapq.heappush(self._heap, (priority, next(self._seq), time.perf_counter(), fn, args, future, loop))
+            self._depth[priority] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="inference-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                priority, _, enqueued, fn, args, future, loop = heapq.heappop(self._heap)
+                self._depth[priority] -= 1
+                stats = self._stats[priority]
+                wait_ms = (time.perf_counter() - enqueued) * 1000
+                stats.waits_ms.append(wait_ms)
+                if future.cancelled():
+                    stats.cancelled += 1
+                    continue
+                max_age = self.limits[priority]["max_age_ms"]
+                if max_age and wait_ms > max_age:
+                    stats.shed_age += 1
+                    error = Overloaded(f"Việc {CLASS_NAMES[priority]} chờ quá {max_age:.0f} ms",
+                                       self._retry_after(self._depth[priority]))
+                    _deliver(loop, future, None, error)
+                    continue
+                self._busy = True
+
+            start = time.perf_counter()
+            result = error = None
+            try:
+                result = fn(*args)
+            except Exception as e:
+                error = e
+            elapsed = time.perf_counter() - start
+
+            with self._cond:
+                self._busy = False
+                self._service_s = 0.8 * self._service_s + 0.2 * elapsed
+                if error is None:
+                    stats.completed += 1
+                else:
+                    stats.failed += 1
+            _deliver(loop, future, result, error)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "busy": self._busy,
+                "service_ms_ewma": round(self._service_s * 1000, 2),
+                "limits": {CLASS_NAMES[cls]: limit for cls, limit in self.limits.items()},
+                "classes": {CLASS_NAMES[cls]: s.snapshot(self._depth[cls]) for cls, s in self._stats.items()},
+            }
@@ -0,0 +1,117 @@
+"""
+Chỉ mục embedding của các session đang active trong bộ nhớ (1 shard) + hàm chia shard.
+
+Mỗi shard giữ ma trận (N, D) embedding đã chuẩn hóa; tìm top-1 là 1 phép nhân ma trận
+thay cho aggregation $reduce trên Mongo. Dùng bởi backend/shard_node.py.
+
+Chia shard theo locker_id (session gắn với tủ nên cả lưu / lấy / đóng đều biết key):
+    hash : crc32(locker_id) % SHARD_COUNT
+    bank : SHARD_BANK_MAP = {"A": 0, "B": 1, ...} theo bank của tủ, bank lạ rơi về hash
+"""
+
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+SHARD_PARTITION = os.getenv("SHARD_PARTITION", "hash")  # hash | bank
+SHARD_BANK_MAP = json.loads(os.getenv("SHARD_BANK_MAP") or "{}")
+
+
+def shard_for(locker_id, shard_count, bank=None, partition=SHARD_PARTITION, bank_map=SHARD_BANK_MAP):
+    """Chỉ số shard sở hữu session của tủ locker_id."""
+    if partition == "bank" and bank in bank_map:
+        return int(bank_map[bank]) % shard_count
+    return zlib.crc32(locker_id.encode("utf-8")) % shard_count
+
+
+class SessionIndex:
+    def __init__(self, dim=None, capacity=256):
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((capacity, dim or 0), dtype=np.float32)
+        self._session_ids = []
+        self._locker_ids = []
+        self._rows = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Dùng thẳng ma trận memmap của snapshot (backend/embedding_snapshot.py), không copy."""
+        index = cls(dim=snapshot.header["dim"] or None)
+        if snapshot.matrix is not None:
+            index._matrix = snapshot.matrix
+        index._session_ids = list(snapshot.session_ids)
+        index._locker_ids = list(snapshot.locker_ids)
+        index._rows = {session_id: row for row, session_id in enumerate(index._session_ids)}
+        return index
+
+    def export(self):
+        """Bản sao nhất quán (session_ids, locker_ids, matrix) để ghi snapshot."""
+        with self._lock:
+            count = len(self._session_ids)
+            return list(self._session_ids), list(self._locker_ids), np.array(self._matrix[:count])
+
+    def __len__(self):
+        return len(self._session_ids)
+
+    @staticmethod
+    def _unit(vec):
+        arr = np.asarray(vec, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(arr)
+        if norm == 0:
+            raise ValueError("Embedding vector has zero norm")
+        return arr / norm
+
+    def add(self, session_id, locker_id, embedding):
+        vec = self._unit(embedding)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vec.shape[0]
+                self._matrix = np.zeros((max(len(self._matrix), 1), self.dim), dtype=np.float32)
+            if vec.shape[0] != self.dim:
+                raise ValueError(f"Embedding {vec.shape[0]} chiều, chỉ mục {self.dim} chiều")
+            row = self._rows.get(session_id)
+            if row is None:
+                row = len(self._session_ids)
+                if row == len(self._matrix):
+                    grown = np.zeros((2 * len(self._matrix), self.dim), dtype=np.float32)
+                    grown[:row] = self._matrix[:row]
+                    self._matrix = grown
+                self._session_ids.append(session_id)
+                self._locker_ids.append(locker_id)
+                self._rows[session_id] = row
+            self._matrix[row] = vec
+            self._locker_ids[row] = locker_id
+
+    def remove(self, session_id):
+        """Xoá bằng cách chuyển hàng cuối vào chỗ trống (O(1))."""
+        with self._lock:
+            row = self._rows.pop(session_id, None)
+            if row is None:
+                return False
+            last = len(self._session_ids) - 1
+            if row != last:
+                self._matrix[row] = self._matrix[last]
+                self._session_ids[row] = self._session_ids[last]
+                self._locker_ids[row] = self._locker_ids[last]
+                self._rows[self._session_ids[row]] = row
+            self._session_ids.pop()
+            self._locker_ids.pop()
+            return True
+
+    def best(self, query_embedding):
+        """Session giống nhất: {"session_id", "locker_id", "cosineSim"} hoặc None."""
+        query = self._unit(query_embedding)
+        with self._lock:
+            count = len(self._session_ids)
+            if not count or query.shape[0] != self.dim:
+                return None
+            scores = self._matrix[:count] @ query
+            row = int(np.argmax(scores))
+            return {
+                "session_id": self._session_ids[row],
+                "locker_id": self._locker_ids[row],
+                "cosineSim": float(scores[row]),
+            }
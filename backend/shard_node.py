@@ -0,0 +1,245 @@
+"""
+Node shard cho tra cứu session theo khuôn mặt (không tải mô hình nhận diện).
+
+Mỗi node giữ trong bộ nhớ các session active thuộc phần của mình (SHARD_INDEX / SHARD_COUNT,
+cách chia xem backend/session_index.py) và trả top-1 cho coordinator (backend/scatter_gather.py).
+
+    SHARD_INDEX=0 SHARD_COUNT=3 uvicorn backend.shard_node:app --port 9100
+
+SHARD_SOURCE=mongo (mặc định khi có MONGODB_URI): nạp session từ Mongo lúc khởi động và
+mỗi SHARD_RESYNC_SECONDS (bù các lần coordinator gửi add / remove bị lỗi). Add / remove đến
+trong lúc đang dựng chỉ mục mới được áp lại lên chỉ mục đó trước khi thay.
+SHARD_SOURCE=empty: bắt đầu rỗng, chỉ nhận session qua API (scripts/run_shard_cluster.py).
+
+SHARD_SNAPSHOT_PATH (chỉ với nguồn mongo): ghi snapshot chỉ mục mỗi SHARD_SNAPSHOT_SECONDS và khi tắt;
+lần khởi động sau map file đó rồi chỉ bắt kịp session tạo / đóng sau mốc snapshot
+(backend/embedding_snapshot.py). Snapshot hỏng / khác shard thì nạp lại toàn bộ như cũ.
+"""
+
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
+
+from backend import embedding_snapshot
+from backend.embedding_snapshot import SnapshotError
+from backend.session_index import SessionIndex, shard_for
+
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_SOURCE = os.getenv("SHARD_SOURCE") or ("mongo" if os.getenv("MONGODB_URI") else "empty")
+SHARD_RESYNC_SECONDS = float(os.getenv("SHARD_RESYNC_SECONDS", "60"))
+SHARD_SNAPSHOT_PATH = os.getenv("SHARD_SNAPSHOT_PATH", "")
+SHARD_SNAPSHOT_SECONDS = float(os.getenv("SHARD_SNAPSHOT_SECONDS", "300"))
+
+app = FastAPI(title=f"Smart Locker session shard {SHARD_INDEX}/{SHARD_COUNT}")
+
+index = SessionIndex()
+# Khi đang dựng chỉ mục mới (đọc Mongo ngoài lock): add / remove đến trong lúc đó được ghi lại để áp lại
+_swap_lock = threading.Lock()
+_recorders = []
+stats = {"queries": 0, "adds": 0, "removes": 0, "resyncs": 0, "snapshot_writes": 0,
+         "started_from": None, "ready_ms": None}
+
+
+class MatchRequest(BaseModel):
+    embedding: list[float]
+
+
+class SessionRequest(BaseModel):
+    session_id: str
+    locker_id: str
+    embedding: list[float]
+
+
+def _mine(db_utils):
+    banks = {doc["locker_id"]: doc.get("bank") for doc in db_utils.load_locker_states()}
+    return lambda locker_id: shard_for(locker_id, SHARD_COUNT, banks.get(locker_id)) == SHARD_INDEX
+
+
+def _apply(target, op):
+    if op[0] == "add":
+        return target.add(*op[1:])
+    return target.remove(op[1])
+
+
+def _swap(fresh, ops):
+    """Áp các add / remove đến trong lúc dựng `fresh` rồi thay chỉ mục (gọi khi giữ _swap_lock)."""
+    global index
+    for op in ops:
+        try:
+            _apply(fresh, op)
+        except ValueError as e:
+            print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Bỏ qua {op[0]} {op[1]} khi áp lại: {e}")
+    index = fresh
+
+
+def _load_from_mongo():
+    """Dựng lại chỉ mục từ các session active thuộc shard này."""
+    from backend import db_utils
+
+    ops = []
+    with _swap_lock:
+        _recorders.append(ops)
+    try:
+        mine = _mine(db_utils)
+        fresh = SessionIndex()
+        for doc in db_utils.load_active_sessions():
+            if mine(doc["locker_id"]):
+                fresh.add(str(doc["_id"]), doc["locker_id"], doc["face_embedding"])
+    except Exception:
+        with _swap_lock:
+            _recorders.remove(ops)
+        raise
+    with _swap_lock:
+        _recorders.remove(ops)
+        _swap(fresh, ops)
+    stats["resyncs"] += 1
+    print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Nạp {len(fresh)} session active")
+
+
+def _load_from_snapshot():
+    """Map snapshot rồi bắt kịp thay đổi sau mốc của nó; False nếu không dùng được snapshot."""
+    global index
+    from backend import db_utils
+
+    try:
+        snapshot = embedding_snapshot.load(SHARD_SNAPSHOT_PATH)
+    except SnapshotError as e:
+        print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Bỏ qua snapshot: {e}")
+        return False
+    meta = snapshot.header["meta"]
+    if (meta.get("shard_index"), meta.get("shard_count")) != (SHARD_INDEX, SHARD_COUNT):
+        print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Bỏ qua snapshot của shard "
+              f"{meta.get('shard_index')}/{meta.get('shard_count')}")
+        return False
+
+    fresh = SessionIndex.from_snapshot(snapshot)
+    mine = _mine(db_utils)
+    opened, closed = db_utils.load_session_changes(snapshot.catch_up_since)
+    for session_id in closed:
+        fresh.remove(session_id)
+    for doc in opened:
+        if mine(doc["locker_id"]):
+            fresh.add(str(doc["_id"]), doc["locker_id"], doc["face_embedding"])
+    index = fresh
+    print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Snapshot thế hệ {snapshot.header['generation']} "
+          f"({snapshot.count} session, as_of {snapshot.header['as_of']}) + {len(opened)} mới / "
+          f"{len(closed)} đóng -> {len(fresh)} session active")
+    threading.Thread(target=_verify_snapshot, args=(snapshot,), name="shard-snapshot-verify", daemon=True).start()
+    return True
+
+
+def _verify_snapshot(snapshot):
+    # Checksum ma trận đọc cả file nên chạy sau khi node đã sẵn sàng
+    try:
+        snapshot.verify()
+    except SnapshotError as e:
+        print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] {e}, nạp lại toàn bộ từ Mongo")
+        _load_from_mongo()
+
+
+def write_snapshot():
+    as_of = datetime.now(timezone.utc)
+    session_ids, locker_ids, matrix = index.export()
+    header = embedding_snapshot.write(SHARD_SNAPSHOT_PATH, session_ids, locker_ids, matrix, as_of=as_of,
+                                      meta={"shard_index": SHARD_INDEX, "shard_count": SHARD_COUNT})
+    stats["snapshot_writes"] += 1
+    return header
+
+
+def _snapshot_loop():
+    while True:
+        time.sleep(SHARD_SNAPSHOT_SECONDS)
+        try:
+            write_snapshot()
+        except Exception as e:
+            print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Lỗi ghi snapshot: {e}")
+
+
+def _resync_loop():
+    while True:
+        time.sleep(SHARD_RESYNC_SECONDS)
+        try:
+            _load_from_mongo()
+        except Exception as e:
+            print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Lỗi resync: {e}")
+
+
+if SHARD_SOURCE == "mongo":
+    _start = time.perf_counter()
+    if SHARD_SNAPSHOT_PATH and _load_from_snapshot():
+        stats["started_from"] = "snapshot"
+    else:
+        _load_from_mongo()
+        stats["started_from"] = "mongo"
+        if SHARD_SNAPSHOT_PATH:
+            try:
+                write_snapshot()
+            except Exception as e:
+                print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Lỗi ghi snapshot: {e}")
+    stats["ready_ms"] = round((time.perf_counter() - _start) * 1000, 1)
+    if SHARD_RESYNC_SECONDS > 0:
+        threading.Thread(target=_resync_loop, name="shard-resync", daemon=True).start()
+    if SHARD_SNAPSHOT_PATH and SHARD_SNAPSHOT_SECONDS > 0:
+        threading.Thread(target=_snapshot_loop, name="shard-snapshot", daemon=True).start()
+
+
+@app.post("/match")
+def match(req: MatchRequest):
+    start = time.perf_counter()
+    stats["queries"] += 1
+    try:
+        best = index.best(req.embedding)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "shard": SHARD_INDEX,
+        "match": best,
+        "sessions": len(index),
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+
+def _record(op):
+    """Áp 1 add / remove lên chỉ mục hiện tại và ghi lại cho các lần dựng chỉ mục đang chạy."""
+    with _swap_lock:
+        result = _apply(index, op)
+        for ops in _recorders:
+            ops.append(op)
+    return result
+
+
+@app.post("/sessions")
+def add_session(req: SessionRequest):
+    try:
+        _record(("add", req.session_id, req.locker_id, req.embedding))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stats["adds"] += 1
+    return {"shard": SHARD_INDEX, "sessions": len(index)}
+
+
+@app.delete("/sessions/{session_id}")
+def remove_session(session_id: str):
+    removed = _record(("remove", session_id))
+    stats["removes"] += int(removed)
+    return {"shard": SHARD_INDEX, "removed": removed, "sessions": len(index)}
+
+
+@app.on_event("shutdown")
+def snapshot_on_shutdown():
+    if SHARD_SOURCE == "mongo" and SHARD_SNAPSHOT_PATH:
+        try:
+            write_snapshot()
+        except Exception as e:
+            print(f"[Shard {SHARD_INDEX}/{SHARD_COUNT}] Lỗi ghi snapshot: {e}")
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok", "shard": SHARD_INDEX, "shard_count": SHARD_COUNT,
+            "source": SHARD_SOURCE, "sessions": len(index), **stats}
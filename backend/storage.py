@@ -0,0 +1,139 @@
+"""
+Giao diện lưu trữ trạng thái tủ / session cho backend, chọn bằng STORAGE_BACKEND.
+
+    mongo : MongoDB (backend/db_utils.py), mặc định. Cần MONGODB_URI.
+    local : SQLite + file embedding NumPy trên máy kiosk (backend/local_storage.py),
+            chạy được khi mất WAN; đồng bộ lên Mongo khi có MONGODB_URI và mạng trở lại.
+
+Mọi chỗ trong backend gọi qua get_storage() thay vì import db_utils trực tiếp, để
+chế độ local không cần (và không chờ) kết nối Mongo lúc khởi động.
+"""
+
+import os
+from abc import ABC, abstractmethod
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")  # mongo | local
+
+
+class StorageBackend(ABC):
+    """Các thao tác /store, /retrieve, bảng tủ và chỉ mục shard cần."""
+
+    name = "abstract"
+
+    # ----- tủ -----
+    @abstractmethod
+    def init_lockers_if_empty(self, num_lockers: int = 10): ...
+
+    @abstractmethod
+    def create_lockers(self, count: int) -> int: ...
+
+    @abstractmethod
+    def load_locker_states(self) -> list[dict]: ...
+
+    @abstractmethod
+    def get_locker_state(self, locker_id: str) -> dict | None: ...
+
+    @abstractmethod
+    def claim_locker(self, locker_id: str, session_id: str) -> bool: ...
+
+    @abstractmethod
+    def release_held_locker(self, locker_id: str, session_id: str) -> bool: ...
+
+    # ----- session -----
+    @abstractmethod
+    def new_session_id(self) -> str: ...
+
+    @abstractmethod
+    def create_locker_session(self, locker_id: str, face_embedding, session_id: str | None = None) -> str: ...
+
+    @abstractmethod
+    def close_locker_session(self, session_id: str) -> bool:
+        """Đóng session nếu còn active; False nếu đã đóng trước đó."""
+
+    @abstractmethod
+    def find_active_session_by_face(self, query_embedding, exclude_ids=None) -> dict | None: ...
+
+    @abstractmethod
+    def load_active_sessions(self) -> list[dict]: ...
+
+    # ----- gallery -----
+    @abstractmethod
+    def find_similar_faces(self, query_embedding, top_k: int = 3) -> list[dict]: ...
+
+    def apply_session_records(self, records: list[dict]) -> dict:
+        """Ghi lô bản ghi write-behind; chỉ backend ở xa (Mongo) cần."""
+        raise NotImplementedError(f"{self.name} không hỗ trợ write-behind")
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+    def close(self):
+        """Ghi nốt dữ liệu đang đệm khi tắt server."""
+
+
+class MongoStorage(StorageBackend):
+    """Bọc các hàm sẵn có của backend/db_utils.py (import lúc tạo, tức là lúc kết nối Mongo)."""
+
+    name = "mongo"
+
+    def __init__(self):
+        from backend import db_utils
+        self.db = db_utils
+
+    def init_lockers_if_empty(self, num_lockers=10):
+        return self.db.init_lockers_if_empty(num_lockers)
+
+    def create_lockers(self, count):
+        return self.db.create_lockers(count)
+
+    def load_locker_states(self):
+        return self.db.load_locker_states()
+
+    def get_locker_state(self, locker_id):
+        return self.db.get_locker_state(locker_id)
+
+    def claim_locker(self, locker_id, session_id):
+        return self.db.claim_locker(locker_id, session_id)
+
+    def release_held_locker(self, locker_id, session_id):
+        return self.db.release_held_locker(locker_id, session_id)
+
+    def new_session_id(self):
+        return self.db.new_session_id()
+
+    def create_locker_session(self, locker_id, face_embedding, session_id=None):
+        return self.db.create_locker_session(locker_id=locker_id, face_embedding=face_embedding, session_id=session_id)
+
+    def close_locker_session(self, session_id):
+        return self.db.close_locker_session(session_id=session_id)
+
+    def find_active_session_by_face(self, query_embedding, exclude_ids=None):
+        return self.db.find_active_session_by_face(query_embedding, exclude_ids=exclude_ids)
+
+    def load_active_sessions(self):
+        return self.db.load_active_sessions()
+
+    def find_similar_faces(self, query_embedding, top_k=3):
+        return self.db.find_similar_faces(query_embedding, top_k=top_k)
+
+    def apply_session_records(self, records):
+        return self.db.apply_session_records(records)
+
+
+_storage = None
+
+
+def get_storage(kind=None) -> StorageBackend:
+    """Backend lưu trữ dùng chung của process (tạo ở lần gọi đầu)."""
+    global _storage
+    if _storage is None:
+        kind = kind or STORAGE_BACKEND
+        if kind == "mongo":
+            _storage = MongoStorage()
+        elif kind == "local":
+            from backend.local_storage import LocalStorage
+            _storage = LocalStorage()
+        else:
+            raise ValueError(f"STORAGE_BACKEND không hợp lệ: {kind} (mongo | local)")
+        print(f"[Storage] Dùng backend {_storage.name}")
+    return _storage
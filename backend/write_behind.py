@@ -0,0 +1,194 @@
+"""
+Ghi sau (write-behind) cho sổ sách gửi / lấy đồ: mở tủ không phải chờ round trip tới Atlas.
+
+Khi WRITE_BEHIND_ENABLED=1:
+- /store, /retrieve quyết định trên bảng tủ trong bộ nhớ (LockerTable write_through=False),
+  ghi quyết định vào journal append-only cục bộ (fsync) rồi trả lời ngay.
+- Thread nền gom WRITE_BEHIND_BATCH bản ghi mỗi WRITE_BEHIND_FLUSH_MS, ghi xuống Mongo bằng
+  storage.apply_session_records (idempotent theo session_id), lỗi thì thử lại với backoff
+  tới WRITE_BEHIND_MAX_BACKOFF_S. Ghi xong thì thêm dòng {"ack": seq} vào journal; hàng đợi
+  rỗng thì cắt journal về 0.
+- Khởi động: replay các bản ghi sau ack cuối cùng (áp lên bảng tủ + overlay tra cứu), rồi flush lại.
+- Session đã lưu nhưng chưa ghi xuống DB nằm trong `overlay` (SessionIndex); session đã đóng
+  nhưng chưa ghi nằm trong `closing`. Tra cứu khuôn mặt gộp cả hai với kết quả Mongo.
+
+Journal là của 1 process: chỉ bật với WEB_CONCURRENCY=1 (các worker prefork không chia sẻ bảng tủ);
+chạy nhiều worker thì server từ chối khởi động (backend/prefork.py: require_single_process).
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+import numpy as np
+
+from backend.storage import get_storage
+from backend.session_index import SessionIndex
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "0").lower() in ("1", "true", "yes")
+WRITE_BEHIND_JOURNAL = os.getenv("WRITE_BEHIND_JOURNAL", "./data/write_behind.jsonl")
+WRITE_BEHIND_FLUSH_MS = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "200"))
+WRITE_BEHIND_MAX_BACKOFF_S = float(os.getenv("WRITE_BEHIND_MAX_BACKOFF_S", "30"))
+
+
+class WriteBehindQueue:
+    def __init__(self, path=WRITE_BEHIND_JOURNAL, flush_ms=WRITE_BEHIND_FLUSH_MS, batch_size=WRITE_BEHIND_BATCH,
+                 storage=None):
+        self.path = path
+        self.storage = storage or get_storage()
+        self.flush_interval = flush_ms / 1000.0
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = deque()
+        self._seq = 0
+        self._file = None
+        self._thread = None
+        self.overlay = SessionIndex()
+        self.closing = set()
+        self.stats = {"journaled": 0, "flushed": 0, "batches": 0, "retries": 0, "replayed": 0,
+                      "last_error": None, "last_flush_ms": None}
+
+    # ----- journal -----
+    def _append(self, record):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def replay(self, locker_table):
+        """Đọc journal, giữ lại bản ghi chưa ack, áp lên bảng tủ + overlay. Gọi trước start()."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        records, acked = [], 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # dòng cuối ghi dở khi mất điện: bỏ từ đây
+                    if "ack" in entry:
+                        acked = max(acked, entry["ack"])
+                    else:
+                        records.append(entry)
+        pending = [rec for rec in records if rec["seq"] > acked]
+        for rec in pending:
+            self._track(rec)
+            locker_table.apply(rec["locker_id"], rec["session_id"] if rec["op"] == "store" else None)
+        self._pending.extend(pending)
+        self._seq = max([acked] + [rec["seq"] for rec in records])
+        self.stats["replayed"] = len(pending)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if pending:
+            print(f"[WriteBehind] Replay {len(pending)} bản ghi chưa ghi xuống Mongo từ {self.path}")
+        return len(pending)
+
+    def _track(self, rec):
+        if rec["op"] == "store":
+            self.overlay.add(rec["session_id"], rec["locker_id"], rec["embedding"])
+        else:
+            self.overlay.remove(rec["session_id"])
+            self.closing.add(rec["session_id"])
+
+    def _record(self, op, session_id, locker_id, embedding=None):
+        with self._lock:
+            self._seq += 1
+            rec = {"seq": self._seq, "op": op, "session_id": session_id, "locker_id": locker_id,
+                   "at": datetime.now(timezone.utc).isoformat()}
+            if embedding is not None:
+                rec["embedding"] = np.asarray(embedding, dtype=np.float32).astype(float).tolist()
+            self._append(rec)
+            self._track(rec)
+            self._pending.append(rec)
+            self.stats["journaled"] += 1
+        self._wake.set()
+
+    def record_store(self, session_id, locker_id, embedding):
+        self._record("store", session_id, locker_id, embedding)
+
+    def record_retrieve(self, session_id, locker_id):
+        self._record("retrieve", session_id, locker_id)
+
+    # ----- tra cứu -----
+    def find_active_session(self, embedding):
+        """Gộp session trong Mongo (trừ session đang chờ đóng) với session chưa ghi xuống DB."""
+        with self._lock:
+            closing = list(self.closing)
+        remote = self.storage.find_active_session_by_face(embedding, exclude_ids=closing)
+        local = self.overlay.best(embedding)
+        if local is None:
+            return remote
+        if remote is None or local["cosineSim"] > float(remote["cosineSim"]):
+            return local
+        return remote
+
+    # ----- flush -----
+    def _flush_once(self):
+        with self._lock:
+            batch = list(self._pending)[:self.batch_size]
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        self.storage.apply_session_records(batch)
+        with self._lock:
+            for _ in batch:
+                self._pending.popleft()
+            for rec in batch:
+                if rec["op"] == "store":
+                    # Session đã vào Mongo; nếu đã bị đóng sau đó thì overlay cũng đã xoá
+                    self.overlay.remove(rec["session_id"])
+                elif not any(p["session_id"] == rec["session_id"] for p in self._pending):
+                    self.closing.discard(rec["session_id"])
+            if self._pending:
+                self._append({"ack": batch[-1]["seq"]})
+            else:
+                # Đã ghi hết: cắt journal thay vì để file phình ra
+                self._file.truncate(0)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self.stats["flushed"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_flush_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return len(batch)
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                while self._flush_once() == self.batch_size:
+                    pass
+                backoff = self.flush_interval
+            except Exception as e:
+                self.stats["retries"] += 1
+                self.stats["last_error"] = f"{type(e).__name__}: {e}"
+                backoff = min(WRITE_BEHIND_MAX_BACKOFF_S, max(backoff * 2, 0.5))
+                print(f"[WriteBehind] Ghi Mongo lỗi ({e}), thử lại sau {backoff:.1f} s "
+                      f"({len(self._pending)} bản ghi đang chờ)")
+                time.sleep(backoff)
+
+    def start(self):
+        if self._file is None:
+            raise RuntimeError("Gọi replay() trước start()")
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        self._wake.set()
+
+    def drain(self, timeout=5.0):
+        """Chờ hàng đợi ghi hết (khi tắt server); trả về số bản ghi còn lại."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            self._wake.set()
+            time.sleep(0.05)
+        return len(self._pending)
+
+    def snapshot(self):
+        with self._lock:
+            oldest = self._pending[0]["at"] if self._pending else None
+            return dict(self.stats, pending=len(self._pending), oldest_pending=oldest,
+                        overlay_sessions=len(self.overlay), closing=len(self.closing))
@@ -2,6 +2,8 @@
 """
 run_server.py - Start script cho Smart Locker API
 Hỗ trợ cả local (SSL) và production (Render)
+
+WEB_CONCURRENCY > 1: chạy nhiều worker bằng backend/prefork.py (mô hình tải 1 lần trước fork)
 """
 
 import os
@@ -11,31 +13,49 @@ import ssl
 if __name__ == "__main__":
     # Detect môi trường
     is_production = os.environ.get("RENDER") or os.environ.get("PRODUCTION")
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
     
     if is_production:
         # PRODUCTION: Render tự handle SSL qua reverse proxy
         port = int(os.environ.get("PORT", 8000))
-        print(f"🚀 Starting in PRODUCTION mode on port {port}")
+        print(f"🚀 Starting in PRODUCTION mode on port {port} ({workers} worker)")
         
-        import uvicorn
-        uvicorn.run(
-            "backend.main:app",
-            host="0.0.0.0",
-            port=port,
-            log_level="info",
-            reload=False
-        )
+        if workers > 1:
+            from backend.prefork import serve
+            serve("backend.main:app", "0.0.0.0", port, workers, log_level="info")
+        else:
+            import uvicorn
+            uvicorn.run(
+                "backend.main:app",
+                host="0.0.0.0",
+                port=port,
+                log_level="info",
+                reload=False
+            )
     else:
         # LOCAL DEVELOPMENT: Dùng SSL
         print("🔒 Starting in LOCAL mode with SSL on https://localhost:8001")
         
-        import uvicorn
-        uvicorn.run(
-            "backend.main:app",
-            host="localhost",
-            port=8001,
-            ssl_keyfile='./ssl/privkey.pem',
-            ssl_certfile='./ssl/fullchain.pem',
-            log_level="info",
-            reload=True  # Auto-reload cho development
-        )
\ No newline at end of file
+        if workers > 1:
+            # Nhiều worker thì không auto-reload được
+            from backend.prefork import serve
+            serve(
+                "backend.main:app",
+                "localhost",
+                8001,
+                workers,
+                ssl_keyfile='./ssl/privkey.pem',
+                ssl_certfile='./ssl/fullchain.pem',
+                log_level="info",
+            )
+        else:
+            import uvicorn
+            uvicorn.run(
+                "backend.main:app",
+                host="localhost",
+                port=8001,
+                ssl_keyfile='./ssl/privkey.pem',
+                ssl_certfile='./ssl/fullchain.pem',
+                log_level="info",
+                reload=True  # Auto-reload cho development
+            )
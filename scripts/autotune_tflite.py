@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+autotune_tflite.py - Chạy autotune num_threads / XNNPACK cho các mô hình TFLite của Detector
+Runs the TFLite autotuner ahead of time and fills the tuning cache used by load_models().
+
+Ví dụ / Examples:
+  python scripts/autotune_tflite.py --concurrency 3          # đo cho 3 worker chạy song song
+  python scripts/autotune_tflite.py --force --concurrency 1  # đo lại, ghi đè cache
+"""
+
+import os
+import sys
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+from app.config import EMOTION_MODEL_PATH, ACTION_MODEL_PATH, EMBED_TFLITE_MODEL_PATH, TFLITE_AUTOTUNE_CONCURRENCY
+from app.tflite_autotune import resolve_interpreter_settings, cpu_signature
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Autotune num_threads / XNNPACK cho mô hình TFLite")
+    parser.add_argument("--concurrency", type=int, default=TFLITE_AUTOTUNE_CONCURRENCY,
+                        help="Số worker chạy mô hình cùng lúc trên server")
+    parser.add_argument("--force", action="store_true", help="Đo lại kể cả khi đã có trong cache")
+    args = parser.parse_args()
+
+    print(f"CPU: {cpu_signature()}")
+    settings = resolve_interpreter_settings(
+        {"emotion": EMOTION_MODEL_PATH, "action": ACTION_MODEL_PATH, "embedding": EMBED_TFLITE_MODEL_PATH},
+        mode="force" if args.force else "on",
+        concurrency=args.concurrency,
+    )
+    for name, setting in settings.items():
+        print(f"{name:<10} {setting or 'mặc định'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+batch_detect.py - Chạy Detector.process_frame offline trên thư mục ảnh / video
+Offline batch runner for the production Detector (no HTTP server).
+
+- Ảnh (file / thư mục) và video (lấy mẫu --video-fps frame mỗi giây, grab() frame bỏ qua).
+- Nhiều process worker, mỗi process tải Detector 1 lần; kết quả ghi ra theo đúng thứ tự input.
+- Output JSONL (1 dòng / frame) hoặc .npz (mảng theo người / khuôn mặt, kèm embedding).
+- In tốc độ frame/s định kỳ và khi kết thúc.
+
+Dùng để trích lại embedding khi đổi mô hình, hoặc rà soát footage mà không đi qua API.
+
+Ví dụ / Examples:
+  python scripts/batch_detect.py crops/ --output results.jsonl
+  python scripts/batch_detect.py lobby.mp4 --video-fps 2 --workers 4 --output lobby.npz
+  python scripts/batch_detect.py photos/ --output audit.jsonl --no-embeddings --policy fixed
+"""
+
+from os import putenv
+putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
+putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+import cv2
+import numpy as np
+
+from video_extract import VIDEO_EXTS, sample_frames, rotate_frame
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+_detector = None
+_policy_name = None
+_policies = {}
+
+
+def _init_worker(policy_name):
+    """Tải Detector 1 lần cho mỗi process / Load one Detector per worker process."""
+    global _detector, _policy_name
+    sys.path.insert(0, ROOT_DIR)
+    from app.box_detector import Detector
+    _detector = Detector()
+    # Ảnh tĩnh: Detector tự tạo policy mới cho mỗi ảnh theo preset này / stills get a fresh policy per call
+    _detector.policy_name = policy_name
+    _policy_name = policy_name
+
+
+def _policy_for(source):
+    """Mỗi video giữ 1 ResolutionPolicy riêng trong process / One policy per video source."""
+    from app.resolution_policy import ResolutionPolicy
+    policy = _policies.get(source)
+    if policy is None:
+        policy = _policies[source] = ResolutionPolicy.from_preset(_policy_name)
+    return policy
+
+
+def detect_task(task):
+    """Chạy Detector trên 1 frame; frame là đường dẫn ảnh hoặc mảng đã decode."""
+    source, index, frame = task
+    start = time.perf_counter()
+    # Ảnh tĩnh không có frame trước: không giữ policy theo từng file / no per-file policy for still images
+    policy = None
+    if isinstance(frame, str):
+        frame = cv2.imread(frame, cv2.IMREAD_COLOR)
+    else:
+        policy = _policy_for(source)
+    if frame is None:
+        return source, index, None, 0.0
+    result = _detector.process_frame(frame, policy)
+    return source, index, result, time.perf_counter() - start
+
+
+def iter_tasks(inputs, video_fps):
+    """Sinh (source, chỉ số frame, đường dẫn ảnh | frame) theo thứ tự input."""
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTS):
+                        full = os.path.join(root, name)
+                        yield full, 0, full
+        elif path.lower().endswith(VIDEO_EXTS):
+            cap = cv2.VideoCapture(path)
+            try:
+                fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+                total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+                rotation = int(cap.get(cv2.CAP_PROP_ORIENTATION_META))
+                step = max(1, int(round(fps / video_fps)))
+                for index, frame in sample_frames(cap, step, "auto", total, fps):
+                    yield path, index, rotate_frame(frame, rotation)
+            finally:
+                cap.release()
+        else:
+            yield path, 0, path
+
+
+class JsonlWriter:
+    def __init__(self, path, embeddings):
+        self.file = open(path, "w", encoding="utf-8")
+        self.embeddings = embeddings
+
+    def write(self, source, index, result):
+        record = {"source": source, "frame": index}
+        if result is None:
+            record["error"] = "unreadable"
+        else:
+            person_count, face_count, person_boxes, face_boxes = result
+            record["persons"] = [{"box": list(box), "conf": round(conf, 4), "action": action}
+                                 for box, conf, action in person_boxes]
+            record["faces"] = []
+            for box, conf, emotion, embedding in face_boxes:
+                face = {"box": list(box), "conf": round(conf, 4), "emotion": emotion}
+                if self.embeddings and embedding is not None:
+                    face["embedding"] = np.asarray(embedding, dtype=np.float32).round(6).tolist()
+                record["faces"].append(face)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class NpzWriter:
+    """
+    Gom kết quả thành mảng phẳng: frames (source_idx, frame), persons / faces trỏ về frame_idx.
+    Flat arrays keyed by frame_idx, written once at the end.
+    """
+
+    def __init__(self, path, embeddings):
+        self.path = path
+        self.embeddings = embeddings
+        self.sources, self.source_ids = [], {}
+        self.frames, self.failed = [], []
+        self.person_frame, self.person_box, self.person_conf, self.person_action = [], [], [], []
+        self.face_frame, self.face_box, self.face_conf, self.face_emotion, self.face_embedding = [], [], [], [], []
+
+    def write(self, source, index, result):
+        source_id = self.source_ids.setdefault(source, len(self.sources))
+        if source_id == len(self.sources):
+            self.sources.append(source)
+        frame_id = len(self.frames)
+        self.frames.append((source_id, index))
+        self.failed.append(result is None)
+        if result is None:
+            return
+        _, _, person_boxes, face_boxes = result
+        for box, conf, action in person_boxes:
+            self.person_frame.append(frame_id)
+            self.person_box.append(box)
+            self.person_conf.append(conf)
+            self.person_action.append(action)
+        for box, conf, emotion, embedding in face_boxes:
+            if self.embeddings and embedding is None:
+                continue
+            self.face_frame.append(frame_id)
+            self.face_box.append(box)
+            self.face_conf.append(conf)
+            self.face_emotion.append(emotion)
+            if self.embeddings:
+                self.face_embedding.append(np.asarray(embedding, dtype=np.float32))
+
+    def close(self):
+        arrays = dict(
+            sources=np.asarray(self.sources),
+            frames=np.asarray(self.frames, dtype=np.int64).reshape(-1, 2),
+            failed=np.asarray(self.failed, dtype=bool),
+            person_frame=np.asarray(self.person_frame, dtype=np.int64),
+            person_box=np.asarray(self.person_box, dtype=np.int32).reshape(-1, 4),
+            person_conf=np.asarray(self.person_conf, dtype=np.float32),
+            person_action=np.asarray(self.person_action),
+            face_frame=np.asarray(self.face_frame, dtype=np.int64),
+            face_box=np.asarray(self.face_box, dtype=np.int32).reshape(-1, 4),
+            face_conf=np.asarray(self.face_conf, dtype=np.float32),
+            face_emotion=np.asarray(self.face_emotion),
+        )
+        if self.embeddings:
+            arrays["face_embedding"] = (np.stack(self.face_embedding) if self.face_embedding
+                                        else np.zeros((0, 0), dtype=np.float32))
+        np.savez_compressed(self.path, **arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy Detector offline trên ảnh / video")
+    parser.add_argument("inputs", nargs="+", help="File ảnh, thư mục ảnh hoặc file video")
+    parser.add_argument("--output", required=True, help="File kết quả .jsonl hoặc .npz")
+    parser.add_argument("--workers", type=int, default=1, help="Số process chạy Detector")
+    parser.add_argument("--video-fps", type=float, default=3.0, help="Số frame lấy mẫu mỗi giây video")
+    parser.add_argument("--policy", default=None, help="DETECTION_POLICY cho batch (mặc định như server)")
+    parser.add_argument("--no-embeddings", action="store_true", help="Không ghi embedding khuôn mặt")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Giây giữa các dòng tiến độ")
+    args = parser.parse_args()
+
+    inputs = [os.path.abspath(p) for p in args.inputs]
+    output = os.path.abspath(args.output)
+    writer_cls = NpzWriter if output.endswith(".npz") else JsonlWriter
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, ROOT_DIR)
+    from app.config import DETECTION_POLICY
+    policy_name = args.policy or DETECTION_POLICY
+
+    writer = writer_cls(output, embeddings=not args.no_embeddings)
+    tasks = iter_tasks(inputs, args.video_fps)
+    workers = max(1, args.workers)
+    if workers == 1:
+        _init_worker(policy_name)
+        results = map(detect_task, tasks)
+    else:
+        pool = mp.Pool(workers, initializer=_init_worker, initargs=(policy_name,))
+        # imap giữ thứ tự input; chunksize nhỏ để frame video không dồn ứ trong pipe
+        results = pool.imap(detect_task, tasks, chunksize=2)
+
+    print(f"🔄 {len(inputs)} input, {workers} worker, policy={policy_name} -> {output}")
+    frames = faces = failed = 0
+    busy = 0.0
+    start = last_report = time.perf_counter()
+    try:
+        for source, index, result, seconds in results:
+            writer.write(source, index, result)
+            frames += 1
+            busy += seconds
+            if result is None:
+                failed += 1
+            else:
+                faces += result[1]
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                last_report = now
+                print(f"[Batch] {frames} frame, {frames / (now - start):.1f} frame/s, {faces} khuôn mặt")
+    finally:
+        writer.close()
+        if workers > 1:
+            pool.terminate()
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ {frames} frame ({failed} lỗi đọc), {faces} khuôn mặt trong {elapsed:.1f} s "
+          f"-> {frames / elapsed if elapsed else 0:.2f} frame/s "
+          f"(trung bình {busy / max(1, frames - failed) * 1000:.1f} ms/frame mỗi worker)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+bench_stats.py - Hàm thống kê độ trễ dùng chung cho các script đo hiệu năng
+Shared latency statistics for the load-test and benchmark scripts.
+"""
+
+import numpy as np
+
+
+def summarize_latencies(samples_ms):
+    """
+    Tính các chỉ số độ trễ (ms) từ danh sách mẫu.
+    Returns count/mean/min/max and p50/p90/p95/p99 in milliseconds.
+    """
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    if arr.size == 0:
+        return {"count": 0, "mean_ms": None, "min_ms": None, "max_ms": None,
+                "p50_ms": None, "p90_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p90, p95, p99 = np.percentile(arr, [50, 90, 95, 99])
+    return {
+        "count": int(arr.size),
+        "mean_ms": float(arr.mean()),
+        "min_ms": float(arr.min()),
+        "max_ms": float(arr.max()),
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+    }
+
+
+def format_row(name, stats, extra=""):
+    """Định dạng 1 dòng bảng kết quả / Format one result table row."""
+    if not stats["count"]:
+        return f"{name:<28} {'-':>7}"
+    return (
+        f"{name:<28} {stats['count']:>7} {stats['mean_ms']:>9.2f} {stats['p50_ms']:>9.2f} "
+        f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f} {extra}"
+    )
+
+
+TABLE_HEADER = f"{'case':<28} {'n':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"
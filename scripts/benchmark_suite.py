@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+benchmark_suite.py - Bộ benchmark thống nhất có baseline để bắt regression hiệu năng
+Unified benchmark runner with stored baselines.
+
+Mỗi case là 1 đường chạy production được đo riêng:
+  emotion, action, embedding   - các mô hình TFLite qua Detector (gồm tiền xử lý)
+  person_yolo, face_yolo       - 2 mô hình YOLO
+  process_frame                - toàn bộ Detector.process_frame
+  matching                     - db_utils.find_active_session_by_face trên gallery tổng hợp
+
+Mỗi case có warm-up riêng (không tính), sau đó đo --iterations lần trên các
+input khác nhau (không lặp 1 ảnh), báo cáo mean/p50/p90/p95/p99 và ghi JSON.
+
+Ví dụ / Examples:
+  python scripts/benchmark_suite.py --save-baseline bench/baseline.json
+  python scripts/benchmark_suite.py --baseline bench/baseline.json --tolerance 0.15 --json bench/latest.json
+  python scripts/benchmark_suite.py --cases emotion,embedding --images dataset/frames --faces dataset/crops
+
+Exit code 2 nếu có case chậm hơn baseline quá ngưỡng --tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+from bench_stats import summarize_latencies, format_row, TABLE_HEADER
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+# ----------------- Ngữ cảnh dùng chung / Shared context -----------------
+class BenchContext:
+    """Tải lười Detector, input và Mongo để chỉ case cần mới phải trả giá khởi tạo."""
+
+    def __init__(self, args):
+        self.args = args
+        self._detector = None
+        self._frames = None
+        self._faces = None
+        self._persons = None
+        self._db_utils = None
+
+    @property
+    def detector(self):
+        if self._detector is None:
+            from app.box_detector import Detector
+            self._detector = Detector()
+        return self._detector
+
+    @property
+    def frames(self):
+        """Frame đầy đủ (camera) / Full camera frames."""
+        if self._frames is None:
+            self._frames = _load_images(self.args.images, self.args.num_inputs) or _synthetic_frames(self.args.num_inputs)
+        return self._frames
+
+    @property
+    def faces(self):
+        """Ảnh crop khuôn mặt / Face crops."""
+        if self._faces is None:
+            self._faces = _load_images(self.args.faces, self.args.num_inputs) or [
+                _center_crop(f, 0.38, 0.22, 0.3) for f in self.frames
+            ]
+        return self._faces
+
+    @property
+    def persons(self):
+        """Ảnh crop người / Person crops."""
+        if self._persons is None:
+            self._persons = [_center_crop(f, 0.6, 0.45, 0.8) for f in self.frames]
+        return self._persons
+
+    @property
+    def db_utils(self):
+        if self._db_utils is None:
+            uri = self.args.mongo
+            if uri == "memory":
+                import mongo_standin
+                mongo_standin.install()
+                uri = "mongodb://standin"
+            os.environ["MONGODB_URI"] = uri
+            # Dùng DB riêng để không đụng dữ liệu thật / Never touch the production DB
+            os.environ["MONGODB_DB_NAME"] = self.args.mongo_db
+            from backend import db_utils
+            self._db_utils = db_utils
+        return self._db_utils
+
+
+def _load_images(directory, limit):
+    if not directory:
+        return []
+    paths = []
+    for dirpath, _, filenames in os.walk(directory):
+        paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(IMAGE_EXTS))
+    images = [img for img in (cv2.imread(p) for p in sorted(paths)[:limit]) if img is not None]
+    if not images:
+        raise SystemExit(f"Không đọc được ảnh nào trong {directory}")
+    return images
+
+
+def _synthetic_frames(count):
+    from load_test import synthetic_face_frame
+    return [synthetic_face_frame(i % 16, i) for i in range(count)]
+
+
+def _center_crop(frame, cy, cx, frac):
+    h, w = frame.shape[:2]
+    size = int(min(h, w) * frac)
+    y0 = max(0, int(h * cy) - size // 2)
+    x0 = max(0, int(w * cx) - size // 2)
+    return np.ascontiguousarray(frame[y0:y0 + size, x0:x0 + size])
+
+
+# ----------------- Các case / Cases -----------------
+# Mỗi case nhận BenchContext và trả về hàm run(i) chạy 1 lần với input thứ i.
+CASES = {}
+
+
+def bench_case(name, description):
+    def register(fn):
+        fn.description = description
+        CASES[name] = fn
+        return fn
+    return register
+
+
+@bench_case("emotion", "Detector._detect_emotion trên crop khuôn mặt")
+def _case_emotion(ctx):
+    det, faces = ctx.detector, ctx.faces
+    return lambda i: det._detect_emotion(faces[i % len(faces)])
+
+
+@bench_case("action", "Detector._detect_action trên crop người")
+def _case_action(ctx):
+    det, persons = ctx.detector, ctx.persons
+    return lambda i: det._detect_action(persons[i % len(persons)])
+
+
+@bench_case("embedding", "Detector._get_face_embedding trên crop khuôn mặt")
+def _case_embedding(ctx):
+    det, faces = ctx.detector, ctx.faces
+    return lambda i: det._get_face_embedding(faces[i % len(faces)])
+
+
+@bench_case("person_yolo", "YOLO người (DETECTOR_BACKEND), imgsz=640")
+def _case_person_yolo(ctx):
+    det, frames = ctx.detector, ctx.frames
+    return lambda i: det.person_model.predict(frames[i % len(frames)], conf=0.3, iou=0.45, imgsz=640, classes=[0])
+
+
+@bench_case("face_yolo", "YOLO khuôn mặt (DETECTOR_BACKEND) trên ROI người, imgsz=160")
+def _case_face_yolo(ctx):
+    det, persons = ctx.detector, ctx.persons
+    return lambda i: det.face_model.predict(persons[i % len(persons)], conf=0.3, iou=0.45, imgsz=160)
+
+
+@bench_case("process_frame", "Toàn bộ Detector.process_frame (DETECTION_POLICY)")
+def _case_process_frame(ctx):
+    det, frames = ctx.detector, ctx.frames
+    return lambda i: det.process_frame(frames[i % len(frames)])
+
+
+@bench_case("process_frame_fixed", "Detector.process_frame với policy fixed (640 / 160)")
+def _case_process_frame_fixed(ctx):
+    from app.resolution_policy import ResolutionPolicy
+    det, frames = ctx.detector, ctx.frames
+    policy = ResolutionPolicy.from_preset("fixed")
+    return lambda i: det.process_frame(frames[i % len(frames)], policy=policy)
+
+
+@bench_case("matching", "find_active_session_by_face trên gallery tổng hợp")
+def _case_matching(ctx):
+    db_utils = ctx.db_utils
+    size, dim = ctx.args.gallery_size, ctx.args.embedding_dim
+    rng = np.random.default_rng(0)
+    coll = db_utils.locker_sessions_collection
+    if coll.count_documents({"status": "active"}) != size:
+        coll.delete_many({})
+        vectors = rng.standard_normal((size, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        now = datetime.now(timezone.utc)
+        for start in range(0, size, 1000):
+            coll.insert_many([
+                {"locker_id": f"B{j:05d}", "face_embedding": v.tolist(), "status": "active",
+                 "created_at": now, "closed_at": None}
+                for j, v in enumerate(vectors[start:start + 1000], start)
+            ])
+    queries = rng.standard_normal((64, dim)).astype(np.float32)
+    return lambda i: db_utils.find_active_session_by_face(queries[i % len(queries)])
+
+
+# ----------------- Chạy & so sánh / Run & compare -----------------
+def run_case(name, ctx, warmup, iterations):
+    run = CASES[name](ctx)
+    for i in range(warmup):
+        run(i)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        run(warmup + i)
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize_latencies(samples)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def _environment():
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare_to_baseline(results, baseline, metric, tolerance):
+    """
+    So sánh từng case với baseline. Trả về danh sách regression.
+    A case regresses when current[metric] > baseline[metric] * (1 + tolerance).
+    """
+    regressions = []
+    print(f"\n📏 So sánh với baseline ({metric}, tolerance={tolerance:.0%})")
+    for name, stats in results["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if not base or base.get(metric) is None or stats.get(metric) is None:
+            print(f"  {name:<16} (không có baseline)")
+            continue
+        ratio = stats[metric] / base[metric] if base[metric] else float("inf")
+        regressed = ratio > 1 + tolerance
+        flag = "❌ REGRESSION" if regressed else ("✅ faster" if ratio < 1 - tolerance else "ok")
+        print(f"  {name:<16} {base[metric]:>9.2f} -> {stats[metric]:>9.2f} ms ({ratio - 1:+.1%}) {flag}")
+        if regressed:
+            regressions.append({"case": name, "baseline": base[metric], "current": stats[metric], "ratio": ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite cho các mô hình và đường xử lý của Detector")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"Danh sách case, mặc định: {','.join(CASES)}")
+    parser.add_argument("--list", action="store_true", help="Liệt kê các case rồi thoát")
+    parser.add_argument("--warmup", type=int, default=10, help="Số lần warm-up mỗi case (không tính)")
+    parser.add_argument("--iterations", type=int, default=200, help="Số lần đo mỗi case")
+    parser.add_argument("--images", help="Thư mục frame camera thật (mặc định: ảnh tổng hợp)")
+    parser.add_argument("--faces", help="Thư mục crop khuôn mặt thật (mặc định: cắt từ frame)")
+    parser.add_argument("--num-inputs", type=int, default=64, help="Số input khác nhau dùng luân phiên")
+    parser.add_argument("--mongo", default="memory", help="Case matching: 'memory' hoặc URI Mongo")
+    parser.add_argument("--mongo-db", default="lockai_bench", help="Tên DB dùng cho case matching")
+    parser.add_argument("--gallery-size", type=int, default=1000, help="Số session active cho case matching")
+    parser.add_argument("--embedding-dim", type=int, default=256, help="Số chiều embedding cho case matching")
+    parser.add_argument("--json", help="Ghi kết quả JSON ra file")
+    parser.add_argument("--save-baseline", help="Ghi kết quả làm baseline mới")
+    parser.add_argument("--baseline", help="File baseline để so sánh")
+    parser.add_argument("--metric", default="p50_ms", help="Chỉ số dùng để so sánh baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Ngưỡng chậm hơn cho phép (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, fn in CASES.items():
+            print(f"{name:<16} {fn.description}")
+        return 0
+
+    # Đường dẫn tương đối tính theo thư mục hiện tại, trước khi chuyển về root repo
+    for attr in ("images", "faces", "json", "save_baseline", "baseline"):
+        if getattr(args, attr):
+            setattr(args, attr, os.path.abspath(getattr(args, attr)))
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, ROOT_DIR)
+
+    selected = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in CASES]
+    if unknown:
+        parser.error(f"Case không tồn tại: {', '.join(unknown)}")
+
+    ctx = BenchContext(args)
+    results = {
+        "environment": _environment(),
+        "settings": {"warmup": args.warmup, "iterations": args.iterations, "num_inputs": args.num_inputs},
+        "cases": {},
+    }
+    print(TABLE_HEADER)
+    for name in selected:
+        stats = run_case(name, ctx, args.warmup, args.iterations)
+        results["cases"][name] = stats
+        print(format_row(name, stats))
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["regressions"] = compare_to_baseline(results, baseline, args.metric, args.tolerance)
+        if results["regressions"]:
+            exit_code = 2
+
+    for path in filter(None, [args.json, args.save_baseline]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 Đã ghi {path}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
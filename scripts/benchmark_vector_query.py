@@ -1,115 +1,270 @@
-from os import putenv
-putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
-putenv("ROCM_PATH", "/opt/rocm-6.3.0")
+#!/usr/bin/env python3
+"""
+benchmark_vector_query.py - Đo khả năng mở rộng của tìm kiếm khuôn mặt theo kích thước gallery
+Vector search scaling benchmark: Mongo aggregation vs in-process exact vs approximate.
 
+Sinh gallery vector đơn vị tổng hợp (mặc định 1k -> 1M, 64/128/256/512 chiều như các mô
+hình trong models/), mỗi danh tính có vài mẫu nhiễu quanh 1 tâm. Truy vấn là mẫu nhiễu
+mới của danh tính có trong gallery. So sánh:
+  mongo  - pipeline `$reduce` hiện tại (db_utils._cosine_sim_stage) trên MongoDB thật
+  exact  - quét NumPy chính xác (gallery @ q + argpartition); kèm throughput khi gom batch
+  ivf    - chỉ mục xấp xỉ IVF (k-means, nprobe cụm gần nhất) bằng NumPy, báo recall@k
+Kết quả in bảng và ghi CSV (--csv).
+
+Ví dụ / Examples:
+  python scripts/benchmark_vector_query.py --sizes 1000,10000,100000 --dims 256 --methods exact,ivf
+  python scripts/benchmark_vector_query.py --mongo mongodb://localhost:27017 --mongo-max-size 100000 --csv vq.csv
+"""
+
+import os
+import sys
+import csv
 import time
+import argparse
+
 import numpy as np
-import cv2
-from pymongo import MongoClient
-from datetime import datetime, timezone
-import tensorflow as tf
-from tensorflow.keras import layers, Model
-from fastapi import HTTPException
-
-# Kết nối MongoDB
-global_client = None
-def get_db_client(uri="mongodb://localhost:27017/"):
-    global global_client
-    if global_client is None:
-        global_client = MongoClient(uri)
-    return global_client
-
-def load_embedding_model(input_shape=(160, 160, 3), embedding_dim=64):
-    inputs = layers.Input(shape=input_shape)
-    x = layers.Conv2D(16, 3, activation='relu', padding='same')(inputs)
-    x = layers.BatchNormalization()(x)
-    x = layers.MaxPooling2D()(x)
-    x = layers.Conv2D(32, 3, activation='relu', padding='same')(x)
-    x = layers.BatchNormalization()(x)
-    x = layers.MaxPooling2D()(x)
-    x = layers.Conv2D(64, 3, activation='relu', padding='same')(x)
-    x = layers.GlobalAveragePooling2D()(x)
-    x = layers.Dropout(0.5)(x)
-    embeddings = layers.Dense(embedding_dim, activation=None, name='embeddings')(x)
-    embeddings = layers.Lambda(lambda t: tf.math.l2_normalize(t, axis=1))(embeddings)
-    model = Model(inputs, embeddings, name='embedding_model')
-    model.load_weights("models/face_embedding_model_64.h5")
-    return model
-
-def get_face_embedding(face_img, model):
-    try:
-        resized = cv2.resize(face_img, (160, 160))
-        arr = resized.astype(np.float32) / 255.0
-        inp = np.expand_dims(arr, 0)
-        return model.predict(inp)[0].tolist()
-    except Exception as e:
-        print(f"Embedding error: {e}")
-        return None
-
-def measure_latency_and_query(image_path, top_k=5, num_runs=100, mongo_uri="mongodb://localhost:27017/"):
+
+from bench_stats import summarize_latencies, format_row, TABLE_HEADER
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLES_PER_IDENTITY = 5
+
+
+def _normalize(x):
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+
+
+def synthetic_gallery(size, dim, noise, seed=0, chunk=100_000):
+    """Gallery float32 (size, dim) đơn vị: mỗi danh tính SAMPLES_PER_IDENTITY mẫu quanh 1 tâm."""
+    rng = np.random.default_rng(seed)
+    n_ids = max(1, size // SAMPLES_PER_IDENTITY)
+    centers = _normalize(rng.standard_normal((n_ids, dim), dtype=np.float32))
+    gallery = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, chunk):
+        end = min(size, start + chunk)
+        ids = np.arange(start, end) % n_ids
+        block = centers[ids] + rng.standard_normal((end - start, dim), dtype=np.float32) * (noise / np.sqrt(dim))
+        gallery[start:end] = _normalize(block)
+    return gallery, centers
+
+
+def synthetic_queries(centers, count, noise, seed=1):
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(0, len(centers), count)
+    dim = centers.shape[1]
+    return _normalize(centers[ids] + rng.standard_normal((count, dim), dtype=np.float32) * (noise / np.sqrt(dim)))
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+# ----------------- Exact -----------------
+def bench_exact(gallery, queries, k, batch):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(top_k(gallery @ q, k))
+        latencies.append((time.perf_counter() - start) * 1000)
+    # Throughput khi gom batch truy vấn (vd. nhiều camera) / batched throughput
+    start = time.perf_counter()
+    for s in range(0, len(queries), batch):
+        scores = queries[s:s + batch] @ gallery.T
+        for row in scores:
+            top_k(row, k)
+    batched_qps = len(queries) / (time.perf_counter() - start)
+    return latencies, results, {"batched_qps": batched_qps}
+
+
+# ----------------- IVF (xấp xỉ) -----------------
+class IVFIndex:
+    """
+    Inverted-file index: k-means thành nlist cụm, vector sắp lại liền nhau theo cụm.
+    Truy vấn chỉ quét nprobe cụm có tâm gần nhất.
+    """
+
+    def __init__(self, gallery, nlist, iterations=10, train_size=100_000, seed=0):
+        rng = np.random.default_rng(seed)
+        train = gallery[rng.choice(len(gallery), min(len(gallery), max(train_size, nlist * 4)), replace=False)]
+        centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = self._assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        assign = self._assign(gallery, centroids)
+        order = np.argsort(assign, kind="stable")
+        self.ids = order
+        self.vectors = np.ascontiguousarray(gallery[order])
+        counts = np.bincount(assign, minlength=nlist)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk=65536):
+        out = np.empty(len(vectors), dtype=np.int64)
+        for s in range(0, len(vectors), chunk):
+            out[s:s + chunk] = np.argmax(vectors[s:s + chunk] @ centroids.T, axis=1)
+        return out
+
+    def search(self, q, k, nprobe):
+        lists = top_k(self.centroids @ q, nprobe)
+        ranges = [(self.offsets[c], self.offsets[c + 1]) for c in lists]
+        candidates = np.concatenate([np.arange(a, b) for a, b in ranges]) if ranges else np.zeros(0, np.int64)
+        if not len(candidates):
+            return candidates
+        scores = np.concatenate([self.vectors[a:b] @ q for a, b in ranges])
+        return self.ids[candidates[top_k(scores, k)]]
+
+
+def bench_ivf(gallery, queries, k, nprobe, truth):
+    nlist = max(1, int(4 * np.sqrt(len(gallery))))
+    start = time.perf_counter()
+    index = IVFIndex(gallery, nlist)
+    build_s = time.perf_counter() - start
+    latencies, hits = [], 0
+    for q, exact in zip(queries, truth):
+        start = time.perf_counter()
+        found = index.search(q, k, min(nprobe, nlist))
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(np.intersect1d(found, exact))
+    recall = hits / float(sum(len(t) for t in truth))
+    return latencies, {"build_s": build_s, "recall": recall, "nlist": nlist, "nprobe": min(nprobe, nlist)}
+
+
+# ----------------- Mongo $reduce -----------------
+def bench_mongo(db_utils, gallery, queries, k, chunk=5000):
+    """Nạp gallery vào collection tạm rồi chạy đúng pipeline của find_active_session_by_face."""
+    collection = db_utils.db[f"vector_bench_{gallery.shape[1]}"]
+    collection.drop()
+    start = time.perf_counter()
+    for s in range(0, len(gallery), chunk):
+        collection.insert_many([{"face_embedding": v, "status": "active", "locker_id": f"B{s + i}"}
+                                for i, v in enumerate(gallery[s:s + chunk].astype(float).tolist())],
+                               ordered=False)
+    collection.create_index("status")
+    load_s = time.perf_counter() - start
+
+    latencies = []
     try:
-        client = get_db_client(mongo_uri)
-        db = client["face_recognition_db"]
-        face_collection = db["faces"]
-
-        model = load_embedding_model()
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Cannot read image: {image_path}")
-        q_emb = get_face_embedding(img, model)
-        if q_emb is None:
-            raise ValueError("Failed to extract embedding.")
-        query_vec = np.array(q_emb, dtype=np.float32).tolist()
-
-        total = 0.0
-        for _ in range(num_runs):
-            start = time.time()
+        for q in queries:
             pipeline = [
-                # dot product
-                {"$addFields": {
-                    "dot": {"$sum": {"$map": {
-                        "input": {"$range": [0, {"$size": "$face_embedding"}]},
-                        "as": "idx",
-                        "in": {"$multiply": [
-                            {"$arrayElemAt": ["$face_embedding", "$$idx"]},
-                            {"$arrayElemAt": [query_vec, "$$idx"]}
-                        ]}
-                    }}}
-                }},
-                # magnitudes
-                {"$addFields": {
-                    "magDoc": {"$sqrt": {"$sum": {"$map": {
-                        "input": "$face_embedding",
-                        "as": "val",
-                        "in": {"$multiply": ["$$val", "$$val"]}
-                    }}}},
-                    "magQuery": {"$sqrt": {"$sum": {"$map": {
-                        "input": query_vec,
-                        "as": "qv",
-                        "in": {"$multiply": ["$$qv", "$$qv"]}
-                    }}}}
-                }},
-                # cosineSim
-                {"$addFields": {
-                    "cosineSim": {
-                        "$cond": [
-                            {"$eq": ["$magDoc", 0]}, 0,
-                            {"$divide": ["$dot", {"$multiply": ["$magDoc", "$magQuery"]}]}
-                        ]
-                    }
-                }},
+                {"$match": {"status": "active"}},
+                db_utils._cosine_sim_stage(q.astype(float).tolist()),
                 {"$sort": {"cosineSim": -1}},
-                {"$limit": top_k},
-                {"$project": {"_id": 0, "name": 1, "cosineSim": 1}}
+                {"$limit": k},
+                {"$project": {"locker_id": 1, "cosineSim": 1}},
             ]
-            list(face_collection.aggregate(pipeline))
-            total += (time.time() - start) * 1000
-        avg = total / num_runs
-        print(f"Avg latency: {avg:.2f} ms over {num_runs} runs")
-        return avg
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
+            start = time.perf_counter()
+            list(collection.aggregate(pipeline, allowDiskUse=True))
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        collection.drop()
+    return latencies, {"build_s": load_s}
+
+
+def connect_mongo(uri, db_name):
+    if uri == "memory":
+        # Stand-in tính $reduce bằng NumPy nên không phản ánh chi phí Mongo thật
+        raise SystemExit("--mongo memory không đo được pipeline thật; dùng URI MongoDB")
+    os.environ["MONGODB_URI"] = uri
+    os.environ["MONGODB_DB_NAME"] = db_name
+    sys.path.insert(0, ROOT_DIR)
+    from backend import db_utils
+    return db_utils
+
+
+def _ints(text):
+    return [int(float(x)) for x in text.split(",") if x]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tìm kiếm vector: Mongo $reduce vs NumPy exact vs IVF")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="Kích thước gallery")
+    parser.add_argument("--dims", default="64,128,256,512", help="Số chiều embedding")
+    parser.add_argument("--methods", default="mongo,exact,ivf")
+    parser.add_argument("--queries", type=int, default=200, help="Số truy vấn cho exact / ivf")
+    parser.add_argument("--mongo-queries", type=int, default=10, help="Số truy vấn cho mongo (chậm)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=32, help="Kích thước batch khi đo throughput exact")
+    parser.add_argument("--nprobe", type=int, default=8, help="Số cụm IVF quét mỗi truy vấn")
+    parser.add_argument("--noise", type=float, default=0.6, help="Độ nhiễu giữa các mẫu cùng danh tính")
+    parser.add_argument("--mongo", default=os.getenv("MONGODB_URI"), help="URI MongoDB cho method mongo")
+    parser.add_argument("--mongo-db", default="lockai_vector_bench", help="DB tạm cho benchmark (bị ghi / xoá)")
+    parser.add_argument("--mongo-max-size", type=int, default=100_000,
+                        help="Bỏ qua mongo với gallery lớn hơn (nạp rất lâu)")
+    parser.add_argument("--max-gallery-gb", type=float, default=4.0, help="Bỏ qua tổ hợp cần RAM lớn hơn")
+    parser.add_argument("--csv", help="Ghi kết quả ra file CSV")
+    args = parser.parse_args()
+
+    methods = [m for m in args.methods.split(",") if m]
+    db_utils = None
+    if "mongo" in methods:
+        if not args.mongo:
+            print("[Bench] Không có MONGODB_URI / --mongo -> bỏ qua method mongo")
+            methods.remove("mongo")
+        else:
+            db_utils = connect_mongo(args.mongo, args.mongo_db)
+
+    rows = []
+    print(TABLE_HEADER + f" {'qps':>9}  ghi chú")
+    for dim in _ints(args.dims):
+        for size in _ints(args.sizes):
+            gallery_gb = size * dim * 4 / 1e9
+            if gallery_gb > args.max_gallery_gb:
+                print(f"{'-':<28} bỏ qua {size}x{dim}: cần {gallery_gb:.1f} GB > --max-gallery-gb")
+                continue
+            gallery, centers = synthetic_gallery(size, dim, args.noise)
+            queries = synthetic_queries(centers, args.queries, args.noise)
+            truth = None
+            for method in methods:
+                extra, notes = {}, ""
+                if method == "exact":
+                    latencies, truth, extra = bench_exact(gallery, queries, args.top_k, args.batch)
+                    notes = f"batched_qps={extra['batched_qps']:.0f}"
+                elif method == "ivf":
+                    if truth is None:
+                        truth = [top_k(gallery @ q, args.top_k) for q in queries]
+                    latencies, extra = bench_ivf(gallery, queries, args.top_k, args.nprobe, truth)
+                    notes = (f"recall@{args.top_k}={extra['recall']:.3f} nlist={extra['nlist']} "
+                             f"nprobe={extra['nprobe']} build={extra['build_s']:.1f}s")
+                elif method == "mongo":
+                    if size > args.mongo_max_size:
+                        print(f"{'mongo ' + str(size) + 'x' + str(dim):<28} bỏ qua (> --mongo-max-size)")
+                        continue
+                    latencies, extra = bench_mongo(db_utils, gallery, queries[:args.mongo_queries], args.top_k)
+                    notes = f"load={extra['build_s']:.1f}s"
+                else:
+                    raise SystemExit(f"Method không hợp lệ: {method}")
+
+                stats = summarize_latencies(latencies)
+                qps = 1000.0 / stats["mean_ms"] if stats["mean_ms"] else 0.0
+                name = f"{method} {size}x{dim}"
+                print(format_row(name, stats, f"{qps:>9.1f}  {notes}"))
+                rows.append({
+                    "method": method, "size": size, "dim": dim, "queries": stats["count"],
+                    "mean_ms": round(stats["mean_ms"], 4), "p50_ms": round(stats["p50_ms"], 4),
+                    "p95_ms": round(stats["p95_ms"], 4), "p99_ms": round(stats["p99_ms"], 4),
+                    "qps": round(qps, 2),
+                    "batched_qps": round(extra.get("batched_qps", 0.0), 2) or "",
+                    "recall_at_k": round(extra["recall"], 4) if "recall" in extra else "",
+                    "build_s": round(extra["build_s"], 3) if "build_s" in extra else "",
+                })
+            del gallery
+
+    if args.csv and rows:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"\n[Bench] Đã ghi {len(rows)} dòng -> {args.csv}")
+
 
 if __name__ == "__main__":
-    measure_latency_and_query("test_imgs/HoangDinhHaiAnh_2.jpg")
+    main()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+calibrate_thresholds.py - Hiệu chỉnh UNLOCK_THRESHOLD / EXISTING_FACE_THRESHOLD
+Offline threshold calibration from a labeled face set.
+
+Bước 1 (embed): trích embedding (đã chuẩn hóa) của bộ ảnh có nhãn bằng mô hình
+production, ghi ra các shard `.npy` memory-mapped trong --work-dir (kèm labels.npy,
+meta.json). Chạy lại với cùng --work-dir sẽ dùng lại shard đã có (trừ khi --re-embed).
+
+Bước 2 (score): duyệt mọi cặp ảnh theo khối (block x block) bằng nhân ma trận; điểm
+cosine của cặp cùng người (genuine) và khác người (impostor) được cộng dồn vào histogram
+cố định, nên RAM chỉ phụ thuộc kích thước khối chứ không phụ thuộc số cặp.
+
+Bước 3: tính đường FAR/FRR theo ngưỡng, EER và ngưỡng đề xuất:
+  - UNLOCK_THRESHOLD: FRR nhỏ nhất với FAR hệ thống <= --unlock-far
+  - EXISTING_FACE_THRESHOLD: FRR nhỏ nhất với FAR hệ thống <= --existing-far
+FAR hệ thống ~ FAR mỗi cặp x số session active (--active-sessions), vì /retrieve và
+/store so khuôn mặt với tất cả session đang active.
+FRR chính là tỉ lệ người dùng phải thử lại; số lần gọi trung bình = 1 / (1 - FRR).
+
+Bộ ảnh có nhãn: --faces-dir <root>/<danh tính>/*.jpg hoặc --manifest như ingest_gallery.py.
+Ảnh chưa cắt sẵn khuôn mặt thì thêm --detect.
+
+Ví dụ / Examples:
+  python scripts/calibrate_thresholds.py --faces-dir dataset/faces --work-dir calib/
+  python scripts/calibrate_thresholds.py --manifest gallery/manifest.csv --detect --active-sessions 48
+"""
+
+from os import putenv
+putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
+putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+import numpy as np
+
+from ingest_gallery import IMAGE_EXTS, read_manifest, decode_stream, batched, best_face_crops
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Histogram điểm cosine trên [-1, 1] / Fixed score histogram over [-1, 1]
+N_BINS = 4000
+
+
+# ----------------- Bước 1: embed vào shard memmap -----------------
+def labeled_items(args):
+    """Trả về list (nhãn, tên, đường dẫn ảnh, source) giống item của ingest_gallery.py."""
+    if args.manifest:
+        return read_manifest(args.manifest)[0]
+    root = args.faces_dir
+    items = []
+    for identity in sorted(os.listdir(root)):
+        folder = os.path.join(root, identity)
+        if os.path.isdir(folder):
+            items.extend((identity, identity, os.path.join(folder, f), f"{identity}/{f}")
+                         for f in sorted(os.listdir(folder)) if f.lower().endswith(IMAGE_EXTS))
+    return items
+
+
+def embed_to_shards(args, items, work_dir):
+    """Trích embedding theo batch, ghi các shard float32 (shard_size, dim) bằng open_memmap."""
+    from app.config import EMBED_TFLITE_MODEL_PATH
+    from app.embedder import BatchEmbedder
+
+    face_model = None
+    if args.detect:
+        from app.detector_backends import create_detector_backend
+        face_model = create_detector_backend("face")
+    embedder = BatchEmbedder(batch_size=args.batch_size)
+
+    identities = {}
+    labels, shards = [], []
+    shard, shard_rows = None, 0
+    skipped = 0
+
+    def new_shard():
+        path = os.path.join(work_dir, f"embeddings_{len(shards):05d}.npy")
+        shards.append(os.path.basename(path))
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(args.shard_size, embedder.dim))
+
+    def trim_shard(rows):
+        """Cắt shard cuối về đúng số dòng; gọi sau khi đã flush và bỏ mọi tham chiếu tới memmap của nó."""
+        if rows == args.shard_size:
+            return
+        path = os.path.join(work_dir, shards[-1])
+        data = np.load(path, mmap_mode="r")
+        trimmed = data[:rows].copy()
+        del data
+        # Ghi file mới rồi thay nguyên tử, không ghi đè file đang được map
+        tmp = path[:-len(".npy")] + ".tmp.npy"
+        np.save(tmp, trimmed)
+        os.replace(tmp, path)
+
+    start = time.perf_counter()
+    for batch in batched(decode_stream(items, args.workers, args.batch_size * 4), args.batch_size):
+        images = [(item, image) for item, image, _ in batch if image is not None]
+        skipped += len(batch) - len(images)
+        if face_model is not None and images:
+            crops = best_face_crops(face_model, [img for _, img in images], args.imgsz, 0.3, 0.45)
+            pairs = [(item, c[0]) for (item, _), c in zip(images, crops) if c is not None]
+            skipped += len(images) - len(pairs)
+        else:
+            pairs = images
+        if not pairs:
+            continue
+
+        vectors = embedder.embed([crop for _, crop in pairs])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        keep = norms[:, 0] > 0
+        skipped += int((~keep).sum())
+        vectors = vectors[keep] / norms[keep]
+        for (item, _), ok in zip(pairs, keep):
+            if ok:
+                labels.append(identities.setdefault(item[0], len(identities)))
+
+        while len(vectors):
+            if shard is None:
+                shard, shard_rows = new_shard(), 0
+            take = min(len(vectors), args.shard_size - shard_rows)
+            shard[shard_rows:shard_rows + take] = vectors[:take]
+            shard_rows += take
+            vectors = vectors[take:]
+            if shard_rows == args.shard_size:
+                shard.flush()
+                shard = None
+        print(f"[Calib] Đã embed {len(labels)}/{len(items)} ảnh", end="\r")
+    if shard is not None:
+        shard.flush()
+        shard = None
+        trim_shard(shard_rows)
+    print()
+
+    np.save(os.path.join(work_dir, "labels.npy"), np.asarray(labels, dtype=np.int32))
+    meta = {
+        "model": os.path.basename(EMBED_TFLITE_MODEL_PATH),
+        "dim": embedder.dim,
+        "count": len(labels),
+        "identities": len(identities),
+        "skipped": skipped,
+        "shards": shards,
+        "source": args.manifest or args.faces_dir,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+    with open(os.path.join(work_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    return meta
+
+
+# ----------------- Bước 2: histogram điểm theo khối -----------------
+def iter_blocks(work_dir, shards, block_size):
+    """Các khối (offset toàn cục, view memmap) / Global-offset blocks over the memmapped shards."""
+    offset = 0
+    for name in shards:
+        data = np.load(os.path.join(work_dir, name), mmap_mode="r")
+        for start in range(0, len(data), block_size):
+            block = data[start:start + block_size]
+            yield offset + start, block
+        offset += len(data)
+
+
+def score_histograms(work_dir, meta, block_size):
+    """
+    Histogram điểm genuine / impostor trên mọi cặp (i < j), tính theo khối.
+    Bộ nhớ đỉnh ~ 2 khối embedding + 1 ma trận block x block.
+    """
+    labels = np.load(os.path.join(work_dir, "labels.npy"))
+    genuine = np.zeros(N_BINS, dtype=np.int64)
+    impostor = np.zeros(N_BINS, dtype=np.int64)
+    blocks = list(iter_blocks(work_dir, meta["shards"], block_size))
+
+    for bi, (off_i, block_i) in enumerate(blocks):
+        a = np.ascontiguousarray(block_i)
+        lab_i = labels[off_i:off_i + len(a)]
+        for off_j, block_j in blocks[bi:]:
+            b = a if off_j == off_i else np.ascontiguousarray(block_j)
+            lab_j = labels[off_j:off_j + len(b)]
+            scores = a @ b.T
+            bins = ((scores + 1.0) * (N_BINS / 2.0)).astype(np.int32)
+            np.clip(bins, 0, N_BINS - 1, out=bins)
+            same = lab_i[:, None] == lab_j[None, :]
+            if off_j == off_i:
+                # Chỉ lấy tam giác trên, bỏ đường chéo (ảnh so với chính nó)
+                upper = np.triu(np.ones(same.shape, dtype=bool), k=1)
+                genuine += np.bincount(bins[same & upper], minlength=N_BINS)
+                impostor += np.bincount(bins[~same & upper], minlength=N_BINS)
+            else:
+                genuine += np.bincount(bins[same], minlength=N_BINS)
+                impostor += np.bincount(bins[~same], minlength=N_BINS)
+        print(f"[Calib] Khối {bi + 1}/{len(blocks)}", end="\r")
+    print()
+    return genuine, impostor
+
+
+# ----------------- Bước 3: FAR / FRR -----------------
+def far_frr_curve(genuine, impostor):
+    """
+    Với ngưỡng t = cạnh dưới của mỗi bin (chấp nhận khi score >= t):
+      FAR(t) = tỉ lệ impostor >= t, FRR(t) = tỉ lệ genuine < t.
+    """
+    thresholds = np.linspace(-1.0, 1.0, N_BINS, endpoint=False)
+    far = impostor[::-1].cumsum()[::-1] / max(1, impostor.sum())
+    frr = np.concatenate([[0], genuine.cumsum()[:-1]]) / max(1, genuine.sum())
+    return thresholds, far, frr
+
+
+def equal_error_rate(thresholds, far, frr):
+    i = int(np.argmin(np.abs(far - frr)))
+    return float(thresholds[i]), float((far[i] + frr[i]) / 2)
+
+
+def recommend(thresholds, far, frr, target_far):
+    """Ngưỡng thấp nhất (FRR nhỏ nhất) có FAR mỗi cặp <= target_far."""
+    ok = np.nonzero(far <= target_far)[0]
+    if not len(ok):
+        return None
+    i = int(ok[0])
+    return {"threshold": round(float(thresholds[i]), 4), "far": float(far[i]), "frr": float(frr[i]),
+            "expected_attempts": round(1.0 / max(1e-9, 1.0 - float(frr[i])), 3)}
+
+
+def at_threshold(thresholds, far, frr, value):
+    i = int(np.clip(np.searchsorted(thresholds, value, side="left"), 0, len(thresholds) - 1))
+    return {"threshold": value, "far": float(far[i]), "frr": float(frr[i]),
+            "expected_attempts": round(1.0 / max(1e-9, 1.0 - float(frr[i])), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hiệu chỉnh ngưỡng cosine cho mở tủ / phát hiện mặt đã gửi đồ")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--faces-dir", help="Thư mục <danh tính>/<ảnh>")
+    source.add_argument("--manifest", help="Manifest CSV / JSONL (user_id, name, path) như ingest_gallery.py")
+    parser.add_argument("--work-dir", default="calibration", help="Nơi lưu shard embedding và kết quả")
+    parser.add_argument("--re-embed", action="store_true", help="Bỏ shard cũ, trích embedding lại")
+    parser.add_argument("--detect", action="store_true", help="Cắt khuôn mặt bằng YOLO trước khi embed")
+    parser.add_argument("--imgsz", type=int, default=640, help="imgsz YOLO khuôn mặt khi --detect")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=min(8, (os.cpu_count() or 1) * 2))
+    parser.add_argument("--shard-size", type=int, default=50000, help="Số embedding mỗi shard .npy")
+    parser.add_argument("--block-size", type=int, default=4096,
+                        help="Kích thước khối khi nhân ma trận (RAM ~ block^2 x 4 byte)")
+    parser.add_argument("--active-sessions", type=int, default=12,
+                        help="Số session active điển hình (số tủ) để quy đổi FAR hệ thống")
+    parser.add_argument("--unlock-far", type=float, default=1e-3,
+                        help="FAR hệ thống tối đa khi mở tủ (người lạ mở nhầm tủ)")
+    parser.add_argument("--existing-far", type=float, default=1e-4,
+                        help="FAR hệ thống tối đa khi kiểm tra mặt đã gửi đồ (chặn nhầm người mới)")
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    if args.manifest:
+        args.manifest = os.path.abspath(args.manifest)
+    if args.faces_dir:
+        args.faces_dir = os.path.abspath(args.faces_dir)
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, ROOT_DIR)
+
+    meta_path = os.path.join(work_dir, "meta.json")
+    if os.path.exists(meta_path) and not args.re_embed:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        print(f"[Calib] Dùng lại {meta['count']} embedding ({meta['identities']} người) trong {work_dir}")
+    else:
+        if not (args.faces_dir or args.manifest):
+            parser.error("Cần --faces-dir hoặc --manifest khi chưa có shard embedding")
+        items = labeled_items(args)
+        print(f"[Calib] Trích embedding {len(items)} ảnh -> {work_dir}")
+        meta = embed_to_shards(args, items, work_dir)
+        print(f"[Calib] {meta['count']} embedding, {meta['identities']} người, bỏ qua {meta['skipped']} ảnh "
+              f"({meta['seconds']} s)")
+
+    start = time.perf_counter()
+    genuine, impostor = score_histograms(work_dir, meta, args.block_size)
+    print(f"[Calib] {int(genuine.sum())} cặp genuine, {int(impostor.sum())} cặp impostor "
+          f"({time.perf_counter() - start:.1f} s)")
+    if not genuine.sum() or not impostor.sum():
+        print("❌ Cần ít nhất 2 ảnh / người và 2 người để hiệu chỉnh")
+        sys.exit(1)
+
+    thresholds, far, frr = far_frr_curve(genuine, impostor)
+    eer_threshold, eer = equal_error_rate(thresholds, far, frr)
+    sessions = max(1, args.active_sessions)
+    report = {
+        "embeddings": meta["count"],
+        "identities": meta["identities"],
+        "model": meta["model"],
+        "genuine_pairs": int(genuine.sum()),
+        "impostor_pairs": int(impostor.sum()),
+        "eer": round(eer, 5),
+        "eer_threshold": round(eer_threshold, 4),
+        "active_sessions": sessions,
+        "recommended": {
+            "UNLOCK_THRESHOLD": recommend(thresholds, far, frr, args.unlock_far / sessions),
+            "EXISTING_FACE_THRESHOLD": recommend(thresholds, far, frr, args.existing_far / sessions),
+        },
+        "current": {
+            "UNLOCK_THRESHOLD": at_threshold(thresholds, far, frr, float(os.getenv("UNLOCK_THRESHOLD", "0.93"))),
+            "EXISTING_FACE_THRESHOLD": at_threshold(thresholds, far, frr,
+                                                    float(os.getenv("EXISTING_FACE_THRESHOLD", "0.95"))),
+        },
+    }
+
+    np.savez(os.path.join(work_dir, "histograms.npz"), genuine=genuine, impostor=impostor, thresholds=thresholds)
+    with open(os.path.join(work_dir, "far_frr.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["threshold", "far", "frr"])
+        for i in range(0, N_BINS, 4):
+            writer.writerow([f"{thresholds[i]:.4f}", f"{far[i]:.8f}", f"{frr[i]:.8f}"])
+    with open(os.path.join(work_dir, "report.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nEER = {eer:.4%} tại ngưỡng {eer_threshold:.4f}")
+    for name in ("UNLOCK_THRESHOLD", "EXISTING_FACE_THRESHOLD"):
+        cur, rec = report["current"][name], report["recommended"][name]
+        print(f"{name:<24} hiện tại {cur['threshold']:.4f}: FAR={cur['far']:.2e} FRR={cur['frr']:.2%} "
+              f"(~{cur['expected_attempts']} lần thử)")
+        if rec:
+            print(f"{'':<24} đề xuất  {rec['threshold']:.4f}: FAR={rec['far']:.2e} FRR={rec['frr']:.2%} "
+                  f"(~{rec['expected_attempts']} lần thử)")
+        else:
+            print(f"{'':<24} không đạt được FAR mục tiêu với dữ liệu này")
+    min_far = min(args.unlock_far, args.existing_far) / sessions
+    if impostor.sum() * min_far < 10:
+        # Quá ít cặp impostor thì FAR ước lượng ở mức mục tiêu chỉ dựa trên vài cặp
+        print(f"⚠️ Chỉ có {int(impostor.sum())} cặp impostor, cần >= {int(np.ceil(10 / min_far))} "
+              f"để ước lượng FAR {min_far:.1e} đáng tin cậy; hãy thêm người vào bộ dữ liệu")
+    lines = [f"{n}={r['threshold']}" for n, r in report["recommended"].items() if r]
+    if lines:
+        print("\nThêm vào .env:\n" + "\n".join(lines))
+    print(f"\nĐường FAR/FRR: {os.path.join(work_dir, 'far_frr.csv')}")
+
+
+if __name__ == "__main__":
+    main()
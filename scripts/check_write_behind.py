@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+check_write_behind.py - Kiểm tra bảng tủ ở chế độ write-behind không mất lần cấp tủ khi nạp lại
+Write-behind locker table check: allocations survive a reload such as /init_lockers.
+
+Không cần Mongo: dùng storage giả trong bộ nhớ (không bao giờ thấy các lần cấp tủ vì chúng chỉ nằm
+trong journal), cấp 1 tủ, rồi làm đúng như /init_lockers (create_lockers + LockerTable.load) và kiểm
+tra: tủ đã cấp vẫn occupied, tủ mới được thêm, lần cấp kế tiếp không trùng tủ. Exit code 1 nếu sai.
+
+Ví dụ / Example:
+  python scripts/check_write_behind.py
+"""
+
+import os
+import sys
+from datetime import datetime, timezone
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from backend.locker_state import LockerTable
+
+
+class StaleStorage:
+    """Bảng lockers của DB khi các lần cấp tủ vẫn còn chờ trong journal write-behind."""
+
+    name = "stale"
+
+    def __init__(self, count):
+        self.lockers = {}
+        self.create_lockers(count)
+
+    def create_lockers(self, count):
+        created = 0
+        now = datetime.now(timezone.utc)
+        for i in range(1, count + 1):
+            locker_id = f"L{i:02d}"
+            if locker_id not in self.lockers:
+                self.lockers[locker_id] = {"locker_id": locker_id, "status": "free", "current_session_id": None,
+                                           "created_at": now, "updated_at": now}
+                created += 1
+        return created
+
+    def load_locker_states(self):
+        return [dict(doc) for doc in self.lockers.values()]
+
+
+def main():
+    storage = StaleStorage(2)
+    table = LockerTable(policy="lowest_id", write_through=False, storage=storage)
+    table.load()
+    first = table.allocate("session-a")
+
+    # /init_lockers: tạo thêm tủ rồi nạp lại bảng
+    created = storage.create_lockers(4)
+    table.load()
+    second = table.allocate("session-b")
+
+    summary = table.summary()
+    checks = [
+        (f"tủ đầu tiên được cấp ({first})", first is not None),
+        ("/init_lockers thêm tủ mới", created == 2 and summary["total_lockers"] == 4),
+        (f"tủ {first} vẫn do session-a giữ sau khi nạp lại",
+         table._lockers[first]["current_session_id"] == "session-a"),
+        (f"lần cấp sau không trùng tủ ({second})", second is not None and second != first),
+        ("còn đúng 2 tủ trống", summary["free_lockers"] == 2),
+    ]
+    ok = True
+    for name, passed in checks:
+        print(f"{'OK  ' if passed else 'FAIL'} {name}")
+        ok = ok and passed
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
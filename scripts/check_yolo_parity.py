@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+check_yolo_parity.py - Kiểm tra backend onnxruntime cho kết quả khớp với Ultralytics/torch
+Parity check between the onnxruntime and ultralytics detector backends.
+
+Chạy cả hai backend trên cùng bộ ảnh (người: frame đầy đủ, khuôn mặt: crop người),
+ghép box theo IoU và báo cáo: recall / precision của ONNX so với torch, IoU trung
+bình của các cặp khớp, độ lệch confidence lớn nhất. Exit code 1 nếu vượt ngưỡng.
+
+Ví dụ / Example:
+  python scripts/check_yolo_parity.py --images dataset/frames --min-recall 0.98 --min-iou 0.9
+"""
+
+from os import putenv
+putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
+putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
+
+import os
+import sys
+import argparse
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app.detector_backends import create_detector_backend
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+def box_iou(a, b):
+    """IoU giữa 2 tập box xyxy / Pairwise IoU (len(a), len(b))."""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod((rb - lt).clip(0), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match(ref, test, iou_threshold=0.5):
+    """Ghép tham lam theo IoU / Greedy IoU matching. Trả về [(i_ref, i_test, iou)]."""
+    (ref_boxes, _), (test_boxes, _) = ref, test
+    if not len(ref_boxes) or not len(test_boxes):
+        return []
+    ious = box_iou(ref_boxes, test_boxes)
+    pairs = []
+    while True:
+        i, j = np.unravel_index(np.argmax(ious), ious.shape)
+        if ious[i, j] < iou_threshold:
+            return pairs
+        pairs.append((i, j, float(ious[i, j])))
+        ious[i, :] = -1
+        ious[:, j] = -1
+
+
+def compare(kind, images, imgsz, classes, torch_backend, onnx_backend):
+    totals = {"ref": 0, "test": 0, "matched": 0, "ious": [], "conf_delta": 0.0}
+    for image in images:
+        ref = torch_backend.predict(image, conf=0.3, iou=0.45, imgsz=imgsz, classes=classes)
+        test = onnx_backend.predict(image, conf=0.3, iou=0.45, imgsz=imgsz, classes=classes)
+        pairs = match(ref, test)
+        totals["ref"] += len(ref[1])
+        totals["test"] += len(test[1])
+        totals["matched"] += len(pairs)
+        totals["ious"].extend(p[2] for p in pairs)
+        for i, j, _ in pairs:
+            totals["conf_delta"] = max(totals["conf_delta"], abs(float(ref[1][i]) - float(test[1][j])))
+    recall = totals["matched"] / totals["ref"] if totals["ref"] else 1.0
+    precision = totals["matched"] / totals["test"] if totals["test"] else 1.0
+    mean_iou = float(np.mean(totals["ious"])) if totals["ious"] else 1.0
+    print(f"{kind:<7} torch={totals['ref']:<5} onnx={totals['test']:<5} recall={recall:.3f} "
+          f"precision={precision:.3f} mean_iou={mean_iou:.3f} max_conf_delta={totals['conf_delta']:.3f}")
+    return recall, precision, mean_iou
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So khớp kết quả YOLO giữa onnxruntime và ultralytics")
+    parser.add_argument("--images", required=True, help="Thư mục frame camera thật")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--min-recall", type=float, default=0.98)
+    parser.add_argument("--min-precision", type=float, default=0.98)
+    parser.add_argument("--min-iou", type=float, default=0.90)
+    args = parser.parse_args()
+
+    paths = sorted(os.path.join(d, f) for d, _, fs in os.walk(args.images) for f in fs if f.lower().endswith(IMAGE_EXTS))
+    frames = [img for img in (cv2.imread(p) for p in paths[:args.limit]) if img is not None]
+    if not frames:
+        raise SystemExit(f"Không đọc được ảnh nào trong {args.images}")
+    os.chdir(ROOT_DIR)
+
+    ok = True
+    torch_person = create_detector_backend("person", "ultralytics")
+    onnx_person = create_detector_backend("person", "onnxruntime")
+    result = compare("person", frames, 640, [0], torch_person, onnx_person)
+
+    # Crop người theo box torch để kiểm tra mô hình khuôn mặt trên đúng loại input production
+    crops = []
+    for frame in frames:
+        boxes, _ = torch_person.predict(frame, conf=0.3, iou=0.45, imgsz=640, classes=[0])
+        crops.extend(frame[int(y1):int(y2), int(x1):int(x2)] for x1, y1, x2, y2 in boxes if x2 > x1 and y2 > y1)
+    results = [result]
+    if crops:
+        results.append(compare("face", crops, 160, None,
+                               create_detector_backend("face", "ultralytics"),
+                               create_detector_backend("face", "onnxruntime")))
+
+    for recall, precision, mean_iou in results:
+        ok &= recall >= args.min_recall and precision >= args.min_precision and mean_iou >= args.min_iou
+    print("✅ PARITY OK" if ok else "❌ PARITY FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+export_yolo_onnx.py - Xuất mô hình YOLO (người / khuôn mặt) sang ONNX cho backend onnxruntime
+Export the person and face YOLO models to ONNX for DETECTOR_BACKEND=onnxruntime.
+
+Export với dynamic=True để Detector có thể chạy nhiều imgsz / batch khác nhau
+trên cùng 1 file. Đường dẫn đích lấy từ app/config.py (PERSON_ONNX_MODEL_PATH,
+FACE_ONNX_MODEL_PATH).
+
+Ví dụ / Example:
+  python scripts/export_yolo_onnx.py
+  python scripts/check_yolo_parity.py --images dataset/frames
+  DETECTOR_BACKEND=onnxruntime python run_server.py
+"""
+
+from os import putenv
+putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
+putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
+
+import os
+import sys
+import shutil
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from ultralytics import YOLO
+from app.config import PERSON_MODEL_PATH, FACE_MODEL_PATH, PERSON_ONNX_MODEL_PATH, FACE_ONNX_MODEL_PATH
+
+
+def export(weights_path, output_path, imgsz, opset, dynamic):
+    model = YOLO(weights_path)
+    exported = model.export(format="onnx", imgsz=imgsz, opset=opset, dynamic=dynamic, simplify=True)
+    if os.path.abspath(exported) != os.path.abspath(output_path):
+        shutil.move(exported, output_path)
+    print(f"✔️ {weights_path} -> {output_path} ({os.path.getsize(output_path) / 2**20:.2f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export YOLO người / khuôn mặt sang ONNX")
+    parser.add_argument("--models", default="person,face", help="person, face hoặc cả hai")
+    parser.add_argument("--opset", type=int, default=12)
+    parser.add_argument("--static", action="store_true", help="Export shape cố định (không dynamic)")
+    parser.add_argument("--person-imgsz", type=int, default=640)
+    parser.add_argument("--face-imgsz", type=int, default=160)
+    args = parser.parse_args()
+
+    os.chdir(ROOT_DIR)
+    names = [n.strip() for n in args.models.split(",")]
+    if "person" in names:
+        export(PERSON_MODEL_PATH, PERSON_ONNX_MODEL_PATH, args.person_imgsz, args.opset, not args.static)
+    if "face" in names:
+        export(FACE_MODEL_PATH, FACE_ONNX_MODEL_PATH, args.face_imgsz, args.opset, not args.static)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+ingest_gallery.py - Nạp gallery khuôn mặt (nhiều người, nhiều ảnh) vào collection faces
+High-throughput gallery ingestion (replaces mongo_upload_multiple.py).
+
+Pipeline:
+  đọc + decode ảnh bằng nhiều thread
+  -> nhận diện khuôn mặt bằng backend YOLO production (DETECTOR_BACKEND), lấy mặt rõ nhất
+  -> embedding theo batch (mô hình TFLite production, app/embedder.py)
+  -> insert_many theo chunk ở thread ghi riêng
+Mỗi chunk ghi xong được thêm vào file checkpoint; chạy lại sẽ bỏ qua ảnh đã nạp.
+Index unique (user_id, source) trong db_utils đảm bảo không bị trùng nếu dừng giữa chừng.
+
+Manifest (CSV có header hoặc JSONL), path là file ảnh hoặc thư mục, tương đối với thư mục manifest:
+  user_id,name,path
+  1,Do Hong Quan,photos/quan
+  2,Nguyen Thanh Tung,photos/tung/001.jpg
+
+Ví dụ / Examples:
+  python scripts/ingest_gallery.py --manifest gallery/manifest.csv
+  python scripts/ingest_gallery.py --image-dir test_imgs/Tung --user-id 2 --name "Nguyen Thanh Tung"
+  python scripts/ingest_gallery.py --manifest gallery/manifest.csv --mongo memory --no-detect
+"""
+
+from os import putenv
+putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
+putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
+
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+# ----------------- Manifest -----------------
+def _expand_path(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.lower().endswith(IMAGE_EXTS)]
+    return [path]
+
+
+def read_manifest(manifest_path):
+    """Đọc manifest CSV / JSONL -> list (user_id, name, đường dẫn ảnh tuyệt đối, source)."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, encoding="utf-8") as f:
+        if manifest_path.endswith((".jsonl", ".json")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for row in rows:
+        paths = row.get("paths") or [row["path"]]
+        for path in paths:
+            full = path if os.path.isabs(path) else os.path.join(base_dir, path)
+            for image_path in _expand_path(full):
+                source = os.path.relpath(image_path, base_dir).replace(os.sep, "/")
+                items.append((str(row["user_id"]), row["name"], image_path, source))
+    return items, base_dir
+
+
+def single_user_items(image_dir, user_id, name):
+    base_dir = os.path.abspath(image_dir)
+    return [(user_id, name, p, os.path.relpath(p, base_dir).replace(os.sep, "/"))
+            for p in _expand_path(base_dir)], base_dir
+
+
+# ----------------- Checkpoint -----------------
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def _checkpoint_key(user_id, source):
+    return f"{user_id}\t{source}"
+
+
+# ----------------- Pipeline stages -----------------
+def decode_stream(items, workers, prefetch):
+    """Decode ảnh bằng thread pool, giữ thứ tự, tối đa `prefetch` ảnh đang chờ / Bounded threaded decode."""
+    def decode(item):
+        start = time.perf_counter()
+        image = cv2.imread(item[2], cv2.IMREAD_COLOR)
+        return item, image, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(decode, item))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def batched(iterable, size):
+    batch = []
+    for x in iterable:
+        batch.append(x)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class InsertWriter(threading.Thread):
+    """
+    Thread ghi: gom document thành chunk, insert_many rồi ghi checkpoint (fsync).
+    Background writer so Mongo round-trips overlap with inference.
+    """
+
+    def __init__(self, db_utils, checkpoint_path, chunk_size):
+        super().__init__(daemon=True)
+        self.db_utils = db_utils
+        self.checkpoint_path = checkpoint_path
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=chunk_size * 4)
+        self.inserted = 0
+        self.insert_seconds = 0.0
+        self.error = None
+
+    def _flush(self, chunk, checkpoint):
+        start = time.perf_counter()
+        self.inserted += self.db_utils.insert_face_documents(chunk)
+        self.insert_seconds += time.perf_counter() - start
+        for doc in chunk:
+            checkpoint.write(_checkpoint_key(doc["user_id"], doc["source"]) + "\n")
+        checkpoint.flush()
+        os.fsync(checkpoint.fileno())
+
+    def run(self):
+        chunk = []
+        with open(self.checkpoint_path, "a", encoding="utf-8") as checkpoint:
+            while True:
+                doc = self.queue.get()
+                if doc is None:
+                    break
+                if self.error:
+                    continue  # xả queue để thread chính không bị chặn / keep draining
+                chunk.append(doc)
+                if len(chunk) >= self.chunk_size:
+                    try:
+                        self._flush(chunk, checkpoint)
+                    except Exception as e:
+                        self.error = e
+                    chunk = []
+            if chunk and not self.error:
+                try:
+                    self._flush(chunk, checkpoint)
+                except Exception as e:
+                    self.error = e
+
+    def put(self, doc):
+        if self.error:
+            raise RuntimeError(f"Ghi MongoDB lỗi: {self.error}")
+        self.queue.put(doc)
+
+
+def best_face_crops(face_model, images, imgsz, conf, iou):
+    """
+    Nhận diện khuôn mặt theo batch, trả về (crop, conf) mặt rõ nhất mỗi ảnh hoặc None.
+    Chạy trên cả ảnh gallery (không phải ROI người) nên dùng imgsz cỡ toàn khung hình.
+    """
+    results = face_model.predict_batch(images, conf=conf, iou=iou, imgsz=imgsz)
+    crops = []
+    for image, (boxes, confs) in zip(images, results):
+        if len(confs) == 0:
+            crops.append(None)
+            continue
+        best = int(np.argmax(confs))
+        x1, y1, x2, y2 = map(int, boxes[best])
+        crop = image[y1:y2, x1:x2] if x2 > x1 and y2 > y1 else None
+        crops.append((crop, float(confs[best])) if crop is not None and crop.size else None)
+    return crops
+
+
+def run_ingest(args, items, db_utils, checkpoint_path):
+    from app.config import EMBED_TFLITE_MODEL_PATH
+    from app.embedder import BatchEmbedder
+
+    done = load_checkpoint(checkpoint_path)
+    todo = [it for it in items if _checkpoint_key(it[0], it[3]) not in done]
+    print(f"[Ingest] {len(items)} ảnh trong manifest, {len(items) - len(todo)} đã nạp trước đó, "
+          f"còn {len(todo)} ảnh")
+    if not todo:
+        return None
+
+    face_model = None
+    if not args.no_detect:
+        from app.detector_backends import create_detector_backend
+        face_model = create_detector_backend("face")
+    embedder = BatchEmbedder(batch_size=args.batch_size, num_threads=args.threads)
+    model_name = os.path.basename(EMBED_TFLITE_MODEL_PATH)
+    print(f"[Ingest] Embedding {model_name}: dim={embedder.dim}, batch={embedder.batch_size}")
+
+    writer = InsertWriter(db_utils, checkpoint_path, args.chunk_size)
+    writer.start()
+
+    counts = Counter()
+    timings = Counter()
+    started = last_report = time.perf_counter()
+    processed = 0
+    try:
+        for batch in batched(decode_stream(todo, args.workers, args.batch_size * 4), args.batch_size):
+            valid = []
+            for item, image, seconds in batch:
+                timings["decode"] += seconds
+                if image is None:
+                    counts["unreadable"] += 1
+                    print(f"[Ingest] ⚠️ Không đọc được ảnh: {item[2]}")
+                else:
+                    valid.append((item, image))
+            processed += len(batch)
+            if not valid:
+                continue
+
+            start = time.perf_counter()
+            if face_model is not None:
+                crops = best_face_crops(face_model, [img for _, img in valid], args.imgsz, args.conf, args.iou)
+            else:
+                crops = [(img, None) for _, img in valid]
+            timings["detect"] += time.perf_counter() - start
+
+            faces = []
+            for (item, _), crop in zip(valid, crops):
+                if crop is None:
+                    counts["no_face"] += 1
+                else:
+                    faces.append((item, crop))
+            if not faces:
+                continue
+
+            start = time.perf_counter()
+            embeddings = embedder.embed([crop for _, (crop, _) in faces])
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            timings["embed"] += time.perf_counter() - start
+
+            now = datetime.now(timezone.utc)
+            for ((user_id, name, _, source), (_, det_conf)), vec, norm in zip(faces, embeddings, norms):
+                if norm[0] == 0:
+                    counts["zero_embedding"] += 1
+                    continue
+                writer.put({
+                    "user_id": user_id,
+                    "name": name,
+                    "face_embedding": (vec / norm).astype(float).tolist(),
+                    "source": source,
+                    "embedding_model": model_name,
+                    "det_conf": det_conf,
+                    "created_at": now,
+                    "updated_at": now,
+                })
+                counts["embedded"] += 1
+
+            if time.perf_counter() - last_report >= args.report_every:
+                last_report = time.perf_counter()
+                rate = processed / (last_report - started)
+                print(f"[Ingest] {processed}/{len(todo)} ảnh, {rate:.1f} ảnh/s, đã ghi {writer.inserted}")
+    finally:
+        writer.queue.put(None)
+        writer.join()
+    if writer.error:
+        raise RuntimeError(f"Ghi MongoDB lỗi: {writer.error}")
+
+    elapsed = time.perf_counter() - started
+    timings["insert"] = writer.insert_seconds
+    return {
+        "images": processed,
+        "embedded": counts["embedded"],
+        "inserted": writer.inserted,
+        "skipped": {k: v for k, v in counts.items() if k != "embedded"},
+        "elapsed_s": round(elapsed, 2),
+        "images_per_s": round(processed / elapsed, 2) if elapsed else 0.0,
+        # decode cộng dồn trên các thread; các stage chạy chồng lên nhau nên tổng > elapsed
+        "stage_seconds": {k: round(v, 2) for k, v in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nạp gallery khuôn mặt vào MongoDB (collection faces)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV / JSONL: user_id, name, path (file hoặc thư mục ảnh)")
+    source.add_argument("--image-dir", help="Thư mục ảnh của 1 người (dùng với --user-id, --name)")
+    parser.add_argument("--user-id", help="user_id khi dùng --image-dir")
+    parser.add_argument("--name", help="Tên khi dùng --image-dir")
+    parser.add_argument("--checkpoint", help="File checkpoint (mặc định: <manifest / thư mục>.ingested)")
+    parser.add_argument("--workers", type=int, default=min(8, (os.cpu_count() or 1) * 2),
+                        help="Số thread decode ảnh")
+    parser.add_argument("--batch-size", type=int, default=16, help="Số ảnh mỗi batch nhận diện / embedding")
+    parser.add_argument("--threads", type=int, default=None, help="num_threads cho mô hình embedding TFLite")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Số document mỗi lần insert_many")
+    parser.add_argument("--no-detect", action="store_true", help="Ảnh đã là crop khuôn mặt, bỏ qua YOLO")
+    parser.add_argument("--imgsz", type=int, default=640,
+                        help="imgsz YOLO khuôn mặt trên cả ảnh gallery (mặc định 640 như YOLO người)")
+    parser.add_argument("--conf", type=float, default=0.3)
+    parser.add_argument("--iou", type=float, default=0.45)
+    parser.add_argument("--mongo", default=None, help="URI Mongo (mặc định MONGODB_URI) hoặc 'memory'")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Giây giữa các dòng tiến độ")
+    parser.add_argument("--json", help="Ghi báo cáo throughput ra file JSON")
+    args = parser.parse_args()
+
+    if args.image_dir and not (args.user_id and args.name):
+        parser.error("--image-dir cần kèm --user-id và --name")
+
+    # Đường dẫn tương đối theo thư mục hiện tại, trước khi chdir về ROOT_DIR
+    if args.manifest:
+        items, _ = read_manifest(args.manifest)
+        checkpoint_path = args.checkpoint or f"{args.manifest}.ingested"
+    else:
+        items, _ = single_user_items(args.image_dir, args.user_id, args.name)
+        checkpoint_path = args.checkpoint or f"{os.path.abspath(args.image_dir).rstrip(os.sep)}.ingested"
+    checkpoint_path = os.path.abspath(checkpoint_path)
+    json_path = os.path.abspath(args.json) if args.json else None
+
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, ROOT_DIR)
+    if args.mongo == "memory":
+        import mongo_standin
+        mongo_standin.install()
+        os.environ["MONGODB_URI"] = "mongodb://standin"
+    elif args.mongo:
+        os.environ["MONGODB_URI"] = args.mongo
+    from backend import db_utils
+
+    report = run_ingest(args, items, db_utils, checkpoint_path)
+    if report is None:
+        print("[Ingest] Không còn ảnh nào cần nạp.")
+        return
+
+    print(f"\n✅ Hoàn tất: {report['images']} ảnh trong {report['elapsed_s']} s "
+          f"({report['images_per_s']} ảnh/s), ghi mới {report['inserted']} document")
+    if report["skipped"]:
+        print(f"Bỏ qua: {report['skipped']}")
+    print(f"Thời gian theo stage (s): {report['stage_seconds']}")
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+load_test.py - Sinh tải đồng thời cho backend Smart Locker
+Concurrent load generator for backend/main.py.
+
+Gửi đồng thời /process_frame, /store, /retrieve và /lockers/summary theo tỉ lệ
+cấu hình (--mix), dùng ảnh khuôn mặt tổng hợp (hoặc ảnh thật qua --images),
+rồi báo cáo p50/p95/p99, throughput và tỉ lệ lỗi cho từng endpoint.
+
+Hai chế độ / Two modes:
+  - --url https://host:port : bắn vào server đang chạy (Mongo do server cấu hình)
+  - --in-process            : chạy app ngay trong process này qua ASGI,
+                              với --mongo memory (mongomock) hoặc URI Mongo local
+
+Ví dụ / Examples:
+  python scripts/load_test.py --in-process --mongo memory --duration 60 --concurrency 16
+  python scripts/load_test.py --url https://localhost:8001 --insecure --mix process_frame=90,summary=10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+
+import cv2
+import numpy as np
+import httpx
+
+from bench_stats import summarize_latencies
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ("process_frame", "store", "retrieve", "summary")
+DEFAULT_MIX = "process_frame=80,summary=10,store=5,retrieve=5"
+
+
+# ----------------- Ảnh tổng hợp / Synthetic images -----------------
+def synthetic_face_frame(identity, variant, size=(640, 480)):
+    """
+    Vẽ 1 frame chân dung tổng hợp: nền, thân người và khuôn mặt.
+    Mỗi identity có màu da / tỉ lệ khuôn mặt riêng, variant thêm nhiễu và dịch chuyển nhẹ.
+    """
+    w, h = size
+    rng = np.random.RandomState(identity * 1000 + variant)
+    face_rng = np.random.RandomState(identity)
+
+    frame = np.empty((h, w, 3), dtype=np.uint8)
+    frame[:] = np.linspace(60, 190, h, dtype=np.uint8)[:, None, None]
+    frame[..., 0] = np.clip(frame[..., 0].astype(np.int16) + face_rng.randint(-40, 40), 0, 255)
+
+    cx = w // 2 + rng.randint(-w // 12, w // 12)
+    cy = int(h * 0.38) + rng.randint(-h // 20, h // 20)
+    face_w = int(w * face_rng.uniform(0.11, 0.15))
+    face_h = int(face_w * face_rng.uniform(1.25, 1.45))
+    skin = tuple(int(c) for c in face_rng.randint(90, 230, size=3))
+    shirt = tuple(int(c) for c in face_rng.randint(0, 255, size=3))
+
+    # Thân người / Torso
+    cv2.rectangle(frame, (cx - int(face_w * 2.2), cy + face_h), (cx + int(face_w * 2.2), h), shirt, -1)
+    cv2.rectangle(frame, (cx - face_w // 3, cy + int(face_h * 0.8)), (cx + face_w // 3, cy + face_h + 4), skin, -1)
+    # Đầu / Head
+    cv2.ellipse(frame, (cx, cy), (face_w, face_h), 0, 0, 360, skin, -1)
+    cv2.ellipse(frame, (cx, cy - face_h // 2), (face_w, face_h // 2), 0, 180, 360, (30, 30, 30), -1)
+    # Mắt, mũi, miệng / Eyes, nose, mouth
+    eye_dx = int(face_w * face_rng.uniform(0.35, 0.5))
+    eye_y = cy - face_h // 8
+    for ex in (cx - eye_dx, cx + eye_dx):
+        cv2.ellipse(frame, (ex, eye_y), (face_w // 6, face_h // 14), 0, 0, 360, (245, 245, 245), -1)
+        cv2.circle(frame, (ex, eye_y), max(2, face_w // 12), (40, 30, 20), -1)
+    cv2.line(frame, (cx, eye_y + face_h // 10), (cx, cy + face_h // 4), tuple(max(0, c - 40) for c in skin), 2)
+    cv2.ellipse(frame, (cx, cy + face_h // 2), (face_w // 3, face_h // 10), 0, 0, 180, (60, 40, 150), 3)
+
+    noise = rng.normal(0, 6, frame.shape)
+    frame = np.clip(frame.astype(np.float32) * rng.uniform(0.85, 1.15) + noise, 0, 255).astype(np.uint8)
+    return frame
+
+
+def encode_jpeg(frame, quality=80):
+    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Không encode được JPEG")
+    return buf.tobytes()
+
+
+def build_image_pool(num_identities, variants, images_dir=None):
+    """
+    Tạo trước ảnh JPEG cho từng identity (không tính thời gian encode vào tải).
+    Với --images, mỗi thư mục con là 1 identity.
+    """
+    pool = {}
+    if images_dir:
+        for idx, name in enumerate(sorted(os.listdir(images_dir))):
+            person_dir = os.path.join(images_dir, name)
+            if not os.path.isdir(person_dir):
+                continue
+            blobs = []
+            for filename in sorted(os.listdir(person_dir)):
+                if filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                    with open(os.path.join(person_dir, filename), "rb") as f:
+                        blobs.append(f.read())
+            if blobs:
+                pool[idx] = blobs
+        if not pool:
+            raise SystemExit(f"Không tìm thấy ảnh trong {images_dir}")
+        return pool
+
+    for identity in range(num_identities):
+        pool[identity] = [encode_jpeg(synthetic_face_frame(identity, v)) for v in range(variants)]
+    return pool
+
+
+# ----------------- Sinh tải / Load generation -----------------
+class LoadState:
+    """Trạng thái dùng chung giữa các worker / Shared state between workers."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.free_identities = list(pool.keys())
+        self.stored_identities = []
+        self.latencies = defaultdict(list)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self.shed = defaultdict(int)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+
+async def _do_request(client, endpoint, state, rng, store_frames):
+    """Gửi 1 request theo loại endpoint; trả về response."""
+    if endpoint == "summary":
+        return await client.get("/lockers/summary")
+
+    if endpoint == "process_frame":
+        identity = rng.choice(list(state.pool.keys()))
+        blob = rng.choice(state.pool[identity])
+        return await client.post("/process_frame", files={"file": ("frame.jpg", blob, "image/jpeg")})
+
+    if endpoint == "store":
+        if state.free_identities:
+            identity = state.free_identities.pop(rng.randrange(len(state.free_identities)))
+        else:
+            identity = rng.choice(list(state.pool.keys()))
+        blobs = state.pool[identity]
+        files = [("files", (f"frame{i}.jpg", rng.choice(blobs), "image/jpeg")) for i in range(store_frames)]
+        resp = await client.post("/store", files=files)
+        granted = resp.status_code == 200 and resp.json().get("status") == "granted"
+        (state.stored_identities if granted else state.free_identities).append(identity)
+        state.outcomes[endpoint]["granted" if granted else "denied"] += 1
+        return resp
+
+    # retrieve: ưu tiên identity đã gửi đồ để mô phỏng luồng thật
+    if state.stored_identities:
+        identity = state.stored_identities.pop(rng.randrange(len(state.stored_identities)))
+    else:
+        identity = rng.choice(list(state.pool.keys()))
+    blob = rng.choice(state.pool[identity])
+    resp = await client.post("/retrieve", files={"file": ("frame.jpg", blob, "image/jpeg")})
+    granted = resp.status_code == 200 and resp.json().get("status") == "granted"
+    if granted:
+        state.free_identities.append(identity)
+    elif identity not in state.free_identities:
+        state.stored_identities.append(identity)
+    state.outcomes[endpoint]["granted" if granted else "denied"] += 1
+    return resp
+
+
+async def _worker(client, state, names, weights, deadline, seed, store_frames):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            resp = await _do_request(client, endpoint, state, rng, store_frames)
+            state.status_codes[endpoint][resp.status_code] += 1
+            if resp.status_code == 503 and "retry-after" in resp.headers:
+                # Bị scheduler từ chối có chủ đích (preview quá tải), không phải lỗi
+                state.shed[endpoint] += 1
+            elif resp.status_code >= 500:
+                state.errors[endpoint] += 1
+        except Exception as e:
+            state.status_codes[endpoint][type(e).__name__] += 1
+            state.errors[endpoint] += 1
+        state.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Endpoint không hợp lệ trong --mix: {name} (chọn trong {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def build_in_process_app(mongo):
+    """
+    Import backend.main trong process hiện tại.
+    mongo = "memory" dùng mongomock (mongo_standin), hoặc một URI Mongo local.
+    """
+    if mongo == "memory":
+        import mongo_standin
+        mongo_standin.install()
+        os.environ["MONGODB_URI"] = "mongodb://standin"
+        os.environ.setdefault("MONGODB_DB_NAME", "loadtest_db")
+    elif mongo:
+        os.environ["MONGODB_URI"] = mongo
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, ROOT_DIR)
+    from backend.main import app
+    return app
+
+
+async def run_load(args):
+    mix = parse_mix(args.mix)
+    names, weights = list(mix.keys()), list(mix.values())
+    print(f"🖼️  Chuẩn bị ảnh ({'thư mục ' + args.images if args.images else 'tổng hợp'})...")
+    pool = build_image_pool(args.identities, args.variants, args.images)
+    state = LoadState(pool)
+
+    if args.in_process:
+        app = build_in_process_app(args.mongo)
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://loadtest"
+    else:
+        transport = None
+        base_url = args.url.rstrip("/")
+
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=timeout,
+                                 verify=not args.insecure) as client:
+        if args.lockers:
+            resp = await client.post("/init_lockers", params={"count": args.lockers})
+            print(f"🔐 /init_lockers -> {resp.status_code} {resp.text[:120]}")
+
+        if args.warmup > 0:
+            print(f"🔥 Warm-up {args.warmup}s...")
+            warm = LoadState(pool)
+            await asyncio.gather(*[
+                _worker(client, warm, ["process_frame"], [1], time.perf_counter() + args.warmup, 10_000 + i, 1)
+                for i in range(min(args.concurrency, 2))
+            ])
+
+        print(f"🚀 Chạy tải {args.duration}s, concurrency={args.concurrency}, mix={mix}")
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            _worker(client, state, names, weights, deadline, args.seed + i, args.store_frames)
+            for i in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+    return build_report(state, elapsed, args)
+
+
+def build_report(state, elapsed, args):
+    report = {
+        "duration_s": elapsed,
+        "concurrency": args.concurrency,
+        "target": "in-process" if args.in_process else args.url,
+        "mongo": args.mongo if args.in_process else "server-configured",
+        "endpoints": {},
+    }
+    total = 0
+    for endpoint in ENDPOINTS:
+        samples = state.latencies.get(endpoint, [])
+        if not samples:
+            continue
+        total += len(samples)
+        report["endpoints"][endpoint] = {
+            "latency": summarize_latencies(samples),
+            "throughput_rps": len(samples) / elapsed,
+            "error_rate": state.errors[endpoint] / len(samples),
+            "shed_rate": state.shed[endpoint] / len(samples),
+            "status_codes": {str(k): v for k, v in state.status_codes[endpoint].items()},
+            "outcomes": dict(state.outcomes.get(endpoint, {})),
+        }
+    report["total_requests"] = total
+    report["total_throughput_rps"] = total / elapsed if elapsed else 0.0
+    return report
+
+
+def print_report(report):
+    print(f"\n📊 Kết quả ({report['duration_s']:.1f}s, concurrency={report['concurrency']}, "
+          f"{report['total_throughput_rps']:.2f} req/s tổng)")
+    print(f"{'endpoint':<15} {'n':>7} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'err%':>7} {'shed%':>7}  status")
+    for endpoint, data in report["endpoints"].items():
+        lat = data["latency"]
+        codes = " ".join(f"{k}:{v}" for k, v in sorted(data["status_codes"].items()))
+        print(
+            f"{endpoint:<15} {lat['count']:>7} {data['throughput_rps']:>8.2f} {lat['p50_ms']:>9.1f} "
+            f"{lat['p95_ms']:>9.1f} {lat['p99_ms']:>9.1f} {data['error_rate'] * 100:>6.2f}% {data['shed_rate'] * 100:>6.2f}%  {codes}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test cho Smart Locker API")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="URL server đang chạy, ví dụ https://localhost:8001")
+    target.add_argument("--in-process", action="store_true", help="Chạy app trong process này (ASGI)")
+    parser.add_argument("--mongo", default="memory",
+                        help="Với --in-process: 'memory' (mongomock) hoặc URI Mongo local")
+    parser.add_argument("--duration", type=float, default=30.0, help="Thời gian chạy tải (giây)")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Thời gian warm-up (giây)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Số client đồng thời")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Tỉ lệ endpoint, mặc định {DEFAULT_MIX}")
+    parser.add_argument("--identities", type=int, default=50, help="Số khuôn mặt tổng hợp")
+    parser.add_argument("--variants", type=int, default=4, help="Số biến thể ảnh mỗi khuôn mặt")
+    parser.add_argument("--images", help="Thư mục ảnh thật, mỗi thư mục con = 1 người")
+    parser.add_argument("--store-frames", type=int, default=3, help="Số frame gửi kèm mỗi /store")
+    parser.add_argument("--lockers", type=int, default=0, help="Gọi /init_lockers với số tủ này trước khi chạy")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout mỗi request (giây)")
+    parser.add_argument("--insecure", action="store_true", help="Bỏ qua kiểm tra chứng chỉ SSL")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"💾 Đã ghi báo cáo vào {args.json}")
+
+
+if __name__ == "__main__":
+    main()
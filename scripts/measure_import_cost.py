@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+measure_import_cost.py - Đo thời gian import và RSS của đường phục vụ với từng TFLite provider
+Measures cold-start import time and resident memory of the serving path per TFLite provider.
+
+Mỗi cấu hình chạy trong 1 process mới (cold start), đo:
+  - import app.box_detector  (thời gian, RSS sau import)
+  - Detector()               (thời gian tải mô hình, RSS sau khi tải, peak RSS)
+  - tensorflow / torch có bị import hay không
+
+Ví dụ / Example:
+  python scripts/measure_import_cost.py --providers tensorflow,tflite_runtime --repeat 3
+  python scripts/measure_import_cost.py --providers tflite_runtime --backend onnxruntime --no-models
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Chạy trong process con / Runs inside the child process
+PROBE = r"""
+import json, resource, sys, time
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return None
+
+result = {"rss_start_mb": rss_mb()}
+t0 = time.perf_counter()
+import app.box_detector
+result["import_s"] = time.perf_counter() - t0
+result["rss_after_import_mb"] = rss_mb()
+from app.tflite_loader import PROVIDER
+result["provider"] = PROVIDER
+if LOAD_MODELS:
+    t0 = time.perf_counter()
+    app.box_detector.Detector()
+    result["load_models_s"] = time.perf_counter() - t0
+    result["rss_after_models_mb"] = rss_mb()
+result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+result["tensorflow_imported"] = "tensorflow" in sys.modules
+result["torch_imported"] = "torch" in sys.modules
+print("RESULT " + json.dumps(result))
+"""
+
+
+def run_probe(provider, backend, load_models):
+    env = dict(os.environ, TFLITE_PROVIDER=provider)
+    if backend:
+        env["DETECTOR_BACKEND"] = backend
+    code = PROBE.replace("LOAD_MODELS", str(load_models))
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, env=env, capture_output=True, text=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Probe thất bại với provider={provider}:\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo import time / RSS của đường phục vụ")
+    parser.add_argument("--providers", default="tensorflow,auto", help="Danh sách TFLITE_PROVIDER cần so sánh")
+    parser.add_argument("--backend", help="DETECTOR_BACKEND dùng khi đo (mặc định theo .env)")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi cấu hình (lấy median)")
+    parser.add_argument("--no-models", action="store_true", help="Chỉ đo import, không tạo Detector")
+    parser.add_argument("--json", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    report = {}
+    for provider in [p.strip() for p in args.providers.split(",") if p.strip()]:
+        runs = [run_probe(provider, args.backend, not args.no_models) for _ in range(args.repeat)]
+        summary = dict(runs[0])
+        for key in runs[0]:
+            values = [r[key] for r in runs if isinstance(r.get(key), (int, float)) and not isinstance(r[key], bool)]
+            if values:
+                summary[key] = sorted(values)[len(values) // 2]
+        report[provider] = summary
+
+    print(f"{'provider':<16} {'resolved':<15} {'import s':>9} {'models s':>9} {'RSS MB':>9} {'peak MB':>9}  tf    torch")
+    for provider, r in report.items():
+        rss = r.get("rss_after_models_mb", r["rss_after_import_mb"])
+        print(f"{provider:<16} {r['provider']:<15} {r['import_s']:>9.2f} {r.get('load_models_s', 0):>9.2f} "
+              f"{rss:>9.1f} {r['peak_rss_mb']:>9.1f}  {str(r['tensorflow_imported']):<5} {r['torch_imported']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
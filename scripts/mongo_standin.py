@@ -0,0 +1,110 @@
+"""
+mongo_standin.py - MongoDB giả lập trong bộ nhớ cho load test / benchmark
+In-memory MongoDB stand-in for load tests and benchmarks.
+
+Dựa trên mongomock, bổ sung phần mongomock chưa hỗ trợ: stage `$addFields`
+tính cosineSim bằng `$reduce` (pipeline của `db_utils.find_active_session_by_face`).
+Stage này được tính bằng NumPy, các stage còn lại ($match, $sort, $limit,
+$project) chạy như bình thường.
+
+Cách dùng / Usage:
+    import mongo_standin
+    mongo_standin.install()        # trước khi import backend.db_utils
+"""
+
+import numpy as np
+import mongomock
+import pymongo
+
+
+def _dot_product_field(stage):
+    """
+    Nếu stage là `$addFields` tính tích vô hướng bằng `$reduce` thì trả về
+    (tên field, tên field embedding, vector truy vấn), ngược lại trả về None.
+    """
+    fields = stage.get("$addFields")
+    if not isinstance(fields, dict) or len(fields) != 1:
+        return None
+    (name, expr), = fields.items()
+    if not isinstance(expr, dict) or "$reduce" not in expr:
+        return None
+    try:
+        mapped = expr["$reduce"]["input"]["$map"]
+        doc_ref, query_vec = [term["$arrayElemAt"][0] for term in mapped["in"]["$multiply"]]
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not isinstance(doc_ref, str) or not doc_ref.startswith("$"):
+        return None
+    return name, doc_ref[1:], np.asarray(query_vec, dtype=np.float32)
+
+
+def _apply_tail(docs, stages):
+    """Chạy các stage đơn giản sau stage tính điểm / Apply the simple trailing stages."""
+    for stage in stages:
+        (op, arg), = stage.items()
+        if op == "$sort":
+            for key, direction in reversed(list(arg.items())):
+                docs.sort(key=lambda d: d.get(key, float("-inf")), reverse=direction < 0)
+        elif op == "$limit":
+            docs = docs[:arg]
+        elif op == "$match":
+            docs = [d for d in docs if mongomock.filtering.filter_applies(arg, d)]
+        elif op == "$project":
+            keep = {k for k, v in arg.items() if v}
+            if "_id" not in arg:
+                keep.add("_id")
+            docs = [{k: v for k, v in d.items() if k in keep} for d in docs]
+        else:
+            raise NotImplementedError(f"Stand-in không hỗ trợ stage {op} sau $reduce")
+    return docs
+
+
+class StandInCollection(mongomock.Collection):
+    """Collection mongomock có hỗ trợ pipeline tính cosineSim."""
+
+    def aggregate(self, pipeline, session=None, **kwargs):
+        for i, stage in enumerate(pipeline):
+            spec = _dot_product_field(stage)
+            if spec is None:
+                continue
+            name, field, query_vec = spec
+            head = pipeline[:i]
+            docs = list(super().aggregate(head, session=session, **kwargs)) if head else list(self.find())
+            if docs:
+                matrix = np.asarray([d[field] for d in docs], dtype=np.float32)
+                scores = matrix @ query_vec
+                for doc, score in zip(docs, scores):
+                    doc[name] = float(score)
+            return iter(_apply_tail(docs, pipeline[i + 1:]))
+        return super().aggregate(pipeline, session=session, **kwargs)
+
+
+class StandInDatabase(mongomock.Database):
+    def get_collection(self, name, *args, **kwargs):
+        collection = super().get_collection(name, *args, **kwargs)
+        if not isinstance(collection, StandInCollection):
+            collection.__class__ = StandInCollection
+        return collection
+
+
+class StandInMongoClient(mongomock.MongoClient):
+    """MongoClient giả lập, bỏ qua URI và các tùy chọn kết nối."""
+
+    def __init__(self, host=None, *args, **kwargs):
+        kwargs.pop("event_listeners", None)  # mongomock không hỗ trợ listener của db_metrics
+        super().__init__(*args, **kwargs)
+
+    def get_database(self, name=None, *args, **kwargs):
+        db = super().get_database(name, *args, **kwargs)
+        if not isinstance(db, StandInDatabase):
+            db.__class__ = StandInDatabase
+        return db
+
+
+def install():
+    """
+    Thay `pymongo.MongoClient` bằng bản giả lập.
+    Phải gọi trước khi import `backend.db_utils`.
+    """
+    pymongo.MongoClient = StandInMongoClient
+    return StandInMongoClient
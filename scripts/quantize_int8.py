@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+quantize_int8.py - Lượng tử hóa full-integer INT8 cho mô hình emotion / action / embedding
+Full-integer INT8 TFLite conversion with a calibration set and an accuracy/latency report.
+
+Khác với convert_embed_model.py / tflite_convert.py (chỉ Optimize.DEFAULT / fp16 và
+còn cho phép SELECT_TF_OPS), script này:
+  1. Lấy representative dataset từ crop thật (--calib-faces, --calib-persons),
+     tiền xử lý giống hệt Detector (resize, grayscale nếu cần, /255).
+  2. Convert với TFLITE_BUILTINS_INT8, input uint8 (Detector tự lượng tử hóa theo
+     scale/zero_point khi load).
+  3. So sánh với bản float TFLite đang dùng: kích thước, độ trễ p50/p95, và độ lệch
+     kết quả (top-1 agreement / accuracy cho classifier, cosine cho embedding).
+
+Ví dụ / Example:
+  python scripts/quantize_int8.py --models emotion,embedding \\
+      --calib-faces dataset/crops/faces --eval-faces dataset/crops/faces_eval \\
+      --report models/int8_report.json
+
+Dùng bản INT8 khi chạy server:
+  EMOTION_MODEL_PATH=models/emotion_model_2_int8.tflite python run_server.py
+"""
+
+from os import putenv
+putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
+putenv("ROCM_PATH", "/opt/rocm-6.3.0")
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+import cv2
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers, Model
+
+from bench_stats import summarize_latencies
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+# Mô hình float gốc (Keras) và bản TFLite float đang chạy production
+MODEL_SPECS = {
+    "emotion": {
+        "keras": "models/emotion_model_2.h5",
+        "float_tflite": "models/emotion_model_2.tflite",
+        "output": "models/emotion_model_2_int8.tflite",
+        "crops": "faces",
+        "kind": "classifier",
+    },
+    "action": {
+        "keras": "models/human_action_recognition_model.h5",
+        "float_tflite": "models/human_action_recognition_model.tflite",
+        "output": "models/human_action_recognition_model_int8.tflite",
+        "crops": "persons",
+        "kind": "classifier",
+    },
+    "embedding": {
+        "keras": "models/face_embedding_model_256.h5",
+        "float_tflite": "models/face_embedding_model_256.tflite",
+        "output": "models/face_embedding_model_256_int8.tflite",
+        "crops": "faces",
+        "kind": "embedding",
+    },
+}
+
+
+def build_embedding_model(input_shape=(160, 160, 3), embedding_dim=256):
+    """Kiến trúc embedding 256 (file .h5 chỉ chứa weights)."""
+    inputs = layers.Input(shape=input_shape)
+
+    x = layers.Conv2D(32, 3, activation='relu', padding='same')(inputs)
+    x = layers.BatchNormalization()(x)
+    x = layers.MaxPooling2D()(x)
+
+    x = layers.Conv2D(64, 3, activation='relu', padding='same')(inputs)
+    x = layers.BatchNormalization()(x)
+    x = layers.MaxPooling2D()(x)
+
+    x = layers.Conv2D(128, 3, activation='relu', padding='same')(x)
+    x = layers.BatchNormalization()(x)
+    x = layers.MaxPooling2D()(x)
+
+    x = layers.Conv2D(128, 3, activation='relu', padding='same')(x)
+    x = layers.BatchNormalization()(x)
+    x = layers.MaxPooling2D()(x)
+
+    x = layers.Conv2D(256, 3, activation='relu', padding='same')(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dropout(0.2)(x)
+
+    embeddings = layers.Dense(embedding_dim, activation=None, name='embeddings')(x)
+    embeddings = layers.Lambda(lambda t: tf.math.l2_normalize(t, axis=1))(embeddings)
+    return Model(inputs, embeddings, name='embedding_model')
+
+
+def load_keras_model(name, path):
+    if name == "embedding":
+        model = build_embedding_model()
+        model.load_weights(path)
+        return model
+    return tf.keras.models.load_model(path, compile=False)
+
+
+# ----------------- Dữ liệu / Data -----------------
+def list_images(directory):
+    """Trả về [(path, label)] — label là tên thư mục con (None nếu ảnh nằm ngay gốc)."""
+    items = []
+    for dirpath, _, filenames in os.walk(directory):
+        rel = os.path.relpath(dirpath, directory)
+        label = None if rel == "." else rel.split(os.sep)[0]
+        items.extend((os.path.join(dirpath, f), label) for f in sorted(filenames) if f.lower().endswith(IMAGE_EXTS))
+    return items
+
+
+def preprocess(img, input_shape):
+    """
+    Tiền xử lý giống Detector: resize theo input, grayscale nếu 1 kênh, /255.
+    Same preprocessing as Detector (BGR, resize, optional grayscale, /255).
+    """
+    height, width, channels = int(input_shape[1]), int(input_shape[2]), int(input_shape[3])
+    if channels == 1:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img = cv2.resize(img, (width, height))
+    return img.astype(np.float32).reshape(1, height, width, channels) / 255.0
+
+
+def load_batch(items, input_shape):
+    tensors, labels = [], []
+    for path, label in items:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        tensors.append(preprocess(img, input_shape))
+        labels.append(label)
+    return tensors, labels
+
+
+# ----------------- Convert -----------------
+def convert_int8(model, calib_tensors, float_output):
+    """Convert full-integer INT8 với representative dataset từ crop thật."""
+    def representative_dataset():
+        for tensor in calib_tensors:
+            yield [tensor]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    # Chỉ op INT8 built-in, không fallback float / SELECT_TF_OPS
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.float32 if float_output else tf.uint8
+    return converter.convert()
+
+
+# ----------------- Đánh giá / Evaluation -----------------
+class TFLiteRunner:
+    """Chạy 1 mô hình TFLite với input float [0,1], tự lượng tử hóa / giải lượng tử."""
+
+    def __init__(self, model_path, num_threads):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def _quantize(self, x):
+        if self.input['dtype'] in (np.uint8, np.int8):
+            scale, zero_point = self.input['quantization']
+            info = np.iinfo(self.input['dtype'])
+            return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(self.input['dtype'])
+        return x.astype(self.input['dtype'])
+
+    def __call__(self, x):
+        self.interpreter.set_tensor(self.input['index'], self._quantize(x))
+        self.interpreter.invoke()
+        out = self.interpreter.get_tensor(self.output['index'])[0]
+        if self.output['dtype'] in (np.uint8, np.int8):
+            scale, zero_point = self.output['quantization']
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+
+def measure_latency(runner, tensors, warmup=10, iterations=200):
+    for i in range(warmup):
+        runner(tensors[i % len(tensors)])
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        runner(tensors[i % len(tensors)])
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize_latencies(samples)
+
+
+def compare_outputs(kind, float_outs, int8_outs, labels, class_names):
+    """Độ lệch INT8 so với float / INT8 vs float output deltas."""
+    float_outs, int8_outs = np.stack(float_outs), np.stack(int8_outs)
+    if kind == "embedding":
+        a = float_outs / np.linalg.norm(float_outs, axis=1, keepdims=True)
+        b = int8_outs / np.linalg.norm(int8_outs, axis=1, keepdims=True)
+        cos = np.sum(a * b, axis=1)
+        return {"cosine_mean": float(cos.mean()), "cosine_min": float(cos.min()),
+                "cosine_p05": float(np.percentile(cos, 5))}
+
+    float_top1, int8_top1 = float_outs.argmax(axis=1), int8_outs.argmax(axis=1)
+    result = {"top1_agreement": float(np.mean(float_top1 == int8_top1))}
+    # Thư mục con = nhãn (tên lớp hoặc chỉ số) / Sub-folder name is the label
+    if class_names and all(l is not None for l in labels):
+        lookup = {name: i for i, name in enumerate(class_names)}
+        truth = np.array([lookup.get(l, int(l) if l.isdigit() else -1) for l in labels])
+        if np.all(truth >= 0):
+            acc_float = float(np.mean(float_top1 == truth))
+            acc_int8 = float(np.mean(int8_top1 == truth))
+            result.update({"accuracy_float": acc_float, "accuracy_int8": acc_int8,
+                           "accuracy_delta": acc_int8 - acc_float})
+    return result
+
+
+def quantize_model(name, args, crops):
+    spec = MODEL_SPECS[name]
+    print(f"\n===== {name} =====")
+    model = load_keras_model(name, spec["keras"])
+    input_shape = model.input_shape
+
+    calib_items = crops[spec["crops"]]["calib"]
+    random.Random(0).shuffle(calib_items)
+    calib_tensors, _ = load_batch(calib_items[:args.calib_size], input_shape)
+    if not calib_tensors:
+        raise SystemExit(f"Không có ảnh calibration cho {name}")
+    print(f"📐 Calibration: {len(calib_tensors)} crop")
+
+    tflite_model = convert_int8(model, calib_tensors, float_output=spec["kind"] == "embedding")
+    output_path = spec["output"]
+    if args.output_dir:
+        output_path = os.path.join(args.output_dir, os.path.basename(spec["output"]))
+    with open(output_path, "wb") as f:
+        f.write(tflite_model)
+    print(f"✔️ INT8 model saved to '{output_path}'")
+
+    eval_items = crops[spec["crops"]]["eval"] or calib_items[args.calib_size:] or calib_items
+    eval_tensors, eval_labels = load_batch(eval_items[:args.eval_size], input_shape)
+
+    float_runner = TFLiteRunner(spec["float_tflite"], args.threads)
+    int8_runner = TFLiteRunner(output_path, args.threads)
+    float_outs = [float_runner(t) for t in eval_tensors]
+    int8_outs = [int8_runner(t) for t in eval_tensors]
+
+    if name == "emotion":
+        from app.config import EMOTION_LABELS as class_names
+    elif name == "action":
+        from app.config import ACTION_LABELS as class_names
+    else:
+        class_names = None
+
+    report = {
+        "float_model": spec["float_tflite"],
+        "int8_model": output_path,
+        "size_mb": {
+            "float": os.path.getsize(spec["float_tflite"]) / 2**20,
+            "int8": os.path.getsize(output_path) / 2**20,
+        },
+        "latency": {
+            "float": measure_latency(float_runner, eval_tensors),
+            "int8": measure_latency(int8_runner, eval_tensors),
+        },
+        "eval_samples": len(eval_tensors),
+        "quality": compare_outputs(spec["kind"], float_outs, int8_outs, eval_labels, class_names),
+    }
+    lat_f, lat_q = report["latency"]["float"]["p50_ms"], report["latency"]["int8"]["p50_ms"]
+    print(f"📦 Size: {report['size_mb']['float']:.2f} MB -> {report['size_mb']['int8']:.2f} MB")
+    print(f"⏱️  p50: {lat_f:.2f} ms -> {lat_q:.2f} ms ({lat_f / lat_q:.2f}x)")
+    print(f"🎯 Quality: {report['quality']}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-integer INT8 quantization + báo cáo accuracy/latency")
+    parser.add_argument("--models", default="emotion,action,embedding", help="Danh sách mô hình cần lượng tử hóa")
+    parser.add_argument("--calib-faces", help="Thư mục crop khuôn mặt thật cho calibration (emotion, embedding)")
+    parser.add_argument("--calib-persons", help="Thư mục crop người thật cho calibration (action)")
+    parser.add_argument("--eval-faces", help="Crop khuôn mặt để đánh giá; thư mục con = nhãn cảm xúc (tùy chọn)")
+    parser.add_argument("--eval-persons", help="Crop người để đánh giá; thư mục con = nhãn hành vi (tùy chọn)")
+    parser.add_argument("--calib-size", type=int, default=300, help="Số ảnh calibration tối đa")
+    parser.add_argument("--eval-size", type=int, default=500, help="Số ảnh đánh giá tối đa")
+    parser.add_argument("--threads", type=int, default=1, help="num_threads khi đo độ trễ")
+    parser.add_argument("--output-dir", help="Thư mục ghi model INT8 (mặc định: models/)")
+    parser.add_argument("--report", default="models/int8_report.json", help="File báo cáo JSON")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    names = [n.strip() for n in args.models.split(",") if n.strip()]
+    for name in names:
+        if name not in MODEL_SPECS:
+            parser.error(f"Mô hình không hỗ trợ: {name}")
+
+    crops = {
+        "faces": {"calib": list_images(args.calib_faces) if args.calib_faces else [],
+                  "eval": list_images(args.eval_faces) if args.eval_faces else []},
+        "persons": {"calib": list_images(args.calib_persons) if args.calib_persons else [],
+                    "eval": list_images(args.eval_persons) if args.eval_persons else []},
+    }
+    for name in names:
+        if not crops[MODEL_SPECS[name]["crops"]]["calib"]:
+            parser.error(f"{name} cần --calib-{MODEL_SPECS[name]['crops']}")
+
+    report = {name: quantize_model(name, args, crops) for name in names}
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Báo cáo đã ghi vào {args.report}")
+
+
+if __name__ == "__main__":
+    main()
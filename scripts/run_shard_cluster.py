@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+run_shard_cluster.py - Chạy thử tra cứu session scatter-gather với nhiều node shard cục bộ
+Local multi-process harness for backend/shard_node.py + backend/scatter_gather.py.
+
+- Khởi động --shards process uvicorn `backend.shard_node:app` (SHARD_SOURCE=empty, không cần Mongo).
+- Nạp --sessions session tổng hợp qua coordinator (mỗi session tới shard sở hữu tủ của nó).
+- Bắn --queries truy vấn đồng thời, so top-1 với quét chính xác toàn bộ, báo độ trễ / qps.
+- --kill-one: tắt shard 0 rồi chạy lại để xem kết quả thiếu shard (complete=False).
+
+Ví dụ / Examples:
+  python scripts/run_shard_cluster.py --shards 3 --sessions 30000 --queries 1000 --concurrency 32
+  python scripts/run_shard_cluster.py --shards 1 --sessions 30000     # so với 1 node
+  python scripts/run_shard_cluster.py --shards 4 --kill-one --timeout-ms 200
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+import numpy as np
+
+from bench_stats import summarize_latencies, format_row, TABLE_HEADER
+from benchmark_vector_query import synthetic_gallery, synthetic_queries
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from backend.scatter_gather import ShardCoordinator  # noqa: E402
+
+
+def start_shards(count, base_port):
+    procs, urls = [], []
+    for index in range(count):
+        port = base_port + index
+        env = dict(os.environ, SHARD_INDEX=str(index), SHARD_COUNT=str(count), SHARD_SOURCE="empty")
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.shard_node:app",
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            cwd=ROOT_DIR, env=env,
+        ))
+        urls.append(f"http://127.0.0.1:{port}")
+    deadline = time.time() + 30
+    for url in urls:
+        while True:
+            try:
+                if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.time() > deadline:
+                stop_shards(procs)
+                raise RuntimeError(f"Shard {url} không khởi động được")
+            time.sleep(0.2)
+    return procs, urls
+
+
+def stop_shards(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+async def seed(coordinator, gallery, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            ok = await coordinator.add_session(f"s{i}", f"L{i:06d}", gallery[i])
+            if not ok:
+                raise RuntimeError(f"Không nạp được session s{i}")
+
+    await asyncio.gather(*(one(i) for i in range(len(gallery))))
+
+
+async def run_queries(coordinator, queries, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies, results = [], [None] * len(queries)
+
+    async def one(i):
+        async with sem:
+            start = time.perf_counter()
+            results[i] = await coordinator.match(queries[i])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(len(queries))))
+    return latencies, results, len(queries) / (time.perf_counter() - start)
+
+
+def describe(name, latencies, results, qps, truth):
+    complete = sum(r["complete"] for r in results)
+    correct = sum(1 for r, t in zip(results, truth) if r["match"] and r["match"]["session_id"] == f"s{t}")
+    notes = f"đúng top-1 {correct}/{len(results)}, đủ shard {complete}/{len(results)}"
+    print(format_row(name, summarize_latencies(latencies), f"{qps:>9.1f}  {notes}"))
+
+
+async def main_async(args, urls, procs):
+    coordinator = ShardCoordinator(urls, timeout_ms=args.timeout_ms)
+    gallery, centers = synthetic_gallery(args.sessions, args.dim, args.noise)
+    queries = synthetic_queries(centers, args.queries, args.noise)
+    truth = np.argmax(queries @ gallery.T, axis=1)
+
+    start = time.perf_counter()
+    await seed(coordinator, gallery, args.concurrency)
+    sizes = [httpx.get(f"{url}/health").json()["sessions"] for url in urls]
+    print(f"🔄 Nạp {args.sessions} session trong {time.perf_counter() - start:.1f} s, theo shard: {sizes}")
+
+    # Warm-up kết nối keep-alive
+    await run_queries(coordinator, queries[:min(20, len(queries))], args.concurrency)
+
+    print(TABLE_HEADER + f" {'qps':>9}  ghi chú")
+    latencies, results, qps = await run_queries(coordinator, queries, args.concurrency)
+    describe(f"{len(urls)} shard", latencies, results, qps, truth)
+
+    if args.kill_one and len(procs) > 1:
+        procs[0].terminate()
+        procs[0].wait()
+        latencies, results, qps = await run_queries(coordinator, queries, args.concurrency)
+        describe(f"{len(urls)} shard, shard 0 tắt", latencies, results, qps, truth)
+    await coordinator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy thử scatter-gather trên nhiều shard cục bộ")
+    parser.add_argument("--shards", type=int, default=3, help="Số process shard")
+    parser.add_argument("--base-port", type=int, default=9100, help="Port shard đầu tiên")
+    parser.add_argument("--sessions", type=int, default=10000, help="Số session active tổng hợp")
+    parser.add_argument("--dim", type=int, default=256, help="Số chiều embedding")
+    parser.add_argument("--noise", type=float, default=0.35, help="Nhiễu quanh tâm mỗi danh tính")
+    parser.add_argument("--queries", type=int, default=500, help="Số truy vấn")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số truy vấn đồng thời")
+    parser.add_argument("--timeout-ms", type=float, default=300, help="Timeout mỗi shard")
+    parser.add_argument("--kill-one", action="store_true", help="Tắt shard 0 rồi chạy lại truy vấn")
+    args = parser.parse_args()
+
+    procs, urls = start_shards(args.shards, args.base_port)
+    try:
+        asyncio.run(main_async(args, urls, procs))
+    finally:
+        stop_shards(procs)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,45 @@
+#!/usr/bin/env python3
+"""
+video_extract.py - Cắt khuôn mặt từ nhiều video để làm dataset
+Parallel, batched face extraction from videos for dataset building.
+
+- Frame bị bỏ qua chỉ grab() (không decode màu / không copy); với bước nhảy lớn thì
+  seek thẳng theo timestamp (--sampling seek | auto).
+- Frame được lấy mẫu gom thành batch rồi chạy mô hình khuôn mặt 1 lần (predict_batch).
+- Nhiều video chạy song song trên process pool, mỗi process tải mô hình 1 lần.
+- Mỗi video ghi crop vào <output>/<tên video>/ (trùng tên ở thư mục khác thì thêm hash đường dẫn:
+  <tên video>-<8 ký tự sha1>/), cuối cùng in bảng tổng kết và ghi <output>/summary.json.
+
+Ví dụ / Examples:
+  python scripts/video_extract.py test_video/Khai.MOV
+  python scripts/video_extract.py lobby_footage/ --fps 1 --processes 4 --output faces
+  python scripts/video_extract.py a.mp4 b.mp4 --weights yolo8p-face/train4/weights/best.pt --conf 0.5
+"""
+
 from os import putenv
 putenv("HSA_OVERRIDE_GFX_VERSION", "10.3.0")
 putenv("ROCM_PATH", "/opt/rocm-6.3.0/")
 
-import cv2
 import os
-from ultralytics import YOLO
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing as mp
 
-model = YOLO("yolo8p-face/train4/weights/best.pt")
-video_path = "test_video/Khai.MOV"
+import cv2
+import numpy as np
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
 
-# Tạo đường dẫn output dựa trên tên video
-video_name = os.path.splitext(os.path.basename(video_path))[0]
-output_dir = os.path.join("faces", video_name)
-os.makedirs(output_dir, exist_ok=True)
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".m4v")
+# Bước nhảy (số frame) từ đó auto chuyển sang seek / frame step above which 'auto' seeks
+AUTO_SEEK_STEP = 30
 
-cap = cv2.VideoCapture(video_path)
-# Tính toán bước nhảy dựa trên FPS gốc
-original_fps = cap.get(cv2.CAP_PROP_FPS)
-desired_fps = 3
-step = max(1, int(original_fps // desired_fps))  # Ví dụ: 30 FPS -> step = 3
+_model = None  # mô hình của process worker / per-process detector
 
-# Xử lý xoay video
-rotation_code = int(cap.get(cv2.CAP_PROP_ORIENTATION_META))
 
 def rotate_frame(frame, code):
     if code == 90:
@@ -32,36 +50,203 @@ def rotate_frame(frame, code):
         return cv2.rotate(frame, cv2.ROTATE_90_COUNTERCLOCKWISE)
     return frame
 
-frame_count = 0
-processed_count = 0  # Đếm số frame đã xử lý
-
-while cap.isOpened():
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    # Chỉ xử lý frame khi thỏa điều kiện step
-    if frame_count % step == 0:
-        corrected_frame = rotate_frame(frame, rotation_code)
-        results = model.predict(corrected_frame, conf=0.5)
-        
-        max_conf = 0
-        best_box = None
-        
-        for box in results[0].boxes:
-            current_conf = box.conf[0].item()
-            if current_conf > max_conf:
-                max_conf = current_conf
-                best_box = box
-
-        if best_box:
-            x1, y1, x2, y2 = map(int, best_box.xyxy[0].tolist())
-            face_roi = corrected_frame[y1:y2, x1:x2]
-            save_path = os.path.join(output_dir, f"frame_{processed_count}_conf_{max_conf:.2f}.jpg")
-            cv2.imwrite(save_path, face_roi)
-            processed_count += 1  # Tăng counter cho output
-
-    frame_count += 1
-
-cap.release()
-print(f"Đã xử lý xong ở tốc độ ~{desired_fps}FPS!")
\ No newline at end of file
+
+def _init_worker(backend, weights, threads):
+    """Tải mô hình 1 lần cho mỗi process / Load the face model once per worker process."""
+    global _model
+    from app.detector_backends import UltralyticsBackend, OnnxRuntimeBackend
+    if backend == "onnxruntime":
+        _model = OnnxRuntimeBackend(weights, intra_op_threads=threads)
+    else:
+        _model = UltralyticsBackend(weights)
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+
+
+def sample_frames(cap, step, sampling, total_frames, fps):
+    """
+    Sinh (chỉ số frame, frame) cho các frame được lấy mẫu.
+    grab(): bỏ qua frame mà không decode / retrieve(); seek: nhảy theo timestamp.
+    """
+    use_seek = sampling == "seek" or (sampling == "auto" and step >= AUTO_SEEK_STEP and total_frames > 0)
+    if use_seek:
+        for index in range(0, total_frames, step):
+            cap.set(cv2.CAP_PROP_POS_MSEC, index * 1000.0 / fps)
+            ok, frame = cap.read()
+            if not ok:
+                return
+            yield index, frame
+        return
+
+    index = 0
+    while cap.grab():
+        if index % step == 0:
+            ok, frame = cap.retrieve()
+            if not ok:
+                return
+            yield index, frame
+        index += 1
+
+
+def _save_best_faces(batch, results, output_dir, margin):
+    saved = 0
+    for (index, frame), (boxes, confs) in zip(batch, results):
+        if len(confs) == 0:
+            continue
+        best = int(np.argmax(confs))
+        x1, y1, x2, y2 = boxes[best]
+        if margin:
+            pad_w, pad_h = (x2 - x1) * margin, (y2 - y1) * margin
+            x1, y1, x2, y2 = x1 - pad_w, y1 - pad_h, x2 + pad_w, y2 + pad_h
+        h, w = frame.shape[:2]
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(w, int(x2)), min(h, int(y2))
+        if x2 <= x1 or y2 <= y1:
+            continue
+        save_path = os.path.join(output_dir, f"frame_{index:06d}_conf_{float(confs[best]):.2f}.jpg")
+        cv2.imwrite(save_path, frame[y1:y2, x1:x2])
+        saved += 1
+    return saved
+
+
+def process_video(task):
+    """Xử lý 1 video trong process worker, trả về dòng tổng kết / Returns a per-video summary dict."""
+    video_path, dir_name, opts = task
+    output_dir = os.path.join(opts["output"], dir_name)
+    os.makedirs(output_dir, exist_ok=True)
+    summary = {"video": video_path, "output_dir": output_dir, "sampled": 0, "faces": 0}
+    start = time.perf_counter()
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            summary["error"] = "không mở được video"
+            return summary
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        rotation_code = int(cap.get(cv2.CAP_PROP_ORIENTATION_META))
+        step = max(1, int(round(fps / opts["fps"])))
+        summary.update(video_fps=round(fps, 2), frames=total_frames, step=step)
+
+        batch = []
+        for index, frame in sample_frames(cap, step, opts["sampling"], total_frames, fps):
+            batch.append((index, rotate_frame(frame, rotation_code)))
+            if len(batch) == opts["batch_size"]:
+                results = _model.predict_batch([f for _, f in batch], conf=opts["conf"], iou=opts["iou"],
+                                               imgsz=opts["imgsz"])
+                summary["faces"] += _save_best_faces(batch, results, output_dir, opts["margin"])
+                summary["sampled"] += len(batch)
+                batch = []
+        if batch:
+            results = _model.predict_batch([f for _, f in batch], conf=opts["conf"], iou=opts["iou"],
+                                           imgsz=opts["imgsz"])
+            summary["faces"] += _save_best_faces(batch, results, output_dir, opts["margin"])
+            summary["sampled"] += len(batch)
+    except Exception as e:
+        summary["error"] = str(e)
+    finally:
+        cap.release()
+
+    elapsed = time.perf_counter() - start
+    summary["seconds"] = round(elapsed, 2)
+    # Tốc độ so với thời lượng video / speed relative to real time
+    if summary.get("frames") and elapsed:
+        summary["realtime_x"] = round(summary["frames"] / summary["video_fps"] / elapsed, 2)
+    return summary
+
+
+def collect_videos(inputs):
+    videos = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                videos.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(VIDEO_EXTS))
+        else:
+            videos.append(path)
+    # Bỏ video bị liệt kê 2 lần (vd. cả file lẫn thư mục chứa nó)
+    return list(dict.fromkeys(os.path.abspath(v) for v in videos))
+
+
+def output_dir_names(videos):
+    """Tên thư mục con cho từng video; tên trùng (khác thư mục) thêm hash của đường dẫn."""
+    stems = [os.path.splitext(os.path.basename(v))[0] for v in videos]
+    counts = {stem: stems.count(stem) for stem in stems}
+    return [stem if counts[stem] == 1 else f"{stem}-{hashlib.sha1(v.encode('utf-8')).hexdigest()[:8]}"
+            for v, stem in zip(videos, stems)]
+
+
+def main():
+    from app.config import DETECTOR_BACKEND, FACE_MODEL_PATH, FACE_ONNX_MODEL_PATH
+
+    parser = argparse.ArgumentParser(description="Cắt khuôn mặt từ video (song song, theo batch)")
+    parser.add_argument("inputs", nargs="+", help="File video hoặc thư mục chứa video")
+    parser.add_argument("--output", default="faces", help="Thư mục output (mỗi video 1 thư mục con)")
+    parser.add_argument("--fps", type=float, default=3.0, help="Số frame lấy mẫu mỗi giây video")
+    parser.add_argument("--sampling", choices=["grab", "seek", "auto"], default="auto",
+                        help=f"grab: đọc tuần tự bỏ qua frame; seek: nhảy theo timestamp; "
+                             f"auto: seek khi bước >= {AUTO_SEEK_STEP} frame")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=1, help="Số process chạy song song")
+    parser.add_argument("--backend", choices=["ultralytics", "onnxruntime"], default=DETECTOR_BACKEND)
+    parser.add_argument("--weights", default=None, help="File .pt / .onnx (mặc định theo app/config.py)")
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--iou", type=float, default=0.45)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--margin", type=float, default=0.0, help="Nới khung mặt thêm tỉ lệ này mỗi phía")
+    args = parser.parse_args()
+
+    videos = collect_videos(args.inputs)
+    if not videos:
+        parser.error("Không tìm thấy video nào")
+    if args.weights:
+        weights = os.path.abspath(args.weights)
+    else:
+        weights = os.path.join(ROOT_DIR, FACE_ONNX_MODEL_PATH if args.backend == "onnxruntime" else FACE_MODEL_PATH)
+    output = os.path.abspath(args.output)
+    os.makedirs(output, exist_ok=True)
+    processes = max(1, min(args.processes, len(videos)))
+    # Chia core cho các process để tránh tranh chấp thread / split cores between workers
+    threads = max(1, (os.cpu_count() or 1) // processes) if processes > 1 else 0
+
+    opts = dict(output=output, fps=args.fps, sampling=args.sampling, batch_size=args.batch_size,
+                conf=args.conf, iou=args.iou, imgsz=args.imgsz, margin=args.margin)
+    tasks = [(video, name, opts) for video, name in zip(videos, output_dir_names(videos))]
+    print(f"🔄 {len(videos)} video, {processes} process, backend={args.backend}, {args.fps} fps lấy mẫu")
+
+    start = time.perf_counter()
+    summaries = []
+    if processes == 1:
+        _init_worker(args.backend, weights, threads)
+        results = map(process_video, tasks)
+    else:
+        pool = mp.Pool(processes, initializer=_init_worker, initargs=(args.backend, weights, threads))
+        results = pool.imap_unordered(process_video, tasks)
+    for summary in results:
+        summaries.append(summary)
+        status = f"lỗi: {summary['error']}" if "error" in summary else \
+            f"{summary['sampled']} frame -> {summary['faces']} mặt, {summary['seconds']} s " \
+            f"({summary.get('realtime_x', '?')}x realtime)"
+        print(f"[{len(summaries)}/{len(videos)}] {os.path.basename(summary['video'])}: {status}")
+    if processes > 1:
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    total = {
+        "videos": len(summaries),
+        "failed": sum(1 for s in summaries if "error" in s),
+        "sampled_frames": sum(s["sampled"] for s in summaries),
+        "faces": sum(s["faces"] for s in summaries),
+        "seconds": round(elapsed, 2),
+        "processes": processes,
+        "videos_detail": sorted(summaries, key=lambda s: s["video"]),
+    }
+    with open(os.path.join(output, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(total, f, indent=2, ensure_ascii=False)
+    print(f"\n✅ {total['videos']} video ({total['failed']} lỗi), {total['sampled_frames']} frame lấy mẫu, "
+          f"{total['faces']} khuôn mặt trong {total['seconds']} s -> {output}")
+
+
+if __name__ == "__main__":
+    main()